@@ -0,0 +1,201 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Buffered, asynchronous publishing of CloudWatch metrics
+
+Views record metrics through get_client().put_metric_data(), which has the
+same signature as the boto3 CloudWatch client but only adds the values to an
+in-process buffer.  Values are aggregated per namespace, metric name,
+dimensions, and unit into CloudWatch statistic sets and a background thread
+flushes the buffer to the configured sink every METRICS_FLUSH_INTERVAL
+seconds, in batches of up to 20 datums.
+
+The sink is selected with the METRICS_SINK setting:
+    cloudwatch - Publish to AWS CloudWatch
+    stub - Keep published batches in memory (for testing)
+"""
+
+from django.conf import settings
+
+from collections import defaultdict
+import atexit
+import os
+import threading
+
+import bossutils
+from bossutils.logger import BossLogger
+
+# Maximum number of datums CloudWatch accepts in a single PutMetricData call
+MAX_BATCH_SIZE = 20
+
+
+class CloudWatchSink(object):
+    """Sink that publishes metric data to AWS CloudWatch"""
+
+    def __init__(self):
+        self.client = None
+
+    def publish(self, namespace, metric_data):
+        """Publish a batch of metric data
+
+        Args:
+            namespace (str): CloudWatch namespace
+            metric_data (list[dict]): Up to MAX_BATCH_SIZE CloudWatch datums
+        """
+        if self.client is None:
+            session = bossutils.aws.get_session()
+            self.client = session.client('cloudwatch')
+
+        self.client.put_metric_data(Namespace=namespace, MetricData=metric_data)
+
+
+class StubSink(object):
+    """Sink that keeps published metric data in memory
+
+    Attributes:
+        published (list[tuple[str, list[dict]]]): (namespace, metric_data) for each published batch
+    """
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, namespace, metric_data):
+        """Record a batch of metric data
+
+        Args:
+            namespace (str): CloudWatch namespace
+            metric_data (list[dict]): Up to MAX_BATCH_SIZE CloudWatch datums
+        """
+        self.published.append((namespace, metric_data))
+
+
+SINKS = {
+    'cloudwatch': CloudWatchSink,
+    'stub': StubSink,
+}
+
+
+class MetricsBuffer(object):
+    """In-process buffer that aggregates metric data and flushes it from a background thread
+
+    Args:
+        sink (CloudWatchSink|StubSink): Where flushed metric data is published
+        interval (int|float): Number of seconds between flushes
+    """
+
+    def __init__(self, sink, interval):
+        self.sink = sink
+        self.interval = interval
+        self.log = BossLogger().logger
+
+        self.lock = threading.Lock()
+        self.stats = {}
+
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.pid = None
+
+    def put_metric_data(self, Namespace, MetricData):
+        """Add metric data to the buffer
+
+        Takes the same arguments as the boto3 CloudWatch client's put_metric_data(), but only supports datums
+        with a Value.
+
+        Args:
+            Namespace (str): CloudWatch namespace
+            MetricData (list[dict]): CloudWatch datums with MetricName, Dimensions, Value, and Unit
+        """
+        with self.lock:
+            for datum in MetricData:
+                dimensions = tuple((d['Name'], d['Value']) for d in datum.get('Dimensions', []))
+                key = (Namespace, datum['MetricName'], dimensions, datum.get('Unit', 'None'))
+                value = float(datum['Value'])
+
+                stats = self.stats.get(key)
+                if stats is None:
+                    self.stats[key] = {'SampleCount': 1.0, 'Sum': value, 'Minimum': value, 'Maximum': value}
+                else:
+                    stats['SampleCount'] += 1
+                    stats['Sum'] += value
+                    stats['Minimum'] = min(stats['Minimum'], value)
+                    stats['Maximum'] = max(stats['Maximum'], value)
+
+        self.start()
+
+    def flush(self):
+        """Publish all buffered metric data to the sink"""
+        with self.lock:
+            stats, self.stats = self.stats, {}
+
+        batches = defaultdict(list)
+        for (namespace, name, dimensions, unit), values in stats.items():
+            batches[namespace].append({
+                'MetricName': name,
+                'Dimensions': [{'Name': n, 'Value': v} for n, v in dimensions],
+                'StatisticValues': values,
+                'Unit': unit,
+            })
+
+        for namespace, metric_data in batches.items():
+            for i in range(0, len(metric_data), MAX_BATCH_SIZE):
+                try:
+                    self.sink.publish(namespace, metric_data[i:i + MAX_BATCH_SIZE])
+                except Exception:
+                    self.log.exception("Problem publishing {} metrics".format(namespace))
+
+    def start(self):
+        """Start the background flush thread, if it isn't running in this process
+
+        The process id is checked so that a buffer created before uwsgi forks its workers starts a thread in each
+        worker.
+        """
+        if self.pid == os.getpid():
+            return
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self.run, name='boss-metrics', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Stop the background flush thread and publish any remaining metric data"""
+        self.stop_event.set()
+        self.flush()
+
+    def run(self):
+        """Background thread loop"""
+        while not self.stop_event.wait(self.interval):
+            self.flush()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Get the process wide metrics buffer
+
+    Returns:
+        (MetricsBuffer)
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            sink = SINKS[settings.METRICS_SINK]()
+            _client = MetricsBuffer(sink, settings.METRICS_FLUSH_INTERVAL)
+            atexit.register(_client.stop)
+        return _client
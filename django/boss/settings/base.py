@@ -151,12 +151,141 @@ BOSS_VERSION = 'v1'
 # Maximum number of bytes in an uncompressed matrix supported by the Cutout Service
 CUTOUT_MAX_SIZE = 520 * 1048576
 
+# Maximum number of bytes in the decoded matrix of a post whose format is limited by its encoded size instead
+CUTOUT_MAX_DECODED_SIZE = 4 * CUTOUT_MAX_SIZE
+
+# Default (x, y, z) block size of compressed segmentation cutouts. Clients can override it with a media type
+# parameter (eg. application/compressed-segmentation;block_size=8,8,8)
+CUTOUT_SEGMENTATION_BLOCK_SIZE = (8, 8, 8)
+
+# Blosc settings used by the cutout service renderers, selected by channel datatype. Clients can override the codec,
+# compression level and shuffle with media type parameters (eg. application/blosc;codec=lz4;clevel=3;shuffle=byte)
+CUTOUT_BLOSC_SETTINGS = {
+    'default': {'codec': 'blosclz', 'clevel': 9, 'shuffle': 'byte'},
+    'uint8': {'codec': 'lz4', 'clevel': 5, 'shuffle': 'byte'},
+    'uint16': {'codec': 'lz4', 'clevel': 5, 'shuffle': 'byte'},
+    'uint32': {'codec': 'lz4', 'clevel': 5, 'shuffle': 'byte'},
+    'uint64': {'codec': 'lz4', 'clevel': 9, 'shuffle': 'byte'},
+}
+
+# Number of threads blosc uses to compress cutouts, set when the bossspatialdb app is loaded
+CUTOUT_BLOSC_NTHREADS = 4
+
+# Number of seconds the frame lengths of an indexed (version=2) chunked cutout are cached, so a download that is
+# resumed with a Range request within this time only reads the frames it needs
+CUTOUT_CHUNKED_INDEX_TTL = 24 * 60 * 60
+
+# Cutouts of at least CUTOUT_SHARD_MIN_SIZE bytes are split into shards of CUTOUT_SHARD_CUBOIDS (x, y, z) cuboids
+# that are read in parallel by up to CUTOUT_SHARD_WORKERS threads. Set CUTOUT_SHARD_WORKERS to 1 to disable.
+CUTOUT_SHARD_MIN_SIZE = 64 * 1048576
+CUTOUT_SHARD_CUBOIDS = (2, 2, 2)
+CUTOUT_SHARD_WORKERS = 8
+
+# Maximum number of bytes read at the base resolution to compute an on the fly (?on-the-fly=true) cutout
+CUTOUT_ON_THE_FLY_MAX_SIZE = 2 * 1024 * 1048576
+
+# Maximum number of boxes in a single bulk cutout request
+CUTOUT_BULK_MAX_BOXES = 4096
+
+# Cache-Control header of precomputed volume responses. Chunks also have an ETag that changes when the channel's
+# data does, so clients revalidate stale chunks without reading data that hasn't changed. Stacks that only serve
+# public data can use 'public, max-age=...' to let a caching proxy serve chunks.
+PRECOMPUTED_CACHE_CONTROL = 'private, max-age=3600'
+
+# Directory that cutout posts with ?async=true are spooled to until they are written. Must be on persistent
+# local storage that the web server can write to, so queued writes survive restarts
+CUTOUT_ASYNC_SPOOL_DIR = '/var/spool/boss'
+
+# Number of bytes that must stay free in the spool directory after spooling a post
+CUTOUT_ASYNC_MIN_FREE_BYTES = 1024 * 1048576
+
+# Number of seconds the status of an asynchronous cutout write is kept
+CUTOUT_ASYNC_JOB_TTL = 7 * 24 * 60 * 60
+
+# Number of seconds without progress before a process's queued writes stop blocking other writes to their channel
+CUTOUT_ASYNC_CHANNEL_SECONDS = 10 * 60
+
+# Number of seconds between checks for queued writes left by web server processes that are no longer running
+CUTOUT_ASYNC_RECOVER_SECONDS = 60
+
+# Where metrics recorded through boss.metrics are published ('cloudwatch' or 'stub') and how often, in seconds
+METRICS_SINK = 'cloudwatch'
+METRICS_FLUSH_INTERVAL = 60
+
+# Number of seconds the throttle limits read from Vault are cached before being refreshed
+THROTTLE_LIMITS_TTL = 300
+
+# Throttling backend
+#   metrics - Daily usage counters that are reset by an external process
+#   token_bucket - Continuously refilling token buckets
+THROTTLE_BACKEND = 'metrics'
+
+# Number of seconds over which a token bucket refills the whole throttle limit
+THROTTLE_BUCKET_WINDOW = 24 * 60 * 60
+
+# Fraction of the throttle limit a token bucket holds, which is the most that can be used in a burst
+THROTTLE_BUCKET_BURST = 0.1
+
+# Number of datamodel lookups each process keeps in memory, in front of the shared cache
+RESOURCE_CACHE_SIZE = 1024
+
+# Number of seconds datamodel lookups are kept in the shared cache
+RESOURCE_CACHE_TTL = 60 * 60
+
+# Number of resolved user permissions each process keeps in memory, in front of the shared cache
+PERMISSION_CACHE_SIZE = 4096
+
+# Number of seconds resolved user permissions are cached
+PERMISSION_CACHE_TTL = 60
+
+# Pillow encoder options used by the image and tile services
+TILE_PNG_SETTINGS = {'compress_level': 1, 'optimize': False}
+TILE_JPEG_SETTINGS = {'quality': 75, 'subsampling': 2, 'optimize': False}
+TILE_WEBP_SETTINGS = {'lossless': True, 'method': 0}
+
+# Offer lossless WebP tiles to clients that accept image/webp (requires Pillow built with WebP support)
+TILE_WEBP_ENABLED = True
+
+# Name of the Django cache used for rendered tiles
+TILE_CACHE = 'default'
+
+# Number of seconds rendered tiles are cached
+TILE_CACHE_TTL = 24 * 60 * 60
+
+# Maximum size, in bytes, of a rendered tile that will be cached
+TILE_CACHE_MAX_BYTES = 1048576
+
+# Number of seconds pre-rendered tiles are cached
+TILE_PRERENDER_TTL = 30 * 24 * 60 * 60
+
+# Number of seconds without progress before a tile pre-render job is assumed to have died and can be resumed
+TILE_PRERENDER_STALE_SECONDS = 10 * 60
+
+# Maximum number of tiles in a single batch tile request
+TILE_BATCH_MAX_TILES = 256
+
 # Maximum number of pixels that non-privileged users can ingest (200 x 200 x 200 cubes)
 INGEST_MAX_SIZE = (200 * 512) * (200 * 512) * (200 * 16)
 
 # Maximum number of pixels that non-privileged users can downsample (200 x 200 x 200 cubes)
 DOWNSAMPLE_MAX_SIZE = (200 * 512) * (200 * 512) * (200 * 16)
 
+# Downsample backend
+#   step_function - The downsample Step Function, one channel at a time
+#   local - A pool of processes in the web server
+DOWNSAMPLE_BACKEND = 'step_function'
+
+# Number of processes each local downsample uses and how many local downsamples can run at once
+DOWNSAMPLE_LOCAL_WORKERS = 4
+DOWNSAMPLE_LOCAL_MAX_RUNNING = 2
+
+# Python interpreter that runs the local downsample processes, None uses the one installed with the web server's
+# Python (under uWSGI, sys.executable is the uwsgi binary)
+DOWNSAMPLE_LOCAL_PYTHON = None
+
+# Number of seconds without progress before a local downsample is assumed to have died
+DOWNSAMPLE_LOCAL_STALE_SECONDS = 10 * 60
+
 # Allow all cross site origins
 CORS_ORIGIN_ALLOW_ALL = True
 
@@ -0,0 +1,82 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from boss.metrics import MetricsBuffer, StubSink, MAX_BATCH_SIZE
+
+
+def make_datum(name, value, user='user1', unit='Count'):
+    return {
+        'MetricName': name,
+        'Dimensions': [{'Name': 'User', 'Value': user}],
+        'Value': value,
+        'Unit': unit,
+    }
+
+
+class TestMetricsBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.sink = StubSink()
+        self.buffer = MetricsBuffer(self.sink, 60)
+        # Don't start the background thread, flush() is called directly
+        self.buffer.start = lambda: None
+
+    def test_aggregates_values(self):
+        self.buffer.put_metric_data(Namespace='BOSS/Cutout', MetricData=[make_datum('EgressCost', 10, unit='Bytes')])
+        self.buffer.put_metric_data(Namespace='BOSS/Cutout', MetricData=[make_datum('EgressCost', 30, unit='Bytes')])
+        self.buffer.flush()
+
+        self.assertEqual(len(self.sink.published), 1)
+        namespace, metric_data = self.sink.published[0]
+        self.assertEqual(namespace, 'BOSS/Cutout')
+        self.assertEqual(metric_data, [{
+            'MetricName': 'EgressCost',
+            'Dimensions': [{'Name': 'User', 'Value': 'user1'}],
+            'StatisticValues': {'SampleCount': 2.0, 'Sum': 40.0, 'Minimum': 10.0, 'Maximum': 30.0},
+            'Unit': 'Bytes',
+        }])
+
+    def test_separates_dimensions_and_namespaces(self):
+        self.buffer.put_metric_data(Namespace='BOSS/Tile', MetricData=[make_datum('InvokeCount', 1, user='a'),
+                                                                       make_datum('InvokeCount', 1, user='b')])
+        self.buffer.put_metric_data(Namespace='BOSS/Image', MetricData=[make_datum('InvokeCount', 1, user='a')])
+        self.buffer.flush()
+
+        published = dict(self.sink.published)
+        self.assertEqual(len(published['BOSS/Tile']), 2)
+        self.assertEqual(len(published['BOSS/Image']), 1)
+
+    def test_batches(self):
+        data = [make_datum('InvokeCount', 1, user=str(i)) for i in range(MAX_BATCH_SIZE * 2 + 1)]
+        self.buffer.put_metric_data(Namespace='BOSS/Tile', MetricData=data)
+        self.buffer.flush()
+
+        self.assertEqual([len(batch) for _, batch in self.sink.published], [MAX_BATCH_SIZE, MAX_BATCH_SIZE, 1])
+
+    def test_flush_empties_buffer(self):
+        self.buffer.put_metric_data(Namespace='BOSS/Tile', MetricData=[make_datum('InvokeCount', 1)])
+        self.buffer.flush()
+        self.buffer.flush()
+
+        self.assertEqual(len(self.sink.published), 1)
+
+    def test_sink_error_is_logged(self):
+        def publish(namespace, metric_data):
+            raise Exception("CloudWatch is unavailable")
+        self.sink.publish = publish
+
+        self.buffer.put_metric_data(Namespace='BOSS/Tile', MetricData=[make_datum('InvokeCount', 1)])
+        self.buffer.flush()
@@ -0,0 +1,119 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from unittest.mock import MagicMock, patch
+
+from django.test import override_settings
+
+from boss.throttling import parse_limit, MetricLimits, MetricLimitsCache, RedisTokenBucket
+
+LIMITS = {
+    'system': '10T',
+    'apis': {'cutout_egress': '1T'},
+    'users': {'bob': '5G'},
+    'groups': {'public': '1G', 'lab': '2G', 'admins': None},
+}
+
+
+def make_user(username, groups):
+    user = MagicMock()
+    user.username = username
+    user.groups.values_list.return_value = groups
+    return user
+
+
+class TestMetricLimits(unittest.TestCase):
+
+    def setUp(self):
+        self.limits = MetricLimits(LIMITS)
+
+    def test_parse_limit(self):
+        self.assertEqual(parse_limit('1.5K'), 1536)
+        self.assertEqual(parse_limit('2m'), 2 * 1024 * 1024)
+        self.assertIsNone(parse_limit(None))
+
+    def test_lookup_system(self):
+        self.assertEqual(self.limits.lookup_system(), parse_limit('10T'))
+
+    def test_lookup_api(self):
+        self.assertEqual(self.limits.lookup_api('cutout_egress'), parse_limit('1T'))
+        self.assertIsNone(self.limits.lookup_api('tile_egress'))
+
+    def test_lookup_user_specific(self):
+        user = make_user('bob', ['public'])
+        self.assertEqual(self.limits.lookup_user(user), parse_limit('5G'))
+        user.groups.values_list.assert_not_called()
+
+    def test_lookup_user_groups(self):
+        user = make_user('alice', ['public', 'lab', 'other'])
+        self.assertEqual(self.limits.lookup_user(user), parse_limit('2G'))
+
+    def test_lookup_user_unlimited_group(self):
+        user = make_user('carol', ['public', 'admins'])
+        self.assertIsNone(self.limits.lookup_user(user))
+
+    def test_lookup_user_no_groups(self):
+        user = make_user('dave', [])
+        self.assertIsNone(self.limits.lookup_user(user))
+
+    def test_lookup_user_memoized(self):
+        user = make_user('alice', ['public'])
+        self.limits.lookup_user(user)
+        self.limits.lookup_user(user)
+        self.assertEqual(user.groups.values_list.call_count, 1)
+
+
+class TestMetricLimitsCache(unittest.TestCase):
+
+    @patch('boss.throttling.MetricLimits')
+    def test_cached_within_ttl(self, mock_limits):
+        cache = MetricLimitsCache(300)
+        first = cache.get()
+        second = cache.get()
+        self.assertIs(first, second)
+        self.assertEqual(mock_limits.call_count, 1)
+
+    @patch('boss.throttling.MetricLimits')
+    def test_refresh_after_ttl(self, mock_limits):
+        cache = MetricLimitsCache(300)
+        stale = cache.get()
+        cache.loaded -= 301
+
+        # Run the refresh in the calling thread
+        with patch('boss.throttling.threading.Thread') as mock_thread:
+            mock_thread.side_effect = lambda target, daemon: MagicMock(start=target)
+            self.assertIs(cache.get(), stale)
+
+        self.assertEqual(mock_limits.call_count, 2)
+        self.assertIsNot(cache.get(), stale)
+        self.assertFalse(cache.refreshing)
+
+
+@override_settings(THROTTLE_BUCKET_WINDOW=1000, THROTTLE_BUCKET_BURST=0.5)
+class TestRedisTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        config = {'aws': {'cache-throttle': '', 'cache-throttle-db': '0'}}
+        with patch('boss.throttling.bossutils.configuration.BossConfig', return_value=config):
+            self.bucket = RedisTokenBucket()
+
+    def test_get_bucket(self):
+        self.assertEqual(self.bucket.get_bucket(2000), (2.0, 1000.0))
+
+    def test_get_bucket_unlimited(self):
+        self.assertEqual(self.bucket.get_bucket(None), (-1, -1))
+
+    def test_no_redis(self):
+        self.assertIsNone(self.bucket.check_and_add_cost(['bob', 'cutout', 'system'], [1, 1, 1], 100))
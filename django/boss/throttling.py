@@ -18,7 +18,10 @@ from django.utils.translation import ugettext_lazy as _
 from django.conf import settings as django_settings
 
 import json
+import threading
+import time
 import bossutils
+from bossutils.logger import BossLogger
 import redis
 import boto3
 
@@ -51,10 +54,54 @@ def parse_limit(val):
 
     return int(val) # Returning an int, as redis works with ints
 
+# Check all of the given metrics against their limits and, if none are over
+# their limit, add the cost to each of them. Evaluated atomically by Redis.
+#
+# KEYS - metric keys to check
+# ARGV[1] - cost to add to each metric
+# ARGV[2..n] - limit for each key, or -1 if the key has no limit
+#
+# Returns {index, current, limit} for the first metric over its limit (index is
+# 1 based) or {0, 0, 0} if the cost was added
+CHECK_AND_ADD_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[i + 1])
+    if limit >= 0 then
+        local current = tonumber(redis.call('GET', key) or '0')
+        if current > limit then
+            return {i, current, limit}
+        end
+    end
+end
+for i, key in ipairs(KEYS) do
+    if tonumber(ARGV[i + 1]) >= 0 then
+        redis.call('INCRBY', key, ARGV[1])
+    end
+end
+return {0, 0, 0}
+"""
+
+# Connection pools for the throttling Redis instance, keyed by (host, db)
+_connection_pools = {}
+
+
+def get_redis_connection(host, db):
+    """Get a Redis client that shares a process wide connection pool
+
+    Args:
+        host (str): Redis hostname
+        db (int|str): Redis database number
+
+    Returns:
+        redis.StrictRedis
+    """
+    key = (host, db)
+    if key not in _connection_pools:
+        _connection_pools[key] = redis.ConnectionPool(host=host, port=6379, db=db)
+    return redis.StrictRedis(connection_pool=_connection_pools[key])
+
+
 class RedisMetrics(object):
-    # NOTE: If there is no throttling redis instance the other methods don't do anything
-    # NOTE: External process will reset values to zero when the window expires
-    # {obj}_metric = current_cost_in_window
     """
     Object for interacting with a Redis instance storing metric data
 
@@ -67,9 +114,9 @@ class RedisMetrics(object):
     def __init__(self):
         boss_config = bossutils.configuration.BossConfig()
         if len(boss_config['aws']['cache-throttle']) > 0:
-            self.conn = redis.StrictRedis(boss_config['aws']['cache-throttle'],
-                                          6379,
-                                          boss_config['aws']['cache-throttle-db'])
+            self.conn = get_redis_connection(boss_config['aws']['cache-throttle'],
+                                             boss_config['aws']['cache-throttle-db'])
+            self.check_and_add_script = self.conn.register_script(CHECK_AND_ADD_SCRIPT)
         else:
             self.conn = None
 
@@ -109,20 +156,187 @@ class RedisMetrics(object):
         key = "{}_metric".format(obj)
         self.conn.incrby(key, int(val))
 
+    def check_and_add_cost(self, objs, limits, cost):
+        """Check the given objects against their limits and add the cost if none are over
+
+        All of the metrics are checked and incremented in a single atomic Redis call
+
+        NOTE: If there is no Redis instance this method doesn't do anything
+
+        Args:
+            objs (list[str]): Names of the objects to check
+            limits (list[int|None]): Metric limit for each object or None if the object is not limited
+            cost (float|int): Value by which to increase each object's metric value
+                              NOTE: Value will be convered into an integer
+
+        Returns:
+            None if the cost was added, otherwise a tuple of (index, current, limit, wait) for the first object that
+            is over its limit, where wait is always None as the metrics are reset externally
+        """
+        if self.conn is None:
+            return None
+
+        keys = ["{}_metric".format(obj) for obj in objs]
+        args = [int(cost)] + [-1 if limit is None else limit for limit in limits]
+        idx, current, limit = self.check_and_add_script(keys=keys, args=args)
+
+        if idx == 0:
+            return None
+        return idx - 1, current, limit, None
+
+# Token bucket version of CHECK_AND_ADD_SCRIPT. Each bucket is a hash of the
+# number of tokens (bytes) available and the time it was last updated. Buckets
+# refill continuously at their rate up to their capacity, so the cost of a call
+# can be paid as long as the bucket is not empty (it may go negative).
+#
+# KEYS - bucket keys to check
+# ARGV[1] - cost to remove from each bucket
+# ARGV[2] - current time, in seconds
+# ARGV[3..n] - pairs of (refill rate in tokens per second, capacity) for each
+#              key, or (-1, -1) if the key has no limit
+#
+# Returns {index, used, capacity, wait} for the first bucket that is empty
+# (index is 1 based, used is the number of tokens consumed from a full bucket,
+# and wait is the number of seconds until the bucket has tokens) or
+# {0, 0, 0, 0} if the cost was removed
+TOKEN_BUCKET_SCRIPT = """
+local cost = tonumber(ARGV[1])
+local now = tonumber(ARGV[2])
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 + 1])
+    local capacity = tonumber(ARGV[i * 2 + 2])
+    if rate >= 0 then
+        local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+        local available = tonumber(bucket[1]) or capacity
+        local ts = tonumber(bucket[2]) or now
+        available = math.min(capacity, available + math.max(0, now - ts) * rate)
+        if available <= 0 then
+            local wait = 1
+            if rate > 0 then
+                wait = math.ceil(-available / rate) + 1
+            end
+            return {i, math.floor(capacity - available), math.floor(capacity), wait}
+        end
+        tokens[i] = available
+    end
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 + 1])
+    if rate >= 0 then
+        local capacity = tonumber(ARGV[i * 2 + 2])
+        local available = tokens[i] - cost
+        redis.call('HMSET', key, 'tokens', tostring(available), 'ts', tostring(now))
+        -- Once the bucket has refilled the key is the same as a missing key
+        if rate > 0 then
+            redis.call('EXPIRE', key, math.ceil((capacity - available) / rate) + 1)
+        end
+    end
+end
+return {0, 0, 0, 0}
+"""
+
+
+class RedisTokenBucket(object):
+    """
+    Object for interacting with a Redis instance storing token buckets
+
+    Each object's limit is treated as the number of bytes that can be used per
+    django_settings.THROTTLE_BUCKET_WINDOW seconds. The bucket refills at
+    limit / window bytes per second and holds at most
+    limit * django_settings.THROTTLE_BUCKET_BURST bytes, which is the most that
+    can be used in a burst. Unlike RedisMetrics there is no external reset of
+    the usage at the end of each window.
+
+    NOTE: If there is no throttling Redis instance the methods don't do anything
+
+    Redis data format: {obj}_bucket = {'tokens': available_bytes, 'ts': last_update_time}
+    """
+
+    def __init__(self):
+        boss_config = bossutils.configuration.BossConfig()
+        if len(boss_config['aws']['cache-throttle']) > 0:
+            self.conn = get_redis_connection(boss_config['aws']['cache-throttle'],
+                                             boss_config['aws']['cache-throttle-db'])
+            self.check_and_add_script = self.conn.register_script(TOKEN_BUCKET_SCRIPT)
+        else:
+            self.conn = None
+
+        self.window = django_settings.THROTTLE_BUCKET_WINDOW
+        self.burst = django_settings.THROTTLE_BUCKET_BURST
+
+    def get_bucket(self, limit):
+        """Get the refill rate and capacity of the bucket for the given limit
+
+        Args:
+            limit (int|None): Metric limit for the object or None if the object is not limited
+
+        Returns:
+            tuple: (rate, capacity) or (-1, -1) if the object is not limited
+        """
+        if limit is None:
+            return -1, -1
+        return limit / self.window, limit * self.burst
+
+    def check_and_add_cost(self, objs, limits, cost):
+        """Check the given objects' buckets and remove the cost if none are empty
+
+        All of the buckets are checked and updated in a single atomic Redis call
+
+        NOTE: If there is no Redis instance this method doesn't do anything
+
+        Args:
+            objs (list[str]): Names of the objects to check
+            limits (list[int|None]): Metric limit for each object or None if the object is not limited
+            cost (float|int): Number of tokens to remove from each object's bucket
+                              NOTE: Value will be convered into an integer
+
+        Returns:
+            None if the cost was removed, otherwise a tuple of (index, used, capacity, wait) for the first object
+            whose bucket is empty, where wait is the number of seconds until the bucket has tokens again
+        """
+        if self.conn is None:
+            return None
+
+        keys = ["{}_bucket".format(obj) for obj in objs]
+        args = [int(cost), time.time()]
+        for limit in limits:
+            args.extend(self.get_bucket(limit))
+        idx, used, capacity, wait = self.check_and_add_script(keys=keys, args=args)
+
+        if idx == 0:
+            return None
+        return idx - 1, used, capacity, wait
+
+# Throttling backends that can be selected with django_settings.THROTTLE_BACKEND
+BACKENDS = {
+    'metrics': RedisMetrics,
+    'token_bucket': RedisTokenBucket,
+}
+
 class MetricLimits(object):
     """Object for reading metric limits from Vault
 
-    NOTE: Values are read once from Vault on initialization
+    NOTE: Values are read once from Vault on initialization and parsed into
+          numbers of bytes up front. Use get_metric_limits() to get a
+          process wide instance that is periodically refreshed.
+
+    Args:
+        data (optional[dict]): Limits to use instead of reading them from Vault
     """
-    def __init__(self):
-        vault = bossutils.vault.Vault()
-        data = vault.read('secret/endpoint/throttle', 'config')
-        data = json.loads(data)
+    def __init__(self, data=None):
+        if data is None:
+            vault = bossutils.vault.Vault()
+            data = vault.read('secret/endpoint/throttle', 'config')
+            data = json.loads(data)
+
+        self.system = parse_limit(data.get('system'))
+        self.apis = {api: parse_limit(limit) for api, limit in (data.get('apis') or {}).items()}
+        self.users = {user: parse_limit(limit) for user, limit in (data.get('users') or {}).items()}
+        self.groups = {group: parse_limit(limit) for group, limit in (data.get('groups') or {}).items()}
 
-        self.system = data.get('system')
-        self.apis = data.get('apis')
-        self.users = data.get('users')
-        self.groups = data.get('groups')
+        # Resolved limit for each user looked up, so the user's groups are only queried once per instance
+        self.user_limits = {}
 
     def lookup_system(self):
         """Return the current metric limit for the entire system
@@ -130,7 +344,7 @@ class MetricLimits(object):
         Returns:
             int or None
         """
-        return parse_limit(self.system)
+        return self.system
 
     def lookup_api(self, api):
         """Return the current metric limit for the given API
@@ -141,7 +355,7 @@ class MetricLimits(object):
         Returns:
             int or None
         """
-        return parse_limit(self.apis.get(api))
+        return self.apis.get(api)
 
     def lookup_user(self, user):
         """Return the current metric limit for the given user
@@ -156,46 +370,129 @@ class MetricLimits(object):
         Returns:
             int or None
         """
+        if user.username in self.user_limits:
+            return self.user_limits[user.username]
+
         # User specific settings will override any group based limits
         if user.username in self.users:
-            return parse_limit(self.users[user.username])
+            limit = self.users[user.username]
+        else:
+            # Find the largest limit for all groups the user is a member of
+            limits = [self.groups[name]
+                      for name in user.groups.values_list('name', flat=True)
+                      if name in self.groups]
 
-        # Find the largest limit for all groups the user is a member of
-        limits = [parse_limit(self.groups[group.name])
-                  for group in user.groups.all()
-                  if group.name in self.groups]
+            if None in limits or len(limits) == 0:
+                limit = None
+            else:
+                limit = max(limits)
 
-        if None in limits:
-            return None
-        else:
-            return max(limits)
+        self.user_limits[user.username] = limit
+        return limit
+
+
+class MetricLimitsCache(object):
+    """Process wide cache of the MetricLimits read from Vault
+
+    Once the cached limits are older than the TTL the next caller starts a
+    background refresh and keeps using the stale limits until the refresh
+    finishes, so requests never wait on Vault after the first read.
+
+    Args:
+        ttl (int|float): Number of seconds before the cached limits are refreshed
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.limits = None
+        self.loaded = 0
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+    def get(self):
+        """Get the cached limits, loading them if needed
+
+        Returns:
+            MetricLimits
+        """
+        if self.limits is None:
+            with self.lock:
+                if self.limits is None:
+                    self.limits = MetricLimits()
+                    self.loaded = time.time()
+            return self.limits
+
+        if time.time() - self.loaded > self.ttl:
+            with self.lock:
+                if not self.refreshing:
+                    self.refreshing = True
+                    threading.Thread(target=self.refresh, daemon=True).start()
+
+        return self.limits
+
+    def refresh(self):
+        """Reload the limits from Vault"""
+        try:
+            limits = MetricLimits()
+            with self.lock:
+                self.limits = limits
+                self.loaded = time.time()
+        except Exception:
+            BossLogger().logger.exception("Problem refreshing throttle limits from Vault")
+            # Keep using the current limits and wait another TTL before retrying
+            with self.lock:
+                self.loaded = time.time()
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+
+_limits_cache = None
+
+
+def get_metric_limits():
+    """Get the process wide metric limits
+
+    The limits are cached for django_settings.THROTTLE_LIMITS_TTL seconds
+
+    Returns:
+        MetricLimits
+    """
+    global _limits_cache
+    if _limits_cache is None:
+        _limits_cache = MetricLimitsCache(django_settings.THROTTLE_LIMITS_TTL)
+    return _limits_cache.get()
 
 class BossThrottle(object):
     """Object for checking if a given API call is throttled
 
-    NOTE: The check_* methods don't add the new cost before checking
-          if the current call is throttled, so as to still allow an API
-          call that will exceed the limit, in case the limit would
-          disallow most API calls
+    NOTE: The new cost is not added before checking if the current call
+          is throttled, so as to still allow an API call that will exceed
+          the limit, in case the limit would disallow most API calls
 
     Attributes:
         user_error_detail (str): Error message if the user is throttled
         api_error_detail (str): Error message if the API is throttled
         system_error_detail (str): Error message if the whole system is throttled
+        user_wait_detail (str): Error message if the user is throttled and the wait is known
+        api_wait_detail (str): Error message if the API is throttled and the wait is known
+        system_wait_detail (str): Error message if the whole system is throttled and the wait is known
     """
     user_error_detail = _("User is throttled. Expected available tomorrow.")
     api_error_detail = _("API is throttled. Expected available tomorrow.")
     system_error_detail = _("System is throttled. Expected available tomorrow.")
+    user_wait_detail = _("User is throttled.")
+    api_wait_detail = _("API is throttled.")
+    system_wait_detail = _("System is throttled.")
 
     def __init__(self):
-        self.data = RedisMetrics()
-        self.limits = MetricLimits()
+        self.data = BACKENDS[django_settings.THROTTLE_BACKEND]()
+        self.limits = get_metric_limits()
 
         boss_config = bossutils.configuration.BossConfig()
         self.topic = boss_config['aws']['prod_mailing_list']
         self.fqdn = boss_config['system']['fqdn']
 
-    def error(self, user=None, api=None, system=None, details=None):
+    def error(self, user=None, api=None, system=None, details=None, wait=None):
         """Method for notifying admins and raising a Throttle exception
 
         Notifications are send to the Production Mailing List SNS topic
@@ -206,18 +503,21 @@ class BossThrottle(object):
             system (optional[bool]): If the system is throttled
             details (dict): Information about the API call that will be included
                             in the notification to the administrators
+            wait (optional[int]): Number of seconds until the call will be allowed,
+                                  if known
 
         Raises:
             Throttle: Exception with generic information on why the call was throttled
         """
+        # When the wait is known Throttled appends it to the message
         if user:
-            ex_msg = self.user_error_detail
+            ex_msg = self.user_error_detail if wait is None else self.user_wait_detail
             sns_msg = "Throttling user '{}': {}".format(user, json.dumps(details))
         elif api:
-            ex_msg = self.api_error_detail
+            ex_msg = self.api_error_detail if wait is None else self.api_wait_detail
             sns_msg = "Throttling API '{}': {}".format(api, json.dumps(details))
         elif system:
-            ex_msg = self.system_error_detail
+            ex_msg = self.system_error_detail if wait is None else self.system_wait_detail
             sns_msg = "Throttling system: {}".format(json.dumps(details))
 
         client = boto3.client('sns')
@@ -225,12 +525,14 @@ class BossThrottle(object):
                        Subject = 'Boss Request Throttled',
                        Message = sns_msg)
 
-        raise Throttled(detail = ex_msg)
+        raise Throttled(wait = wait, detail = ex_msg)
 
     def check(self, api, user, cost):
         """Check to see if the given API call is throttled
 
-        This is the main BossThrottle method and will call the other check_* methods
+        The user, API, and system limits are all checked and, if none are
+        exceeded, the cost is added to each of their current metric values
+        in a single atomic call to the metric store
 
         Args:
             api (str): Name of the API call being made
@@ -240,91 +542,26 @@ class BossThrottle(object):
         Raises:
             Throttle: If the call is throttled
         """
-        details = {'api': api, 'user': user, 'cost': cost, 'fqdn': self.fqdn}
-
-        self.check_user(user, cost, details)
-        self.check_api(api, cost, details)
-        self.check_system(cost, details)
-
-    def check_user(self, user, cost, details):
-        """Check to see if the user is currently throttled
-
-        NOTE: This method will increment the current metric value by cost
-              if not throttled
+        details = {'api': api, 'user': user.username, 'cost': cost, 'fqdn': self.fqdn}
 
-        Args:
-            user (User): Django user making the request
-            cost (float|int): Cost of the API call being made
-            details (dict): General information about the call to be
-                            used when notifying administrators
+        objs = [user.username, api, 'system']
+        limits = [self.limits.lookup_user(user),
+                  self.limits.lookup_api(api),
+                  self.limits.lookup_system()]
 
-        Raises:
-            Throttle: If the user is throttled
-        """
-        current = self.data.get_metric(user.username)
-        max = self.limits.lookup_user(user)
-
-        if max is None:
-            return
-
-        if current > max:
-            details['current_metric'] = current
-            details['max_metric'] = max
-            self.error(user = user, details = details)
-
-        self.data.add_metric_cost(user.username, cost)
-
-    def check_api(self, api, cost, details):
-        """Check to see if the API is currently throttled
-
-        NOTE: This method will increment the current metric value by cost
-              if not throttled
-
-        Args:
-            api (str): Name of the API call being made
-            cost (float|int): Cost of the API call being made
-            details (dict): General information about the call to be
-                            used when notifying administrators
-
-        Raises:
-            Throttle: If the API is throttled
-        """
-        current = self.data.get_metric(api)
-        max = self.limits.lookup_api(api)
-
-        if max is None:
+        if all(limit is None for limit in limits):
             return
 
-        if current > max:
-            details['current_metric'] = current
-            details['max_metric'] = max
-            self.error(api = api, details = details)
-
-        self.data.add_metric_cost(api, cost)
-
-    def check_system(self, cost, details):
-        """Check to see if the System is currently throttled
-
-        NOTE: This method will increment the current metric value by cost
-              if not throttled
-
-        Args:
-            cost (float|int): Cost of the API call being made
-            details (dict): General information about the call to be
-                            used when notifying administrators
-
-        Raises:
-            Throttle: If the system is throttled
-        """
-        current = self.data.get_metric('system')
-        max = self.limits.lookup_system()
-
-        if max is None:
+        tripped = self.data.check_and_add_cost(objs, limits, cost)
+        if tripped is None:
             return
 
-        if current > max:
-            details['current_metric'] = current
-            details['max_metric'] = max
-            self.error(system = True, details = details)
-
-        self.data.add_metric_cost('system', cost)
+        idx, current, max, wait = tripped
+        details['current_metric'] = current
+        details['max_metric'] = max
+        if idx == 0:
+            self.error(user = user, details = details, wait = wait)
+        elif idx == 1:
+            self.error(api = api, details = details, wait = wait)
+        else:
+            self.error(system = True, details = details, wait = wait)
@@ -58,6 +58,7 @@ urlpatterns = [
     url(r'^v1/groups/', include('bosscore.urls.group-urls', namespace='v1')),
     url(r'^v1/cutout/', include('bossspatialdb.urls', namespace='v1')),
     url(r'^v1/downsample/', include('bossspatialdb.urls_downsample', namespace='v1')),
+    url(r'^v1/precomputed/', include('bossspatialdb.urls_precomputed', namespace='v1')),
     url(r'^v1/image/', include('bosstiles.image_urls', namespace='v1')),
     url(r'^v1/tile/', include('bosstiles.tile_urls', namespace='v1')),
     url(r'^v1/ingest/', include('bossingest.urls', namespace='v1')),
@@ -29,3 +29,18 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "boss.settings.production")
 
 application = get_wsgi_application()
+
+# Write the cutout posts queued by web server processes that are no longer running. uWSGI loads the application in
+# the master before forking its workers, unless lazy-apps is set, so the worker thread is started in each worker
+from bossspatialdb import writebehind
+
+try:
+    import uwsgi
+    from uwsgidecorators import postfork
+except ImportError:
+    writebehind.start()
+else:
+    if uwsgi.worker_id() == 0:
+        postfork(writebehind.start)
+    else:
+        writebehind.start()
@@ -17,3 +17,8 @@ from django.apps import AppConfig
 
 class BosscoreConfig(AppConfig):
     name = 'bosscore'
+
+    def ready(self):
+        from . import resource_cache, permissions
+        resource_cache.connect_signals()
+        permissions.connect_signals()
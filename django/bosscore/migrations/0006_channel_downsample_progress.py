@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bosscore', '0005_auto_20170414_1410'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='downsample_progress',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -218,6 +218,7 @@ class Channel(models.Model):
     )
     downsample_status = models.CharField(choices=DOWNSAMPLE_METHOD_CHOICES, default="NOT_DOWNSAMPLED", max_length=100)
     downsample_arn = models.CharField(max_length=4096, blank=True, null=True)
+    downsample_progress = models.IntegerField(default=0)
 
     class Meta:
         db_table = u"channel"
@@ -12,13 +12,52 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from django.conf import settings
 from django.contrib.auth.models import Group, User
 from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
 
+from guardian.models import UserObjectPermission, GroupObjectPermission
 from guardian.shortcuts import assign_perm, get_perms, remove_perm, get_perms_for_model
 from .error import BossHTTPError, ErrorCodes, BossError
+from .resource_cache import ResourceCache
 from bosscore.models import BossGroup
 
+_permission_cache = None
+
+
+def get_permission_cache():
+    """Get the process wide cache of resolved object permissions
+
+    Returns:
+        (ResourceCache)
+    """
+    global _permission_cache
+    if _permission_cache is None:
+        _permission_cache = ResourceCache(settings.PERMISSION_CACHE_SIZE, settings.PERMISSION_CACHE_TTL,
+                                          prefix='boss-permission-cache')
+    return _permission_cache
+
+
+def invalidate_permission_cache(sender=None, **kwargs):
+    """Invalidate all cached permissions, immediately and again once the current transaction commits
+
+    Also used as the signal handler for object permission and group membership changes
+    """
+    permission_cache = get_permission_cache()
+    permission_cache.invalidate()
+    transaction.on_commit(permission_cache.invalidate)
+
+
+def connect_signals():
+    """Invalidate the permission cache whenever object permissions or group memberships change"""
+    for model in (UserObjectPermission, GroupObjectPermission):
+        post_save.connect(invalidate_permission_cache, sender=model, dispatch_uid='permission_cache_save')
+        post_delete.connect(invalidate_permission_cache, sender=model, dispatch_uid='permission_cache_delete')
+    m2m_changed.connect(invalidate_permission_cache, sender=User.groups.through,
+                        dispatch_uid='permission_cache_groups')
+
 def check_is_member_or_maintainer(user, group_name):
     """
     Check if a user is a member or maintainer of the a group
@@ -42,6 +81,33 @@ def check_is_member_or_maintainer(user, group_name):
 
 class BossPermissionManager:
 
+    @staticmethod
+    def get_user_perms(user, obj):
+        """
+        Get the permissions a user has on an object, including the permissions of the user's groups
+
+        The result is cached for PERMISSION_CACHE_TTL seconds, or until object permissions or group memberships
+        change.
+        Args:
+            user: Current user
+            obj: Resource
+
+        Returns:
+            List of permissions
+
+        """
+        if user.pk is None:
+            return get_perms(user, obj)
+
+        permission_cache = get_permission_cache()
+        generation = permission_cache.get_generation()
+        key = '{}:{}:{}'.format(user.pk, obj._meta.model_name, obj.pk)
+        perms = permission_cache.get(generation, key)
+        if perms is None:
+            perms = get_perms(user, obj)
+            permission_cache.set(generation, key, perms)
+        return perms
+
     @staticmethod
     def is_in_group(user, group_name):
         """
@@ -78,7 +144,7 @@ class BossPermissionManager:
             assign_perm('add_volumetric_data', user_primary_group, obj)
             assign_perm('read_volumetric_data', user_primary_group, obj)
             assign_perm('delete_volumetric_data', user_primary_group, obj)
-
+        invalidate_permission_cache()
 
 
     @staticmethod
@@ -104,6 +170,7 @@ class BossPermissionManager:
         group = Group.objects.get(name=group_name)
         for perm in perm_list:
             assign_perm(perm, group, obj)
+        invalidate_permission_cache()
 
     @staticmethod
     def get_permissions_group(group_name, obj):
@@ -137,6 +204,7 @@ class BossPermissionManager:
         group = Group.objects.get(name=group_name)
         for perm in perm_list:
             remove_perm(perm, group, obj)
+        invalidate_permission_cache()
 
     @staticmethod
     def delete_all_permissions_group(group_name, obj):
@@ -155,6 +223,7 @@ class BossPermissionManager:
         perm_list = get_perms(group, obj)
         for perm in perm_list:
             remove_perm(perm, group, obj)
+        invalidate_permission_cache()
 
     @staticmethod
     def add_permissions_admin_group(obj):
@@ -185,6 +254,7 @@ class BossPermissionManager:
                 assign_perm('add_volumetric_data', admin_group, obj)
                 assign_perm('read_volumetric_data', admin_group, obj)
                 assign_perm('delete_volumetric_data', admin_group, obj)
+            invalidate_permission_cache()
 
         except Group.DoesNotExist:
             raise BossError("Cannot assign permissions to the admin group because the group does not exist",
@@ -214,7 +284,7 @@ class BossPermissionManager:
         else:
             raise BossError("Unable to get permissions for this request", ErrorCodes.INVALID_POST_ARGUMENT)
 
-        if permission in get_perms(user, obj):
+        if permission in BossPermissionManager.get_user_perms(user, obj):
             return True
         else:
             return False
@@ -241,7 +311,7 @@ class BossPermissionManager:
         else:
             raise BossError("Unable to get permissions for this request", ErrorCodes.INVALID_POST_ARGUMENT)
 
-        if permission in get_perms(user, obj):
+        if permission in BossPermissionManager.get_user_perms(user, obj):
             return True
         else:
             return False
@@ -264,7 +334,7 @@ class BossPermissionManager:
         else:
             raise BossError("Invalid method type. This query only supports a GET", ErrorCodes.INVALID_POST_ARGUMENT)
 
-        if permission in get_perms(user, obj):
+        if permission in BossPermissionManager.get_user_perms(user, obj):
             return True
         else:
             return False
\ No newline at end of file
@@ -15,8 +15,7 @@
 import re
 import numpy as np
 
-from .models import Collection, Experiment, Channel
-from .lookup import LookUpKey
+from .resolver import get_resolver
 from .error import BossHTTPError, BossError, ErrorCodes, BossRestArgsError
 from .permissions import BossPermissionManager
 
@@ -40,6 +39,9 @@ class BossRequest:
         """
         self.bossrequest = bossrequest
 
+        # Datamodel lookups shared by everything handling the same request
+        self.resolver = get_resolver(request)
+
         # Datamodel objects
         self.collection = None
         self.experiment = None
@@ -75,7 +77,8 @@ class BossRequest:
 
         # Request variables
         self.user = request.user
-        self.method = request.method
+        # Services that read data through a POST (eg. batch tiles) check permissions as another method
+        self.method = self.bossrequest.get('method', request.method)
         self.version = request.version
 
         # object service
@@ -336,6 +339,7 @@ class BossRequest:
 
         """
         if collection_name:
+            self.resolver.prefetch(collection_name, experiment_name, channel_name)
             colstatus = self.set_collection(collection_name)
             if experiment_name and colstatus:
                 expstatus = self.set_experiment(experiment_name)
@@ -542,8 +546,9 @@ class BossRequest:
         Raises : BossError is the collection is not found.
 
         """
-        if Collection.objects.filter(name=str(collection_name)).exists():
-            self.collection = Collection.objects.get(name=collection_name)
+        collection = self.resolver.get_collection(collection_name)
+        if collection is not None:
+            self.collection = collection
             if self.collection.to_be_deleted is not None:
                 raise BossError("Invalid Request. This resource {} has been marked for deletion"
                                 .format(collection_name),ErrorCodes.RESOURCE_MARKED_FOR_DELETION)
@@ -572,8 +577,9 @@ class BossRequest:
         Returns: BossError is the experiment with the matching name is not found in the db
 
         """
-        if Experiment.objects.filter(name=experiment_name, collection=self.collection).exists():
-            self.experiment = Experiment.objects.get(name=experiment_name, collection=self.collection)
+        experiment = self.resolver.get_experiment(self.collection, experiment_name)
+        if experiment is not None:
+            self.experiment = experiment
             if self.experiment.to_be_deleted is not None:
                 raise BossError("Invalid Request. This resource {} has been marked for deletion"
                                 .format(experiment_name),ErrorCodes.RESOURCE_MARKED_FOR_DELETION)
@@ -603,8 +609,9 @@ class BossRequest:
         Returns:
 
         """
-        if Channel.objects.filter(name=channel_name, experiment=self.experiment).exists():
-            self.channel = Channel.objects.get(name=channel_name, experiment=self.experiment)
+        channel = self.resolver.get_channel(self.experiment, channel_name)
+        if channel is not None:
+            self.channel = channel
             if self.channel.to_be_deleted is not None:
                 raise BossError("Invalid Request. This resource {} has been marked for deletion"
                                 .format(channel_name),ErrorCodes.RESOURCE_MARKED_FOR_DELETION)
@@ -794,7 +801,8 @@ class BossRequest:
         """
         if self.service == 'cutout' or self.service == 'image' or self.service == 'tile' or self.service == 'ids'\
                 or self.service == 'boundingbox' or self.service == 'downsample':
-            perm = BossPermissionManager.check_data_permissions(self.user, self.channel, self.method)
+            perm = self.resolver.check_permissions(BossPermissionManager.check_data_permissions,
+                                                   self.user, self.channel, self.method)
 
         elif self.service == 'meta':
             if self.collection and self.experiment and self.channel:
@@ -806,9 +814,11 @@ class BossRequest:
             else:
                 raise BossError("Error encountered while checking permissions for this request",
                                 ErrorCodes.UNABLE_TO_VALIDATE)
-            perm = BossPermissionManager.check_resource_permissions(self.user, obj, self.method)
+            perm = self.resolver.check_permissions(BossPermissionManager.check_resource_permissions,
+                                                   self.user, obj, self.method)
         elif self.service == 'reserve':
-            perm = BossPermissionManager.check_object_permissions(self.user, self.channel, self.method)
+            perm = self.resolver.check_permissions(BossPermissionManager.check_object_permissions,
+                                                   self.user, self.channel, self.method)
 
         if not perm:
             raise BossError("This user does not have the required permissions", ErrorCodes.MISSING_PERMISSION)
@@ -836,7 +846,7 @@ class BossRequest:
             lookup (str) : The base lookup key that correspond to the request
 
         """
-        return LookUpKey.get_lookup_key(self.base_boss_key).lookup_key
+        return self.resolver.get_lookup_key(self.base_boss_key)
 
     def set_time(self, time):
         """
@@ -0,0 +1,238 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Request scoped resolution of the datamodel resources used by a request
+
+A single ResourceResolver is attached to each request, so the parser and the
+view, which each create a BossRequest, share the datamodel objects, lookup
+keys, and permission checks that were already resolved for the request.
+Resources and lookup keys are also kept in the cross request resource cache.
+"""
+
+from .models import Collection, Experiment, Channel
+from .lookup import LookUpKey
+from .resource_cache import get_resource_cache, get_boss_key_prefixes, META_CONNECTOR
+
+# Name of the request attribute holding the request's ResourceResolver
+REQUEST_ATTRIBUTE = '_boss_resolver'
+
+
+def get_resolver(request):
+    """Get the ResourceResolver for a request, creating it if needed
+
+    Args:
+        request (Request): DRF or Django request
+
+    Returns:
+        (ResourceResolver)
+    """
+    resolver = getattr(request, REQUEST_ATTRIBUTE, None)
+    if resolver is None:
+        resolver = ResourceResolver()
+        setattr(request, REQUEST_ATTRIBUTE, resolver)
+    return resolver
+
+
+class ResourceResolver(object):
+    """Memoized lookups of the datamodel for the life of a request
+
+    Missing resources are memoized as None, so callers can raise their own
+    errors for them.
+    """
+
+    def __init__(self):
+        self.collections = {}
+        self.experiments = {}
+        self.channels = {}
+        self.lookup_keys = {}
+        self.permissions = {}
+
+        self.resource_cache = get_resource_cache()
+        self.generations = {}
+
+    def get_generation(self, *keys):
+        """Get a resource cache generation, read once per request so every lookup sees the same generation
+
+        Args:
+            *keys (str): Boss keys of the resources a cache entry depends on
+
+        Returns:
+            (int|str): Generation from ResourceCache.get_generation()
+        """
+        if keys not in self.generations:
+            self.generations[keys] = self.resource_cache.get_generation(*keys)
+        return self.generations[keys]
+
+    def prefetch(self, collection_name, experiment_name=None, channel_name=None):
+        """Resolve the deepest resource named by the request in a single query
+
+        The resource's parents and coordinate frame are fetched with it and memoized. Resources found are also kept
+        in the cross request resource cache, which is checked first. If the resource doesn't exist nothing is
+        memoized and each level is looked up individually when requested.
+
+        Args:
+            collection_name (str): Name of the collection
+            experiment_name (optional[str]): Name of the experiment
+            channel_name (optional[str]): Name of the channel
+        """
+        names = [str(collection_name)]
+        if experiment_name:
+            names.append(experiment_name)
+            if channel_name:
+                names.append(channel_name)
+
+        key = tuple(names)
+        if len(key) == 1 and key[0] in self.collections or key in self.experiments or key in self.channels:
+            return
+
+        # The resources depend on the resource and each of its parents
+        generation = self.get_generation(*get_boss_key_prefixes(names))
+        cache_key = 'resources:' + META_CONNECTOR.join(names)
+        resources = self.resource_cache.get(generation, cache_key)
+        if resources is None:
+            resources = self.query(*names)
+            if resources is None:
+                return
+            self.resource_cache.set(generation, cache_key, resources)
+
+        self.collections[key[0]] = resources[0]
+        if len(resources) > 1:
+            self.experiments[key[:2]] = resources[1]
+        if len(resources) > 2:
+            self.channels[key] = resources[2]
+
+    def query(self, collection_name, experiment_name=None, channel_name=None):
+        """Query the database for a resource and its parents
+
+        Args:
+            collection_name (str): Name of the collection
+            experiment_name (optional[str]): Name of the experiment
+            channel_name (optional[str]): Name of the channel
+
+        Returns:
+            (tuple|None): The collection, experiment, and channel named, or None if the resource doesn't exist
+        """
+        try:
+            if channel_name:
+                channel = Channel.objects.select_related('experiment__collection', 'experiment__coord_frame')\
+                    .get(name=channel_name, experiment__name=experiment_name,
+                         experiment__collection__name=collection_name)
+                return channel.experiment.collection, channel.experiment, channel
+
+            elif experiment_name:
+                experiment = Experiment.objects.select_related('collection', 'coord_frame')\
+                    .get(name=experiment_name, collection__name=collection_name)
+                return experiment.collection, experiment
+
+            else:
+                return Collection.objects.get(name=collection_name),
+        except (Collection.DoesNotExist, Experiment.DoesNotExist, Channel.DoesNotExist):
+            return None
+
+    def get_collection(self, collection_name):
+        """Get a collection
+
+        Args:
+            collection_name (str): Name of the collection
+
+        Returns:
+            (Collection|None): None if the collection doesn't exist
+        """
+        collection_name = str(collection_name)
+        if collection_name not in self.collections:
+            try:
+                self.collections[collection_name] = Collection.objects.get(name=collection_name)
+            except Collection.DoesNotExist:
+                self.collections[collection_name] = None
+        return self.collections[collection_name]
+
+    def get_experiment(self, collection, experiment_name):
+        """Get an experiment, with its coordinate frame
+
+        Args:
+            collection (Collection): Collection containing the experiment
+            experiment_name (str): Name of the experiment
+
+        Returns:
+            (Experiment|None): None if the experiment doesn't exist
+        """
+        key = (collection.name, experiment_name)
+        if key not in self.experiments:
+            try:
+                self.experiments[key] = Experiment.objects.select_related('coord_frame')\
+                    .get(name=experiment_name, collection=collection)
+            except Experiment.DoesNotExist:
+                self.experiments[key] = None
+        return self.experiments[key]
+
+    def get_channel(self, experiment, channel_name):
+        """Get a channel
+
+        Args:
+            experiment (Experiment): Experiment containing the channel
+            channel_name (str): Name of the channel
+
+        Returns:
+            (Channel|None): None if the channel doesn't exist
+        """
+        key = (experiment.collection.name, experiment.name, channel_name)
+        if key not in self.channels:
+            try:
+                self.channels[key] = Channel.objects.get(name=channel_name, experiment=experiment)
+            except Channel.DoesNotExist:
+                self.channels[key] = None
+        return self.channels[key]
+
+    def get_lookup_key(self, boss_key):
+        """Get the lookup key for a boss key
+
+        Args:
+            boss_key (str): Boss key of the resource
+
+        Returns:
+            (str): Lookup key of the resource
+
+        Raises:
+            BossLookup.DoesNotExist: If there is no lookup key for the boss key
+        """
+        if boss_key not in self.lookup_keys:
+            # Lookup keys only change when the lookup table does, which invalidates the whole cache
+            generation = self.get_generation()
+            cache_key = 'lookup:' + boss_key
+            lookup_key = self.resource_cache.get(generation, cache_key)
+            if lookup_key is None:
+                lookup_key = LookUpKey.get_lookup_key(boss_key).lookup_key
+                self.resource_cache.set(generation, cache_key, lookup_key)
+            self.lookup_keys[boss_key] = lookup_key
+        return self.lookup_keys[boss_key]
+
+    def check_permissions(self, check, user, obj, method_type):
+        """Check a user's permissions on a resource
+
+        Args:
+            check (function): BossPermissionManager method to check the permissions with
+            user (User): User making the request
+            obj (Collection|Experiment|Channel): Resource the request is for
+            method_type (str): HTTP method of the request
+
+        Returns:
+            (bool): Result of check
+        """
+        if obj is None:
+            return check(user, obj, method_type)
+
+        key = (check.__name__, user.pk, obj._meta.model_name, obj.pk, method_type)
+        if key not in self.permissions:
+            self.permissions[key] = check(user, obj, method_type)
+        return self.permissions[key]
@@ -0,0 +1,230 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cross request cache of datamodel resources and lookup keys
+
+Entries are kept in a small LRU in each process, backed by the Django cache
+(Redis in production) so that all processes share them. Every entry is
+stored under the current generation numbers, which are kept in the Django
+cache. There is a generation for the whole cache and one for each resource,
+keyed by its boss key, and an entry for a resource is stored under the
+generations of the resource and its parents.
+
+Saving a collection, experiment, or channel increments the generation of
+just that resource, which invalidates the entries of it and its children in
+every process. Renames update the lookup keys, and changes to lookup keys
+and coordinate frames and deletes increment the generation of the whole
+cache, since they can't be attributed to the resource's current name.
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+from .models import Collection, Experiment, Channel, CoordinateFrame, BossLookup
+
+# Prefix of the Django cache keys used by the resource cache
+PREFIX = 'boss-resource-cache'
+
+# Models whose changes invalidate the cache
+MODELS = (Collection, Experiment, Channel, CoordinateFrame, BossLookup)
+
+# Separator between the names in a boss key
+META_CONNECTOR = "&"
+
+
+class ResourceCache(object):
+    """Versioned two level cache of datamodel lookups
+
+    Args:
+        size (int): Maximum number of entries kept in this process
+        ttl (int): Number of seconds entries are kept
+        prefix (str): Prefix of the Django cache keys, which separates independent caches
+    """
+
+    def __init__(self, size, ttl, prefix=PREFIX):
+        self.size = size
+        self.ttl = ttl
+        self.generation_key = prefix + '-generation'
+        self.key_generation_key = prefix + '-generation:{}'
+        self.entry_key = prefix + ':{}:{}'
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_generation(self, *keys):
+        """Get the current generation
+
+        Args:
+            *keys (str): Keys of the resources that an entry depends on, each of which has its own generation
+
+        Returns:
+            (int|str): Generation number of the whole cache, or if keys are given, it joined with the generation
+                       number of each key
+        """
+        if not keys:
+            return cache.get(self.generation_key, 0)
+
+        generation_keys = [self.generation_key] + [self.key_generation_key.format(key) for key in keys]
+        generations = cache.get_many(generation_keys)
+        return '.'.join(str(generations.get(key, 0)) for key in generation_keys)
+
+    def get(self, generation, key):
+        """Get an entry from the cache
+
+        Args:
+            generation (int|str): Generation from get_generation()
+            key (str): Key of the entry
+
+        Returns:
+            The cached value or None if there is no entry for the generation
+        """
+        local_key = (generation, key)
+        with self.lock:
+            if local_key in self.local:
+                expires, value = self.local[local_key]
+                if expires > time.time():
+                    self.local.move_to_end(local_key)
+                    return value
+                del self.local[local_key]
+
+        value = cache.get(self.entry_key.format(*local_key))
+        if value is not None:
+            self.set_local(local_key, value)
+        return value
+
+    def set(self, generation, key, value):
+        """Add an entry to the cache
+
+        The generation must be the one read before the value was read from the database, so that a value read
+        before a change is never stored under the generation created by the change.
+
+        Args:
+            generation (int|str): Generation from get_generation()
+            key (str): Key of the entry
+            value: Picklable value to cache, must not be None
+        """
+        local_key = (generation, key)
+        cache.set(self.entry_key.format(*local_key), value, self.ttl)
+        self.set_local(local_key, value)
+
+    def set_local(self, local_key, value):
+        """Add an entry to this process' LRU, evicting the least recently used entries
+
+        Args:
+            local_key (tuple): (generation, key) of the entry
+            value: Value to cache
+        """
+        with self.lock:
+            self.local[local_key] = (time.time() + self.ttl, value)
+            self.local.move_to_end(local_key)
+            while len(self.local) > self.size:
+                self.local.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Invalidate entries in every process by incrementing a generation
+
+        Args:
+            key (optional[str]): Key of the resource that changed, to only invalidate the entries that were stored
+                                 under its generation. By default all entries are invalidated
+        """
+        generation_key = self.generation_key if key is None else self.key_generation_key.format(key)
+        cache.add(generation_key, 0, None)
+        try:
+            cache.incr(generation_key)
+        except ValueError:
+            # The generation was evicted between the add and the incr
+            cache.set(generation_key, 1, None)
+
+        if key is None:
+            with self.lock:
+                self.local.clear()
+
+
+_resource_cache = None
+
+
+def get_resource_cache():
+    """Get the process wide resource cache
+
+    Returns:
+        (ResourceCache)
+    """
+    global _resource_cache
+    if _resource_cache is None:
+        _resource_cache = ResourceCache(settings.RESOURCE_CACHE_SIZE, settings.RESOURCE_CACHE_TTL)
+    return _resource_cache
+
+
+def get_boss_key(instance):
+    """Get the boss key of a collection, experiment, or channel
+
+    Args:
+        instance (Collection|Experiment|Channel): Resource
+
+    Returns:
+        (str|None): The boss key, or None if the instance isn't one of the resources
+    """
+    if isinstance(instance, Collection):
+        names = [instance.name]
+    elif isinstance(instance, Experiment):
+        names = [instance.collection.name, instance.name]
+    elif isinstance(instance, Channel):
+        names = [instance.experiment.collection.name, instance.experiment.name, instance.name]
+    else:
+        return None
+    return META_CONNECTOR.join(names)
+
+
+def get_boss_key_prefixes(names):
+    """Get the boss keys of a resource and its parents, which are the keys an entry for the resource depends on
+
+    Args:
+        names (list[str]): Collection, experiment, and channel names of the resource
+
+    Returns:
+        (list[str])
+    """
+    return [META_CONNECTOR.join(names[:i + 1]) for i in range(len(names))]
+
+
+def invalidate_resource_cache(sender, instance=None, **kwargs):
+    """Signal handler that invalidates the resource cache when a datamodel model changes
+
+    A saved collection, experiment, or channel only invalidates the entries that depend on it, everything else
+    invalidates the whole cache. The cache is invalidated immediately and again once the change is committed, so
+    that old values cached by another request before the commit don't survive under the new generation.
+    """
+    key = None
+    if kwargs.get('signal') is post_save:
+        try:
+            key = get_boss_key(instance)
+        except ObjectDoesNotExist:
+            pass
+
+    resource_cache = get_resource_cache()
+    resource_cache.invalidate(key)
+    transaction.on_commit(lambda: resource_cache.invalidate(key))
+
+
+def connect_signals():
+    """Invalidate the resource cache whenever any of the cached models are saved or deleted"""
+    for model in MODELS:
+        post_save.connect(invalidate_resource_cache, sender=model, dispatch_uid='resource_cache_save')
+        post_delete.connect(invalidate_resource_cache, sender=model, dispatch_uid='resource_cache_delete')
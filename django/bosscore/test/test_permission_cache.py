@@ -0,0 +1,58 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.contrib.auth.models import Group
+from rest_framework.test import APITestCase
+
+from bosscore.models import Channel
+from bosscore.permissions import BossPermissionManager
+from .setup_db import SetupTestDB, EXP1
+
+
+class PermissionCacheTests(APITestCase):
+
+    def setUp(self):
+        dbsetup = SetupTestDB()
+        self.owner = dbsetup.create_user('testuser')
+        dbsetup.set_user(self.owner)
+        dbsetup.insert_test_data()
+
+        self.user = dbsetup.create_user('otheruser')
+        self.channel = Channel.objects.get(name='channel1', experiment__name=EXP1)
+        self.group = Group.objects.create(name='readers')
+
+    def test_cached(self):
+        BossPermissionManager.check_data_permissions(self.user, self.channel, 'GET')
+        with self.assertNumQueries(0):
+            BossPermissionManager.check_data_permissions(self.user, self.channel, 'GET')
+
+    def test_add_permissions_group(self):
+        self.user.groups.add(self.group)
+        self.assertFalse(BossPermissionManager.check_data_permissions(self.user, self.channel, 'GET'))
+
+        BossPermissionManager.add_permissions_group('readers', self.channel, ['read_volumetric_data'])
+        self.assertTrue(BossPermissionManager.check_data_permissions(self.user, self.channel, 'GET'))
+
+        BossPermissionManager.delete_permissions_group('readers', self.channel, ['read_volumetric_data'])
+        self.assertFalse(BossPermissionManager.check_data_permissions(self.user, self.channel, 'GET'))
+
+    def test_group_membership(self):
+        BossPermissionManager.add_permissions_group('readers', self.channel, ['read_volumetric_data'])
+        self.assertFalse(BossPermissionManager.check_data_permissions(self.user, self.channel, 'GET'))
+
+        self.group.user_set.add(self.user)
+        self.assertTrue(BossPermissionManager.check_data_permissions(self.user, self.channel, 'GET'))
+
+        self.user.groups.remove(self.group)
+        self.assertFalse(BossPermissionManager.check_data_permissions(self.user, self.channel, 'GET'))
@@ -0,0 +1,134 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest.mock import MagicMock
+
+from rest_framework.test import APITestCase
+
+from bosscore.resolver import ResourceResolver, get_resolver
+from .setup_db import SetupTestDB, EXP1
+
+
+class ResourceResolverTests(APITestCase):
+
+    def setUp(self):
+        dbsetup = SetupTestDB()
+        user = dbsetup.create_user('testuser')
+        dbsetup.set_user(user)
+        dbsetup.insert_test_data()
+        self.user = user
+
+    def test_get_resolver_memoized(self):
+        request = MagicMock(spec=[])
+        resolver = get_resolver(request)
+        self.assertIs(get_resolver(request), resolver)
+
+    def test_prefetch_channel_single_query(self):
+        resolver = ResourceResolver()
+        with self.assertNumQueries(1):
+            resolver.prefetch('col1', EXP1, 'channel1')
+
+        with self.assertNumQueries(0):
+            collection = resolver.get_collection('col1')
+            experiment = resolver.get_experiment(collection, EXP1)
+            channel = resolver.get_channel(experiment, 'channel1')
+            self.assertEqual(experiment.coord_frame.name, 'cf1')
+
+        self.assertEqual(collection.name, 'col1')
+        self.assertEqual(channel.name, 'channel1')
+
+    def test_prefetch_missing_channel(self):
+        resolver = ResourceResolver()
+        resolver.prefetch('col1', EXP1, 'channel56')
+
+        collection = resolver.get_collection('col1')
+        experiment = resolver.get_experiment(collection, EXP1)
+        self.assertIsNotNone(experiment)
+        self.assertIsNone(resolver.get_channel(experiment, 'channel56'))
+
+    def test_missing_collection(self):
+        resolver = ResourceResolver()
+        resolver.prefetch('col56', EXP1, 'channel1')
+        self.assertIsNone(resolver.get_collection('col56'))
+
+    def test_lookup_key_memoized(self):
+        resolver = ResourceResolver()
+        lookup_key = resolver.get_lookup_key('col1&{}&channel1'.format(EXP1))
+        with self.assertNumQueries(0):
+            self.assertEqual(resolver.get_lookup_key('col1&{}&channel1'.format(EXP1)), lookup_key)
+
+    def test_check_permissions_memoized(self):
+        resolver = ResourceResolver()
+        resolver.prefetch('col1', EXP1, 'channel1')
+        channel = resolver.get_channel(resolver.get_experiment(resolver.get_collection('col1'), EXP1), 'channel1')
+
+        check = MagicMock(return_value=True)
+        check.__name__ = 'check_data_permissions'
+        self.assertTrue(resolver.check_permissions(check, self.user, channel, 'GET'))
+        self.assertTrue(resolver.check_permissions(check, self.user, channel, 'GET'))
+        self.assertEqual(check.call_count, 1)
+
+        resolver.check_permissions(check, self.user, channel, 'POST')
+        self.assertEqual(check.call_count, 2)
+
+    def test_resource_cache_shared_between_requests(self):
+        ResourceResolver().prefetch('col1', EXP1, 'channel1')
+
+        resolver = ResourceResolver()
+        with self.assertNumQueries(0):
+            resolver.prefetch('col1', EXP1, 'channel1')
+        self.assertEqual(resolver.channels[('col1', EXP1, 'channel1')].name, 'channel1')
+
+    def test_resource_cache_invalidated_on_save(self):
+        resolver = ResourceResolver()
+        resolver.prefetch('col1', EXP1, 'channel1')
+        channel = resolver.channels[('col1', EXP1, 'channel1')]
+
+        channel.description = 'Updated description'
+        channel.save()
+
+        resolver = ResourceResolver()
+        with self.assertNumQueries(1):
+            resolver.prefetch('col1', EXP1, 'channel1')
+        self.assertEqual(resolver.channels[('col1', EXP1, 'channel1')].description, 'Updated description')
+
+    def test_resource_cache_save_only_invalidates_resource(self):
+        ResourceResolver().prefetch('col1', EXP1, 'channel1')
+        ResourceResolver().prefetch('col1', EXP1, 'channel2')
+
+        resolver = ResourceResolver()
+        resolver.prefetch('col1', EXP1, 'channel2')
+        channel = resolver.channels[('col1', EXP1, 'channel2')]
+        channel.downsample_status = 'NOT_DOWNSAMPLED'
+        channel.save()
+
+        with self.assertNumQueries(0):
+            ResourceResolver().prefetch('col1', EXP1, 'channel1')
+        with self.assertNumQueries(1):
+            ResourceResolver().prefetch('col1', EXP1, 'channel2')
+
+    def test_resource_cache_parent_save_invalidates_children(self):
+        ResourceResolver().prefetch('col1', EXP1, 'channel1')
+
+        resolver = ResourceResolver()
+        resolver.prefetch('col1')
+        collection = resolver.collections['col1']
+        collection.description = 'Updated description'
+        collection.save()
+
+        resolver = ResourceResolver()
+        with self.assertNumQueries(1):
+            resolver.prefetch('col1', EXP1, 'channel1')
+        self.assertEqual(resolver.collections['col1'].description, 'Updated description')
+
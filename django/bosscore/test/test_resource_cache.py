@@ -0,0 +1,68 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from bosscore.resource_cache import ResourceCache
+
+
+class ResourceCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.cache = ResourceCache(2, 60)
+
+    def test_get_set(self):
+        generation = self.cache.get_generation()
+        self.assertIsNone(self.cache.get(generation, 'a'))
+        self.cache.set(generation, 'a', 1)
+        self.assertEqual(self.cache.get(generation, 'a'), 1)
+
+    def test_shared_cache(self):
+        generation = self.cache.get_generation()
+        self.cache.set(generation, 'a', 1)
+
+        other = ResourceCache(2, 60)
+        self.assertEqual(other.get(generation, 'a'), 1)
+
+    def test_local_lru(self):
+        generation = self.cache.get_generation()
+        self.cache.set(generation, 'a', 1)
+        self.cache.set(generation, 'b', 2)
+        self.cache.get(generation, 'a')
+        self.cache.set(generation, 'c', 3)
+
+        self.assertEqual(list(self.cache.local.keys()), [(generation, 'a'), (generation, 'c')])
+
+    def test_invalidate(self):
+        generation = self.cache.get_generation()
+        self.cache.set(generation, 'a', 1)
+        self.cache.invalidate()
+
+        self.assertEqual(self.cache.get_generation(), generation + 1)
+        self.assertIsNone(self.cache.get(self.cache.get_generation(), 'a'))
+        self.assertEqual(len(self.cache.local), 0)
+
+    def test_invalidate_key(self):
+        generation = self.cache.get_generation('col1', 'col1&exp1')
+        other_generation = self.cache.get_generation('col2')
+        self.cache.set(generation, 'a', 1)
+        self.cache.set(other_generation, 'b', 2)
+        self.cache.invalidate('col1')
+
+        self.assertNotEqual(self.cache.get_generation('col1', 'col1&exp1'), generation)
+        self.assertIsNone(self.cache.get(self.cache.get_generation('col1', 'col1&exp1'), 'a'))
+        self.assertEqual(self.cache.get(self.cache.get_generation('col2'), 'b'), 2)
+
@@ -22,6 +22,7 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework import generics
 
+from boss import metrics
 from bosscore.constants import INGEST_GRP
 from bosscore.error import BossError, ErrorCodes, BossHTTPError
 from bossingest.ingest_manager import IngestManager, INGEST_BUCKET
@@ -264,8 +265,7 @@ class IngestJobView(IngestServiceView):
             {'Name': 'Stack', 'Value': boss_config['system']['fqdn']},
         ]
 
-        session = bossutils.aws.get_session()
-        client = session.client('cloudwatch')
+        client = metrics.get_client()
         client.put_metric_data(
             Namespace = "BOSS/Ingest",
             MetricData = [{
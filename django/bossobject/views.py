@@ -18,9 +18,10 @@ from rest_framework.response import Response
 from bosscore.request import BossRequest
 from bosscore.error import BossError, BossHTTPError, ErrorCodes
 
-from spdb.spatialdb.spatialdb import SpatialDB
 from spdb import project
 
+from bossspatialdb import invalidation
+
 from django.conf import settings
 
 
@@ -66,7 +67,7 @@ class Reserve(APIView):
         resource = project.BossResourceDjango(req)
         try:
             # Reserve ids
-            spdb = SpatialDB(settings.KVIO_SETTINGS, settings.STATEIO_CONFIG, settings.OBJECTIO_CONFIG)
+            spdb = invalidation.create_spatialdb()
             start_id = spdb.reserve_ids(resource, int(num_ids))
             data = {'start_id': start_id[0], 'count': num_ids}
             return Response(data, status=200)
@@ -124,7 +125,7 @@ class Ids(APIView):
 
         try:
             # Reserve ids
-            spdb = SpatialDB(settings.KVIO_SETTINGS, settings.STATEIO_CONFIG, settings.OBJECTIO_CONFIG)
+            spdb = invalidation.create_spatialdb()
             ids = spdb.get_ids_in_region(resource, int(resolution), corner, extent)
             return Response(ids, status=200)
         except (TypeError, ValueError) as e:
@@ -184,7 +185,7 @@ class BoundingBox(APIView):
 
         try:
             # Get interface to SPDB cache
-            spdb = SpatialDB(settings.KVIO_SETTINGS, settings.STATEIO_CONFIG, settings.OBJECTIO_CONFIG)
+            spdb = invalidation.create_spatialdb()
             data = spdb.get_bounding_box(resource, int(resolution), int(id), bb_type=bb_type)
             if data is None:
                 return BossHTTPError("The id does not exist. {}".format(id), ErrorCodes.OBJECT_NOT_FOUND)
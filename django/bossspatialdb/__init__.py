@@ -0,0 +1,3 @@
+
+
+default_app_config = 'bossspatialdb.apps.BossspatialdbConfig'
@@ -12,8 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import blosc
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class BossspatialdbConfig(AppConfig):
     name = 'bossspatialdb'
+
+    def ready(self):
+        # Blosc's thread count is global to the process, so it is set once instead of for every cutout
+        blosc.set_nthreads(settings.CUTOUT_BLOSC_NTHREADS)
@@ -0,0 +1,137 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Block reduction used to compute downsampled cutouts on the fly
+
+A cutout at a resolution that hasn't been downsampled yet is computed from
+the channel's base resolution. Each output voxel is reduced from a block of
+base voxels: the mean for image channels and the most common non-zero id for
+annotation channels. The block size on each axis is the ratio of the voxel
+sizes at the two resolutions, so the experiment's hierarchy method
+(anisotropic or isotropic) is respected.
+"""
+
+import numpy as np
+
+
+def get_factors(voxel_dims, resolution, base_resolution):
+    """Get the size of the block of base voxels reduced into each voxel at a resolution
+
+    Args:
+        voxel_dims (list[list]): (x, y, z) voxel size at each resolution, from get_downsampled_voxel_dims()
+        resolution (int): Resolution of the output
+        base_resolution (int): Resolution the output is computed from
+
+    Returns:
+        (tuple[int]): (x, y, z) block size
+    """
+    return tuple(max(1, int(round(voxel_dims[resolution][i] / voxel_dims[base_resolution][i]))) for i in range(3))
+
+
+def source_box(corner, extent, factors):
+    """Get the region at the base resolution that a region at the output resolution is computed from
+
+    Args:
+        corner (tuple[int]): (x, y, z) corner at the output resolution
+        extent (tuple[int]): (x, y, z) extent at the output resolution
+        factors (tuple[int]): (x, y, z) block size from get_factors()
+
+    Returns:
+        (tuple[tuple[int], tuple[int]]): (x, y, z) corner and extent at the base resolution
+    """
+    return tuple(c * f for c, f in zip(corner, factors)), tuple(e * f for e, f in zip(extent, factors))
+
+
+def _blocks(data, factors):
+    """View a (t, z, y, x) array as (t, z, y, x, voxels in block) blocks
+
+    Args:
+        data (np.ndarray): Array whose z, y, and x dimensions are multiples of the factors
+        factors (tuple[int]): (x, y, z) block size
+
+    Returns:
+        (np.ndarray)
+    """
+    t, z, y, x = data.shape
+    fx, fy, fz = factors
+    blocks = data.reshape(t, z // fz, fz, y // fy, fy, x // fx, fx)
+    blocks = blocks.transpose(0, 1, 3, 5, 2, 4, 6)
+    return blocks.reshape(t, z // fz, y // fy, x // fx, fz * fy * fx)
+
+
+def reduce_mean(data, factors):
+    """Reduce each block to its mean, rounded to the array's datatype
+
+    Args:
+        data (np.ndarray): (t, z, y, x) array whose z, y, and x dimensions are multiples of the factors
+        factors (tuple[int]): (x, y, z) block size
+
+    Returns:
+        (np.ndarray): Reduced array with the same datatype
+    """
+    t, z, y, x = data.shape
+    fx, fy, fz = factors
+    blocks = data.reshape(t, z // fz, fz, y // fy, fy, x // fx, fx)
+    return np.rint(blocks.mean(axis=(2, 4, 6))).astype(data.dtype)
+
+
+def reduce_mode(data, factors):
+    """Reduce each block to its most common non-zero value
+
+    Zero is only chosen when a block has no other values. Ties are broken by choosing the smallest value.
+
+    Args:
+        data (np.ndarray): (t, z, y, x) array whose z, y, and x dimensions are multiples of the factors
+        factors (tuple[int]): (x, y, z) block size
+
+    Returns:
+        (np.ndarray): Reduced array with the same datatype
+    """
+    blocks = _blocks(data, factors)
+    shape = blocks.shape[:-1]
+    values = np.sort(blocks.reshape(-1, blocks.shape[-1]), axis=1)
+
+    # The count of each value is the distance between its first and last position in the sorted block
+    n = values.shape[1]
+    positions = np.arange(n)
+    starts = np.ones(values.shape, dtype=bool)
+    starts[:, 1:] = values[:, 1:] != values[:, :-1]
+    ends = np.ones(values.shape, dtype=bool)
+    ends[:, :-1] = starts[:, 1:]
+
+    first = np.maximum.accumulate(np.where(starts, positions, 0), axis=1)
+    last = np.minimum.accumulate(np.where(ends, positions, n - 1)[:, ::-1], axis=1)[:, ::-1]
+    counts = last - first + 1
+    counts[values == 0] = 0
+
+    mode = values[np.arange(values.shape[0]), np.argmax(counts, axis=1)]
+    return mode.reshape(shape)
+
+
+def block_reduce(data, factors, annotation=False):
+    """Reduce a base resolution array by the given block size
+
+    Args:
+        data (np.ndarray): (t, z, y, x) array whose z, y, and x dimensions are multiples of the factors
+        factors (tuple[int]): (x, y, z) block size
+        annotation (bool): If the array holds annotation ids, which are reduced with the mode instead of the mean
+
+    Returns:
+        (np.ndarray): Reduced array with the same datatype
+    """
+    if factors == (1, 1, 1):
+        return data
+    if annotation:
+        return reduce_mode(data, factors)
+    return reduce_mean(data, factors)
@@ -0,0 +1,160 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helpers for reading many boxes of a channel in a single request
+
+A bulk cutout request lists boxes as [x_start, x_stop, y_start, y_stop,
+z_start, z_stop]. Boxes that touch any of the same cuboids are clustered so
+that the cuboids they share are read once, with a single cutout of the
+cluster's cuboid aligned bounding box. A cluster whose bounding box would
+read many cuboids that none of its boxes touch is read one box at a time
+instead.
+
+The response uses the chunked blosc format, with one frame per box. Frames
+are ordered by cluster, so clients match frames to boxes by their bounds.
+"""
+
+import itertools
+
+# A cluster is read as a single cutout if its bounding box has at most this many times the cuboids its boxes touch
+MAX_CLUSTER_WASTE = 2
+
+
+def parse_boxes(data, max_boxes):
+    """Parse the boxes listed in a bulk cutout request
+
+    Args:
+        data (dict): Request body with 'boxes', a list of [x_start, x_stop, y_start, y_stop, z_start, z_stop]
+        max_boxes (int): Maximum number of boxes allowed in a request
+
+    Returns:
+        (list[tuple[tuple[int], tuple[int]]]): (x, y, z) corner and extent of each box
+
+    Raises:
+        ValueError: If the boxes are invalid
+    """
+    boxes = []
+    try:
+        for box in data['boxes']:
+            x_start, x_stop, y_start, y_stop, z_start, z_stop = [int(v) for v in box]
+            boxes.append(((x_start, y_start, z_start), (x_stop - x_start, y_stop - y_start, z_stop - z_start)))
+    except (TypeError, KeyError, ValueError):
+        raise ValueError("Invalid box list")
+
+    if len(boxes) == 0:
+        raise ValueError("No boxes requested")
+    if len(boxes) > max_boxes:
+        raise ValueError("Request is limited to {} boxes".format(max_boxes))
+    for corner, extent in boxes:
+        if min(corner) < 0 or min(extent) <= 0:
+            raise ValueError("Invalid box: {}".format([corner[0], corner[0] + extent[0],
+                                                        corner[1], corner[1] + extent[1],
+                                                        corner[2], corner[2] + extent[2]]))
+
+    return boxes
+
+
+def parse_time_range(data):
+    """Parse the optional time range of a bulk cutout request
+
+    Args:
+        data (dict): Request body with an optional 'time_range' of [start, stop)
+
+    Returns:
+        (str|None): Time range formatted like the cutout service's time argument, or None if not given
+
+    Raises:
+        ValueError: If the time range is invalid
+    """
+    if data.get('time_range') is None:
+        return None
+    try:
+        start, stop = [int(t) for t in data['time_range']]
+    except (TypeError, ValueError):
+        raise ValueError("Invalid time range")
+    return "{}:{}".format(start, stop)
+
+
+def bounding_box(boxes):
+    """Get the bounding box of a list of boxes
+
+    Args:
+        boxes (list[tuple[tuple[int], tuple[int]]]): (corner, extent) of each box
+
+    Returns:
+        (tuple[tuple[int], tuple[int]]): (corner, extent) of the bounding box
+    """
+    start = [min(corner[i] for corner, _ in boxes) for i in range(3)]
+    stop = [max(corner[i] + extent[i] for corner, extent in boxes) for i in range(3)]
+    return tuple(start), tuple(stop[i] - start[i] for i in range(3))
+
+
+def cuboid_indices(corner, extent, cuboid_size):
+    """Get the indices of the cuboids touched by a box
+
+    Args:
+        corner (tuple[int]): (x, y, z) corner of the box
+        extent (tuple[int]): (x, y, z) extent of the box
+        cuboid_size (tuple[int]): (x, y, z) size of a cuboid
+
+    Returns:
+        (list[tuple[int]]): (x, y, z) index of each cuboid
+    """
+    axes = [range(corner[i] // cuboid_size[i], (corner[i] + extent[i] - 1) // cuboid_size[i] + 1) for i in range(3)]
+    return list(itertools.product(*axes))
+
+
+def cluster_boxes(boxes, cuboid_size):
+    """Cluster boxes that touch any of the same cuboids
+
+    Args:
+        boxes (list[tuple[tuple[int], tuple[int]]]): (corner, extent) of each box
+        cuboid_size (tuple[int]): (x, y, z) size of a cuboid
+
+    Returns:
+        (list[tuple]): (corner, extent, box indices) of each region to read, in order of each region's first box
+    """
+    # Union-find of the boxes, joined through the cuboids they touch
+    parents = list(range(len(boxes)))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    owners = {}
+    touched = []
+    for i, (corner, extent) in enumerate(boxes):
+        indices = cuboid_indices(corner, extent, cuboid_size)
+        touched.append(indices)
+        for idx in indices:
+            if idx in owners:
+                parents[find(i)] = find(owners[idx])
+            else:
+                owners[idx] = i
+
+    clusters = {}
+    for i in range(len(boxes)):
+        clusters.setdefault(find(i), []).append(i)
+
+    regions = []
+    for members in sorted(clusters.values(), key=lambda m: m[0]):
+        corner, extent = bounding_box([boxes[i] for i in members])
+        cuboids = set(idx for i in members for idx in touched[i])
+        if len(members) == 1 or len(cuboid_indices(corner, extent, cuboid_size)) <= MAX_CLUSTER_WASTE * len(cuboids):
+            regions.append((corner, extent, members))
+        else:
+            regions.extend((boxes[i][0], boxes[i][1], [i]) for i in members)
+    return regions
@@ -0,0 +1,296 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Framing for the chunked (streamed) blosc cutout format
+
+A chunked response is a stream header followed by a sequence of frames.  Each
+frame holds an independently blosc compressed, C-ordered block of the cutout
+and a small header giving the block's bounds, so a client can decode and use
+each block as soon as it arrives.
+
+Stream header (little endian, 48 bytes):
+    magic (4s) - b'BSCK'
+    version (B)
+    flags (B) - bit 0 set if the frames include a time axis
+    padding (2x)
+    dtype (8s) - numpy dtype name, NUL padded
+    t_start (Q)
+    t_stop (Q)
+    frame_count (Q)
+    reserved (Q)
+
+Frame header (little endian, 56 bytes):
+    x_start, x_stop, y_start, y_stop, z_start, z_stop (Q each)
+    nbytes (Q) - size of the compressed payload that follows
+
+Version 2 (indexed) streams put an index between the stream header and the
+first frame, so every byte of the response is known before it is sent and a
+client can resume an interrupted download with a Range request:
+
+Index entry (little endian, 16 bytes, one per frame):
+    offset (Q) - position of the frame header from the start of the stream
+    length (Q) - size of the frame, including its header
+"""
+
+
+import struct
+
+import blosc
+import numpy as np
+
+MEDIA_TYPE = 'application/blosc-chunked'
+
+STREAM_MAGIC = b'BSCK'
+STREAM_VERSION = 1
+INDEXED_VERSION = 2
+FLAG_TIME_AXIS = 0x01
+
+STREAM_HEADER = struct.Struct('<4sBB2x8sQQQQ')
+FRAME_HEADER = struct.Struct('<7Q')
+INDEX_ENTRY = struct.Struct('<QQ')
+
+# Django cache key of the frame lengths of a version 2 stream, by ETag
+INDEX_KEY = 'boss-chunked-index:{}'
+
+
+def get_version(media_type):
+    """Get the stream version requested with the version parameter of a media type
+
+    Args:
+        media_type (str|None): Accepted media type, including any parameters (eg. application/blosc-chunked;version=2)
+
+    Returns:
+        (int): STREAM_VERSION or INDEXED_VERSION
+
+    Raises:
+        ValueError: If the parameter is invalid
+    """
+    if media_type:
+        for param in media_type.split(';')[1:]:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'version':
+                if value.strip() not in (str(STREAM_VERSION), str(INDEXED_VERSION)):
+                    raise ValueError("Invalid chunked format version '{}'. Must be {} or {}"
+                                     .format(value.strip(), STREAM_VERSION, INDEXED_VERSION))
+                return int(value)
+    return STREAM_VERSION
+
+
+def encode_stream_header(dtype, time_range, frame_count, time_axis=False, version=STREAM_VERSION):
+    """Pack the header that starts a chunked stream
+
+    Args:
+        dtype (str|np.dtype): Datatype of every frame in the stream
+        time_range (list[int]): [start, stop) of the time samples in the stream
+        frame_count (int): Number of frames that will follow the header
+        time_axis (bool): If the frames are 4D (t, z, y, x) instead of 3D (z, y, x)
+        version (int): STREAM_VERSION, or INDEXED_VERSION if the header will be followed by encode_index()
+
+    Returns:
+        (bytes)
+    """
+    flags = FLAG_TIME_AXIS if time_axis else 0
+    return STREAM_HEADER.pack(STREAM_MAGIC, version, flags,
+                              np.dtype(dtype).name.encode('ascii'),
+                              time_range[0], time_range[1], frame_count, 0)
+
+
+def decode_stream_header(buf):
+    """Unpack a stream header
+
+    Args:
+        buf (bytes): At least STREAM_HEADER.size bytes from the start of the stream
+
+    Returns:
+        (dict): Keys dtype, time_range, frame_count, time_axis, version
+
+    Raises:
+        ValueError: If the buffer does not start with a chunked stream header
+    """
+    magic, version, flags, dtype, t_start, t_stop, frame_count, _ = STREAM_HEADER.unpack_from(buf)
+    if magic != STREAM_MAGIC:
+        raise ValueError("Not a chunked cutout stream")
+
+    return {'version': version,
+            'dtype': np.dtype(dtype.rstrip(b'\0').decode('ascii')),
+            'time_range': [t_start, t_stop],
+            'frame_count': frame_count,
+            'time_axis': bool(flags & FLAG_TIME_AXIS)}
+
+
+def encode_frame(data, corner, **blosc_args):
+    """Compress a block of data and prefix it with its frame header
+
+    Args:
+        data (np.ndarray): C-contiguous 3D or 4D block
+        corner (tuple[int]): (x, y, z) voxel coordinate of the block's first voxel
+        **blosc_args: Keyword arguments passed through to blosc.compress()
+
+    Returns:
+        (bytes)
+    """
+    if not data.flags['C_CONTIGUOUS']:
+        data = np.ascontiguousarray(data)
+
+    z_span, y_span, x_span = data.shape[-3:]
+    blosc_args.setdefault('typesize', data.dtype.itemsize)
+    payload = blosc.compress(data, **blosc_args)
+    header = FRAME_HEADER.pack(corner[0], corner[0] + x_span,
+                               corner[1], corner[1] + y_span,
+                               corner[2], corner[2] + z_span,
+                               len(payload))
+    return header + payload
+
+
+def encode_index(frame_lengths):
+    """Pack the index of a version 2 stream, which follows the stream header
+
+    Args:
+        frame_lengths (list[int]): Size of each frame, including its header
+
+    Returns:
+        (bytes)
+    """
+    offset = STREAM_HEADER.size + INDEX_ENTRY.size * len(frame_lengths)
+    entries = []
+    for length in frame_lengths:
+        entries.append(INDEX_ENTRY.pack(offset, length))
+        offset += length
+    return b''.join(entries)
+
+
+def decode_index(buf):
+    """Unpack the index of a version 2 stream
+
+    Args:
+        buf (bytes): The start of the stream, through the end of the index
+
+    Returns:
+        (list[tuple[int]]): (offset, length) of each frame
+    """
+    header = decode_stream_header(buf)
+    return [INDEX_ENTRY.unpack_from(buf, STREAM_HEADER.size + i * INDEX_ENTRY.size)
+            for i in range(header['frame_count'])]
+
+
+def parse_range(range_header, total):
+    """Parse a Range header that requests a single range of bytes
+
+    Args:
+        range_header (str): Value of the Range header (eg. bytes=100-199, bytes=100-, or bytes=-100)
+        total (int): Size of the complete response
+
+    Returns:
+        (tuple[int]|None): [start, stop) of the requested bytes, or None if the header should be ignored and the
+                           complete response sent
+
+    Raises:
+        ValueError: If the range can't be satisfied
+    """
+    unit, _, spec = range_header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+
+    first, _, last = spec.strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            stop = int(last) + 1 if last else total
+        else:
+            start = max(total - int(last), 0)
+            stop = total
+    except ValueError:
+        return None
+
+    if stop <= start and first and last:
+        return None
+    if start >= total or stop <= start:
+        raise ValueError("Range not satisfiable")
+    return start, min(stop, total)
+
+
+def frames_in_range(frame_lengths, start, stop):
+    """Get the frames of a version 2 stream that hold any of a range of bytes
+
+    Args:
+        frame_lengths (list[int]): Size of each frame, including its header
+        start (int): First byte of the range
+        stop (int): Byte after the last byte of the range
+
+    Returns:
+        (tuple[int]): [first, last) frame numbers and the stream offset of the first one
+    """
+    offset = STREAM_HEADER.size + INDEX_ENTRY.size * len(frame_lengths)
+    first = None
+    last = first_offset = 0
+    for i, length in enumerate(frame_lengths):
+        if offset < stop and offset + length > start:
+            if first is None:
+                first, first_offset = i, offset
+            last = i + 1
+        offset += length
+
+    if first is None:
+        # Only the stream header and index were requested
+        return len(frame_lengths), len(frame_lengths), offset
+    return first, last, first_offset
+
+
+def iter_frames(buf):
+    """Decode all frames from a complete chunked stream
+
+    Args:
+        buf (bytes): A complete chunked stream, including the stream header
+
+    Yields:
+        (tuple[tuple[int], np.ndarray]): (x_start, y_start, z_start) and the decoded block
+    """
+    header = decode_stream_header(buf)
+    t_span = header['time_range'][1] - header['time_range'][0]
+    offset = STREAM_HEADER.size
+    if header['version'] >= INDEXED_VERSION:
+        offset += INDEX_ENTRY.size * header['frame_count']
+    for _ in range(header['frame_count']):
+        x_start, x_stop, y_start, y_stop, z_start, z_stop, nbytes = FRAME_HEADER.unpack_from(buf, offset)
+        offset += FRAME_HEADER.size
+
+        shape = (z_stop - z_start, y_stop - y_start, x_stop - x_start)
+        if header['time_axis']:
+            shape = (t_span,) + shape
+
+        raw = blosc.decompress(bytes(buf[offset:offset + nbytes]))
+        offset += nbytes
+        yield (x_start, y_start, z_start), np.frombuffer(raw, dtype=header['dtype']).reshape(shape)
+
+
+def z_slabs(z_start, z_stop, cuboid_z):
+    """Split a z range into slabs aligned to cuboid boundaries
+
+    The first and last slabs are trimmed to the requested range.
+
+    Args:
+        z_start (int): First z index of the request
+        z_stop (int): Last z index (exclusive) of the request
+        cuboid_z (int): Z dimension of a cuboid at the request's resolution
+
+    Returns:
+        (list[tuple[int]]): [start, stop) pairs covering the request
+    """
+    slabs = []
+    start = z_start
+    while start < z_stop:
+        stop = min((start // cuboid_z + 1) * cuboid_z, z_stop)
+        slabs.append((start, stop))
+        start = stop
+    return slabs
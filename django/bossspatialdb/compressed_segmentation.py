@@ -0,0 +1,260 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Neuroglancer compressed segmentation encoding of annotation cutouts
+
+The volume is split into blocks (8 x 8 x 8 by default). Each block stores a
+table of the distinct ids in the block and, for each voxel, the index of its
+id in the table, bit packed with 0, 1, 2, 4, 8, 16, or 32 bits. Annotation
+cutouts are mostly zero or a few ids per block, so they shrink to a few bits
+per voxel.
+
+The buffer is a sequence of little endian 32 bit words. It starts with the
+word offset of each channel, and each time sample of a cutout is a channel.
+Each channel starts with two header words per block, in x, y, z order:
+
+    word 0 - Word offset of the block's table | (bits per index << 24)
+    word 1 - Word offset of the block's packed indices
+
+Offsets are from the start of the channel. A uint64 id takes two words in a
+table, low word first. This module writes all of a channel's tables before
+its indices, so the 24 bit table offsets reach as far as possible.
+
+See https://github.com/google/neuroglancer/tree/master/src/neuroglancer/sliceview/compressed_segmentation
+"""
+
+import numpy as np
+
+MEDIA_TYPE = 'application/compressed-segmentation'
+
+# Datatypes that can be encoded
+DATA_TYPES = ('uint32', 'uint64')
+
+# Number of bits an encoded index can use
+INDEX_BITS = np.array([0, 1, 2, 4, 8, 16, 32])
+
+# Largest table offset that fits in a block header
+MAX_TABLE_OFFSET = 2 ** 24 - 1
+
+
+def get_block_size(media_type, default):
+    """Get the block size requested with the block_size parameter of a media type
+
+    Args:
+        media_type (str|None): Media type, including any parameters (eg. ...;block_size=8,8,8)
+        default (tuple[int]): (x, y, z) block size to use if the parameter isn't given
+
+    Returns:
+        (tuple[int]): (x, y, z) block size
+
+    Raises:
+        ValueError: If the parameter is invalid
+    """
+    if media_type:
+        for param in media_type.split(';')[1:]:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'block_size':
+                try:
+                    block_size = tuple(int(v) for v in value.split(','))
+                except ValueError:
+                    block_size = ()
+                if len(block_size) != 3 or min(block_size) < 1:
+                    raise ValueError("Invalid block_size '{}'. Must be 3 positive integers, x,y,z".format(value))
+                return block_size
+    return tuple(default)
+
+
+def _grid(shape, block_size):
+    """Get the number of blocks along each axis of a volume
+
+    Args:
+        shape (tuple[int]): (z, y, x) shape of the volume
+        block_size (tuple[int]): (x, y, z) block size
+
+    Returns:
+        (tuple[int]): (z, y, x) number of blocks
+    """
+    return tuple(-(-shape[i] // block_size[2 - i]) for i in range(3))
+
+
+def _words_per_id(dtype):
+    return 2 if np.dtype(dtype).itemsize == 8 else 1
+
+
+def _encode_channel(volume, block_size):
+    """Encode a single channel
+
+    Args:
+        volume (np.ndarray): (z, y, x) uint32 or uint64 array
+        block_size (tuple[int]): (x, y, z) block size
+
+    Returns:
+        (np.ndarray): uint32 words of the channel
+
+    Raises:
+        ValueError: If the block tables are too large to address
+    """
+    bx, by, bz = block_size
+    gz, gy, gx = _grid(volume.shape, block_size)
+    num_blocks = gz * gy * gx
+    num_voxels = bx * by * bz
+
+    # Partial blocks are padded with their edge ids, which are already in their tables
+    pad = [(0, g * b - s) for g, b, s in zip((gz, gy, gx), (bz, by, bx), volume.shape)]
+    if any(p for _, p in pad):
+        volume = np.pad(volume, pad, mode='edge')
+    blocks = volume.reshape(gz, bz, gy, by, gx, bx).transpose(0, 2, 4, 1, 3, 5).reshape(num_blocks, num_voxels)
+
+    # Each block's table is its sorted distinct ids and each voxel's index is the rank of its id
+    rows = np.arange(num_blocks)[:, None]
+    order = np.argsort(blocks, axis=1, kind='mergesort')
+    ids = blocks[rows, order]
+    first = np.ones(ids.shape, dtype=bool)
+    first[:, 1:] = ids[:, 1:] != ids[:, :-1]
+    indices = np.empty(blocks.shape, dtype=np.uint32)
+    indices[rows, order] = np.cumsum(first, axis=1) - 1
+    counts = first.sum(axis=1)
+    tables = ids[first]
+
+    bits = INDEX_BITS[np.searchsorted(2 ** INDEX_BITS, counts)]
+    table_words = counts * _words_per_id(volume.dtype)
+    index_words = -(-num_voxels * bits // 32)
+
+    header_words = 2 * num_blocks
+    table_offsets = header_words + np.cumsum(table_words) - table_words
+    index_offsets = header_words + table_words.sum() + np.cumsum(index_words) - index_words
+    if num_blocks and table_offsets[-1] > MAX_TABLE_OFFSET:
+        raise ValueError("Too many distinct ids to encode. Reduce cutout dimensions.")
+
+    words = np.zeros(header_words + table_words.sum() + index_words.sum(), dtype='<u4')
+    words[0:header_words:2] = table_offsets | (bits << 24)
+    words[1:header_words:2] = index_offsets
+    words[header_words:header_words + table_words.sum()] = tables.astype('<' + volume.dtype.str[1:]).view('<u4')
+
+    for b in np.unique(bits[bits > 0]):
+        selected = bits == b
+        per_word = 32 // b
+        num_words = index_words[selected][0]
+        packed = np.zeros((selected.sum(), num_words * per_word), dtype=np.uint64)
+        packed[:, :num_voxels] = indices[selected]
+        packed = packed.reshape(-1, num_words, per_word) << (np.arange(per_word, dtype=np.uint64) * np.uint64(b))
+        positions = index_offsets[selected][:, None] + np.arange(num_words)
+        words[positions] = np.bitwise_or.reduce(packed, axis=2)
+
+    return words
+
+
+def encode(data, block_size=(8, 8, 8)):
+    """Encode a cutout
+
+    Args:
+        data (np.ndarray): (t, z, y, x) uint32 or uint64 array, each time sample is encoded as a channel
+        block_size (tuple[int]): (x, y, z) block size
+
+    Returns:
+        (bytes)
+
+    Raises:
+        ValueError: If the datatype isn't supported or the block tables are too large to address
+    """
+    if data.dtype.name not in DATA_TYPES:
+        raise ValueError("Compressed segmentation only supports {} data".format(" and ".join(DATA_TYPES)))
+
+    channels = [_encode_channel(volume, block_size) for volume in data]
+    offsets = len(channels) + np.cumsum([0] + [len(c) for c in channels[:-1]])
+    return b''.join([offsets.astype('<u4').tobytes()] + [c.tobytes() for c in channels])
+
+
+def _decode_channel(words, start, shape, block_size, dtype):
+    """Decode a single channel
+
+    Args:
+        words (np.ndarray): uint32 words of the whole buffer
+        start (int): Word offset of the channel
+        shape (tuple[int]): (z, y, x) shape of the volume
+        block_size (tuple[int]): (x, y, z) block size
+        dtype (np.dtype): uint32 or uint64
+
+    Returns:
+        (np.ndarray): (z, y, x) array
+
+    Raises:
+        ValueError: If the channel is malformed
+    """
+    bx, by, bz = block_size
+    gz, gy, gx = _grid(shape, block_size)
+    num_blocks = gz * gy * gx
+    num_voxels = bx * by * bz
+
+    if start + 2 * num_blocks > len(words):
+        raise ValueError("Buffer is too short")
+    header = words[start:start + 2 * num_blocks].astype(np.int64)
+    table_offsets = start + (header[0::2] & MAX_TABLE_OFFSET)
+    bits = header[0::2] >> 24
+    index_offsets = start + header[1::2]
+    if np.setdiff1d(bits, INDEX_BITS).size:
+        raise ValueError("Invalid number of bits per index")
+
+    indices = np.zeros((num_blocks, num_voxels), dtype=np.int64)
+    for b in np.unique(bits[bits > 0]):
+        selected = bits == b
+        per_word = 32 // b
+        num_words = -(-num_voxels * b // 32)
+        positions = index_offsets[selected][:, None] + np.arange(num_words)
+        if positions.max() >= len(words):
+            raise ValueError("Buffer is too short")
+        packed = words[positions].astype(np.int64)[:, :, None] >> (np.arange(per_word) * b)
+        indices[selected] = (packed & ((1 << b) - 1)).reshape(-1, num_words * per_word)[:, :num_voxels]
+
+    words_per_id = _words_per_id(dtype)
+    positions = table_offsets[:, None] + indices * words_per_id
+    if positions.size and positions.max() + words_per_id > len(words):
+        raise ValueError("Buffer is too short")
+    blocks = words[positions].astype(dtype)
+    if words_per_id == 2:
+        blocks |= words[positions + 1].astype(dtype) << np.uint64(32)
+
+    volume = blocks.reshape(gz, gy, gx, bz, by, bx).transpose(0, 3, 1, 4, 2, 5).reshape(gz * bz, gy * by, gx * bx)
+    return volume[:shape[0], :shape[1], :shape[2]]
+
+
+def decode(buf, shape, dtype, block_size=(8, 8, 8)):
+    """Decode a cutout
+
+    Args:
+        buf (bytes|memoryview): Encoded cutout
+        shape (tuple[int]): (t, z, y, x) shape of the cutout, each time sample is a channel
+        dtype (str|np.dtype): uint32 or uint64
+        block_size (tuple[int]): (x, y, z) block size the cutout was encoded with
+
+    Returns:
+        (np.ndarray): (t, z, y, x) array
+
+    Raises:
+        ValueError: If the datatype isn't supported or the buffer doesn't match the shape
+    """
+    dtype = np.dtype(dtype)
+    if dtype.name not in DATA_TYPES:
+        raise ValueError("Compressed segmentation only supports {} data".format(" and ".join(DATA_TYPES)))
+    if len(buf) % 4:
+        raise ValueError("Buffer is not a whole number of 32 bit words")
+
+    words = np.frombuffer(buf, dtype='<u4')
+    if len(words) < shape[0]:
+        raise ValueError("Buffer is too short")
+
+    data = np.empty(shape, dtype=dtype)
+    for t in range(shape[0]):
+        data[t] = _decode_channel(words, int(words[t]), shape[1:], block_size, dtype)
+    return data
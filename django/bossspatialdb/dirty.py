@@ -0,0 +1,230 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tracking of the cuboids written since a channel was downsampled
+
+Once a channel has a resolution hierarchy, every cutout write adds the
+cuboids it touched to a Redis set per channel and resolution, in the cache
+Redis used by SpatialDB. Each member is '<time sample>&<morton id>', where
+the morton id interleaves the cuboid's x, y, and z indices.
+
+An incremental downsample moves the tracked cuboids into a snapshot set
+(merging any snapshot left by a failed incremental downsample) and
+recomputes only the cuboids above them in the hierarchy. The snapshot is
+deleted when the downsample succeeds. A full downsample takes the same
+snapshot, without reading it, so the cuboids stay tracked if it fails.
+"""
+
+from django.conf import settings
+
+from spdb.spatialdb.rediskvio import RedisKVIO
+
+DIRTY_KEY = 'DIRTY-CUBOIDS&{}&{}'
+SNAPSHOT_KEY = 'DIRTY-CUBOIDS-SNAPSHOT&{}&{}'
+
+# KEYS[1] - Dirty set
+# ARGV[1] - '1' to start tracking the channel if it isn't tracked already
+# ARGV[2:] - Members to add, in batches because unpack() is limited by the Lua stack size
+MARK_SCRIPT = """
+local added = 0
+if ARGV[1] == '1' or redis.call('EXISTS', KEYS[1]) == 1 then
+    for i = 2, #ARGV, 1000 do
+        added = added + redis.call('SADD', KEYS[1], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+    end
+end
+return added
+"""
+
+# KEYS[1] - Dirty set
+# KEYS[2] - Snapshot set
+# ARGV[1] - '1' to return the members of the snapshot
+SNAPSHOT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    if redis.call('EXISTS', KEYS[2]) == 1 then
+        redis.call('SUNIONSTORE', KEYS[2], KEYS[2], KEYS[1])
+        redis.call('DEL', KEYS[1])
+    else
+        redis.call('RENAME', KEYS[1], KEYS[2])
+    end
+end
+if ARGV[1] == '1' then
+    return redis.call('SMEMBERS', KEYS[2])
+end
+return {}
+"""
+
+
+def morton_encode(x, y, z):
+    """Interleave the bits of cuboid indices into a morton id
+
+    Args:
+        x (int): X index of the cuboid
+        y (int): Y index of the cuboid
+        z (int): Z index of the cuboid
+
+    Returns:
+        (int)
+    """
+    morton = 0
+    bit = 0
+    while x or y or z:
+        morton |= (x & 1) << bit | (y & 1) << (bit + 1) | (z & 1) << (bit + 2)
+        x >>= 1
+        y >>= 1
+        z >>= 1
+        bit += 3
+    return morton
+
+
+def morton_decode(morton):
+    """Split a morton id into cuboid indices
+
+    Args:
+        morton (int): Morton id from morton_encode()
+
+    Returns:
+        (tuple[int]): (x, y, z) index of the cuboid
+    """
+    x = y = z = 0
+    bit = 0
+    while morton:
+        x |= (morton & 1) << bit
+        y |= (morton >> 1 & 1) << bit
+        z |= (morton >> 2 & 1) << bit
+        morton >>= 3
+        bit += 1
+    return x, y, z
+
+
+def cuboid_indices(corner, extent, cuboid_size):
+    """Get the indices of the cuboids touched by a region
+
+    Args:
+        corner (tuple[int]): (x, y, z) corner of the region
+        extent (tuple[int]): (x, y, z) extent of the region
+        cuboid_size (tuple[int]): (x, y, z) size of a cuboid
+
+    Returns:
+        (list[tuple[int]]): (x, y, z) index of each cuboid
+    """
+    ranges = [range(corner[i] // cuboid_size[i], (corner[i] + extent[i] - 1) // cuboid_size[i] + 1)
+              for i in range(3)]
+    return [(x, y, z) for x in ranges[0] for y in ranges[1] for z in ranges[2]]
+
+
+def parent_indices(index, cuboid_size, parent_cuboid_size, factors):
+    """Get the indices of the cuboids at the next resolution computed from a cuboid
+
+    Args:
+        index (tuple[int]): (x, y, z) index of the cuboid
+        cuboid_size (tuple[int]): (x, y, z) size of a cuboid at the cuboid's resolution
+        parent_cuboid_size (tuple[int]): (x, y, z) size of a cuboid at the next resolution
+        factors (tuple[int]): (x, y, z) block size reduced into each voxel of the next resolution
+
+    Returns:
+        (list[tuple[int]]): (x, y, z) index of each cuboid
+    """
+    start = [index[i] * cuboid_size[i] // factors[i] for i in range(3)]
+    stop = [-(-(index[i] + 1) * cuboid_size[i] // factors[i]) for i in range(3)]  # ceil div
+    return cuboid_indices(start, [b - a for a, b in zip(start, stop)], parent_cuboid_size)
+
+
+def encode_member(time_sample, index):
+    """Get the set member of a cuboid
+
+    Args:
+        time_sample (int): Time sample of the cuboid
+        index (tuple[int]): (x, y, z) index of the cuboid
+
+    Returns:
+        (str)
+    """
+    return '{}&{}'.format(time_sample, morton_encode(*index))
+
+
+def decode_member(member):
+    """Parse a set member
+
+    Args:
+        member (str|bytes): Member from encode_member()
+
+    Returns:
+        (tuple): (time sample, (x, y, z) cuboid index)
+    """
+    if isinstance(member, bytes):
+        member = member.decode('ascii')
+    time_sample, morton = member.split('&')
+    return int(time_sample), morton_decode(int(morton))
+
+
+class DirtyCuboids(object):
+    """Redis sets of the cuboids written since a channel was downsampled
+
+    Args:
+        client (optional[redis.StrictRedis]): Redis client, defaults to SpatialDB's cache client
+    """
+
+    def __init__(self, client=None):
+        if client is None:
+            client = RedisKVIO(settings.KVIO_SETTINGS).cache_client
+        self.client = client
+        self.mark_script = client.register_script(MARK_SCRIPT)
+        self.snapshot_script = client.register_script(SNAPSHOT_SCRIPT)
+
+    def mark(self, lookup_key, resolution, corner, extent, time_range, cuboid_size, start=False):
+        """Record the cuboids touched by a write
+
+        Args:
+            lookup_key (str): Lookup key of the channel
+            resolution (int): Resolution of the write
+            corner (tuple[int]): (x, y, z) corner of the write
+            extent (tuple[int]): (x, y, z) extent of the write
+            time_range (list[int]): [start, stop) time samples of the write
+            cuboid_size (tuple[int]): (x, y, z) size of a cuboid at the resolution
+            start (bool): If tracking should start, otherwise the write is only recorded if the channel's
+                          resolution is already being tracked
+        """
+        indices = cuboid_indices(corner, extent, cuboid_size)
+        members = [encode_member(t, index) for t in range(*time_range) for index in indices]
+        self.mark_script(keys=[DIRTY_KEY.format(lookup_key, resolution)], args=['1' if start else '0'] + members)
+
+    def snapshot(self, lookup_key, resolutions, read=True):
+        """Move the tracked cuboids into the snapshot sets that a downsample processes
+
+        Args:
+            lookup_key (str): Lookup key of the channel
+            resolutions (list[int]): Resolutions to snapshot
+            read (bool): If the snapshot should be returned, a full downsample doesn't need it
+
+        Returns:
+            (dict): Map of resolution to a set of (time sample, (x, y, z) cuboid index), only including resolutions
+                    with tracked cuboids
+        """
+        dirty = {}
+        for resolution in resolutions:
+            members = self.snapshot_script(keys=[DIRTY_KEY.format(lookup_key, resolution),
+                                                 SNAPSHOT_KEY.format(lookup_key, resolution)],
+                                           args=['1' if read else '0'])
+            if members:
+                dirty[resolution] = set(decode_member(member) for member in members)
+        return dirty
+
+    def finish(self, lookup_key, resolutions):
+        """Delete the snapshot sets once a downsample succeeds
+
+        Args:
+            lookup_key (str): Lookup key of the channel
+            resolutions (list[int]): Resolutions of the channel
+        """
+        self.client.delete(*[SNAPSHOT_KEY.format(lookup_key, res) for res in resolutions])
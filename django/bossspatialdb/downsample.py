@@ -0,0 +1,488 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Backends that build a channel's resolution hierarchy
+
+The Downsample view starts, monitors, and cancels downsamples through a
+backend selected by settings.DOWNSAMPLE_BACKEND. Each downsample is
+identified by a handle, which is saved as the channel's downsample_arn, and
+reports its status with the Step Function execution statuses (RUNNING,
+SUCCEEDED, FAILED, TIMED_OUT, ABORTED).
+
+    step_function - Executes the downsample Step Function, which runs
+                    boss-tools/activities/resolution_hierarchy.py
+    local - Downsamples in a background thread of the web server, reducing
+            cuboids in a pool of processes that read through SpatialDB and
+            replace the computed cuboids in the object store. Progress is
+            saved in the channel's downsample_progress. Isotropic copies
+            aren't built, so anisotropic channels that need them are
+            rejected.
+"""
+
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import uuid
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+
+import bossutils
+from bossutils.logger import BossLogger
+from spdb.c_lib.ndlib import XYZMorton
+from spdb.project import BossResourceBasic
+from spdb.spatialdb import Cube
+from spdb.spatialdb.spatialdb import SpatialDB, CUBOIDSIZE
+
+from bosscore.models import Channel
+from . import blockreduce
+from .dirty import parent_indices
+from .sharded import shard_boxes
+
+# Prefix of the handles of local downsamples
+LOCAL_PREFIX = 'local:'
+
+# Django cache keys of a local downsample's state and cancel request
+LOCAL_STATE_KEY = 'boss-downsample:{}'
+LOCAL_CANCEL_KEY = 'boss-downsample:{}:cancel'
+
+
+class StepFunctionDownsample(object):
+    """Downsample with the downsample Step Function
+
+    The Step Function's lambdas are sized for a single downsample at a time
+    """
+    max_running = 1
+
+    # Builds the isotropic copies of anisotropic channels
+    supports_iso = True
+
+    def start(self, args, resource, dirty=None):
+        """Start a downsample
+
+        An incremental downsample's frame arguments must already be narrowed with get_incremental_frame()
+
+        Args:
+            args (dict): Downsample arguments built by the Downsample view
+            resource (BossResourceDjango): Channel to downsample
+            dirty (optional[dict]): Ignored, the Step Function downsamples the whole frame
+
+        Returns:
+            (str): Handle of the downsample
+        """
+        boss_config = bossutils.configuration.BossConfig()
+        session = bossutils.aws.get_session()
+        return bossutils.aws.sfn_execute(session, boss_config['sfn']['downsample_sfn'], dict(args))
+
+    def status(self, handle):
+        """Get the status of a downsample
+
+        Args:
+            handle (str): Handle from start()
+
+        Returns:
+            (str): Step Function execution status
+        """
+        session = bossutils.aws.get_session()
+        return bossutils.aws.sfn_status(session, handle)
+
+    def cancel(self, handle):
+        """Cancel a downsample
+
+        Args:
+            handle (str): Handle from start()
+        """
+        session = bossutils.aws.get_session()
+        bossutils.aws.sfn_cancel(session, handle, error="User Cancel",
+                                 cause="User has requested the downsample operation to stop.")
+
+
+def get_frames(args):
+    """Get the region of the frame downsampled at each resolution
+
+    Args:
+        args (dict): Downsample arguments built by the Downsample view
+
+    Returns:
+        (list[tuple[tuple[int], tuple[int]]]): (x, y, z) start and stop at each resolution, up to resolution_max
+    """
+    factors = get_factors(args['type'])
+    start = [args['x_start'], args['y_start'], args['z_start']]
+    stop = [args['x_stop'], args['y_stop'], args['z_stop']]
+
+    frames = []
+    for _ in range(args['resolution_max']):
+        frames.append((tuple(start), tuple(stop)))
+        start = [s // f for s, f in zip(start, factors)]
+        stop = [-(-s // f) for s, f in zip(stop, factors)]  # ceil div
+    return frames
+
+
+def get_factors(hierarchy_method):
+    """Get the block size reduced into each voxel of the next resolution
+
+    Args:
+        hierarchy_method (str): Experiment's hierarchy method
+
+    Returns:
+        (tuple[int]): (x, y, z) block size
+    """
+    return (2, 2, 2) if hierarchy_method.lower() == 'isotropic' else (2, 2, 1)
+
+
+def needs_iso(args):
+    """Check if a downsample has to build isotropic copies of the resolutions it computes
+
+    Anisotropic channels have an isotropic copy of each resolution above the experiment's isotropic level.
+
+    Args:
+        args (dict): Downsample arguments built by the Downsample view
+
+    Returns:
+        (bool)
+    """
+    return args['type'].lower() != 'isotropic' and args['iso_resolution'] < args['resolution_max'] - 1
+
+
+def get_tasks(args, resource_dict, num_time_samples):
+    """Get the cuboids to compute for each resolution of a downsample
+
+    Args:
+        args (dict): Downsample arguments built by the Downsample view
+        resource_dict (dict): Channel to downsample, from BossResource.to_dict()
+        num_time_samples (int): Number of time samples to downsample
+
+    Returns:
+        (list[list[tuple]]): Arguments of downsample_cuboid() for each cuboid, for each resolution in order
+    """
+    factors = get_factors(args['type'])
+    frames = get_frames(args)
+
+    levels = []
+    for resolution in range(args['resolution'], args['resolution_max'] - 1):
+        start, stop = frames[resolution + 1]
+        extent = tuple(b - a for a, b in zip(start, stop))
+        boxes = shard_boxes(start, extent, CUBOIDSIZE[resolution + 1])
+        levels.append([(resource_dict, resolution, corner, box_extent, factors, t, args['annotation_channel'])
+                       for t in range(num_time_samples) for corner, box_extent in boxes])
+    return levels
+
+
+def get_incremental_tasks(args, resource_dict, dirty):
+    """Get the cuboids to compute for each resolution of an incremental downsample
+
+    Only the cuboids computed from a changed cuboid are recomputed. A cuboid changes if it was written since the
+    last downsample or if it was recomputed at the resolution below. Like every task, the recomputed region replaces
+    the old one with downsample_cuboid(), so data zeroed since the last downsample is cleared above it too.
+
+    Args:
+        args (dict): Downsample arguments built by the Downsample view
+        resource_dict (dict): Channel to downsample, from BossResource.to_dict()
+        dirty (dict): Map of resolution to a set of (time sample, (x, y, z) cuboid index), from
+                      DirtyCuboids.snapshot()
+
+    Returns:
+        (list[list[tuple]]): Arguments of downsample_cuboid() for each cuboid, for each resolution in order
+    """
+    factors = get_factors(args['type'])
+    frames = get_frames(args)
+
+    levels = []
+    changed = set()
+    for resolution in range(args['resolution'], args['resolution_max'] - 1):
+        changed |= dirty.get(resolution, set())
+        parent_size = CUBOIDSIZE[resolution + 1]
+        parents = set((t, parent) for t, index in changed
+                      for parent in parent_indices(index, CUBOIDSIZE[resolution], parent_size, factors))
+
+        # Trim the cuboids to the frame
+        start, stop = frames[resolution + 1]
+        tasks = []
+        for t, parent in sorted(parents):
+            corner = [max(parent[i] * parent_size[i], start[i]) for i in range(3)]
+            end = [min((parent[i] + 1) * parent_size[i], stop[i]) for i in range(3)]
+            if all(a < b for a, b in zip(corner, end)):
+                tasks.append((resource_dict, resolution, tuple(corner), tuple(b - a for a, b in zip(corner, end)),
+                              factors, t, args['annotation_channel']))
+        levels.append(tasks)
+        changed = parents
+    return levels
+
+
+def get_incremental_frame(args, dirty):
+    """Get the frame arguments that cover every cuboid an incremental downsample needs to recompute
+
+    The bounding box of the changed cuboids is expanded to the region covered by a cuboid at the top resolution,
+    so every cuboid above them is recomputed from complete data.
+
+    Args:
+        args (dict): Downsample arguments built by the Downsample view
+        dirty (dict): Map of resolution to a set of (time sample, (x, y, z) cuboid index), from
+                      DirtyCuboids.snapshot()
+
+    Returns:
+        (dict): x, y, and z start and stop arguments, within the original frame
+    """
+    factors = get_factors(args['type'])
+    top = args['resolution_max'] - 1
+
+    start = [None] * 3
+    stop = [None] * 3
+    for resolution, cuboids in dirty.items():
+        size = CUBOIDSIZE[resolution]
+        for _, index in cuboids:
+            for i in range(3):
+                scale = factors[i] ** resolution
+                lo = index[i] * size[i] * scale
+                hi = (index[i] + 1) * size[i] * scale
+                start[i] = lo if start[i] is None else min(start[i], lo)
+                stop[i] = hi if stop[i] is None else max(stop[i], hi)
+
+    frame = {}
+    for i, axis in enumerate('xyz'):
+        align = CUBOIDSIZE[top][i] * factors[i] ** top
+        frame['{}_start'.format(axis)] = max(start[i] // align * align, args['{}_start'.format(axis)])
+        frame['{}_stop'.format(axis)] = min(-(-stop[i] // align) * align, args['{}_stop'.format(axis)])
+    return frame
+
+
+_spatialdb = None
+
+
+def put_cuboid(resource, resolution, index, data, time_sample):
+    """Replace a cuboid in the object store
+
+    SpatialDB.write_cuboid() merges, only overwriting voxels with non-zero data, so zeros couldn't clear a
+    downsampled cuboid. The cuboid is put directly instead and its copy in the SpatialDB cache deleted.
+
+    Args:
+        resource (BossResourceBasic): Channel of the cuboid
+        resolution (int): Resolution of the cuboid
+        index (tuple[int]): (x, y, z) cuboid index
+        data (numpy.ndarray): (1, z, y, x) data of the whole cuboid
+        time_sample (int): Time sample of the cuboid
+    """
+    morton = XYZMorton(list(index))
+    cube = Cube.create_cube(resource, list(CUBOIDSIZE[resolution]), [time_sample, time_sample + 1])
+    cube.data = data
+
+    objectio = _spatialdb.objectio
+    key = objectio.generate_object_key(resource, resolution, time_sample, morton)
+    objectio.put_objects([key], [cube.to_blosc_by_time_index(time_sample)])
+    objectio.add_cuboid_to_index(key)
+
+    kvio = _spatialdb.kvio
+    kvio.cache_client.delete(*kvio.generate_cached_cuboid_keys(resource, resolution, [time_sample], [morton]))
+
+
+def downsample_cuboid(task):
+    """Compute a cuboid of the next resolution from the current resolution
+
+    Runs in a pool process, each of which has its own SpatialDB instance. The computed region replaces the same
+    region of the cuboid there, so zeroed data clears it, and a task trimmed to the frame keeps the rest of the
+    cuboid. An empty region is only skipped if the region there is empty too, which includes a cuboid that doesn't
+    exist.
+
+    Args:
+        task (tuple): (resource_dict, resolution, corner, extent, factors, time_sample, annotation) where corner and
+                      extent are the region at the next resolution, within a single cuboid
+    """
+    global _spatialdb
+    if _spatialdb is None:
+        _spatialdb = SpatialDB(settings.KVIO_SETTINGS,
+                               settings.STATEIO_CONFIG,
+                               settings.OBJECTIO_CONFIG)
+
+    resource_dict, resolution, corner, extent, factors, time_sample, annotation = task
+    resource = BossResourceBasic(resource_dict)
+    time_range = [time_sample, time_sample + 1]
+
+    src_corner, src_extent = blockreduce.source_box(corner, extent, factors)
+    cube = _spatialdb.cutout(resource, src_corner, src_extent, resolution, time_range, access_mode="no_cache")
+    data = blockreduce.block_reduce(cube.data, factors, annotation=annotation)
+
+    size = CUBOIDSIZE[resolution + 1]
+    index = tuple(c // s for c, s in zip(corner, size))
+    cuboid = _spatialdb.cutout(resource, [i * s for i, s in zip(index, size)], list(size), resolution + 1,
+                               time_range, access_mode="no_cache").data
+    x, y, z = (c - i * s for c, i, s in zip(corner, index, size))
+    region = cuboid[:, z:z + extent[2], y:y + extent[1], x:x + extent[0]]
+    if not data.any() and not region.any():
+        return
+    region[:] = data
+    put_cuboid(resource, resolution + 1, index, cuboid, time_sample)
+
+
+def get_python():
+    """Get the Python interpreter that runs the local downsample processes
+
+    Under uWSGI, sys.executable is the uwsgi binary, which can't run the spawned processes, so the interpreter
+    installed with the running Python is used instead, unless settings.DOWNSAMPLE_LOCAL_PYTHON names one.
+
+    Returns:
+        (str): Path of a Python interpreter
+    """
+    if settings.DOWNSAMPLE_LOCAL_PYTHON:
+        return settings.DOWNSAMPLE_LOCAL_PYTHON
+    if os.path.basename(sys.executable).startswith('python'):
+        return sys.executable
+    return os.path.join(sys.exec_prefix, 'bin', 'python{}.{}'.format(*sys.version_info[:2]))
+
+
+def get_pool():
+    """Start the pool of processes that compute cuboids
+
+    Forking a threaded web server process could copy locks held by other threads, so the pool is spawned and sets
+    up Django before it loads any tasks.
+
+    Returns:
+        (multiprocessing.pool.Pool): Pool of settings.DOWNSAMPLE_LOCAL_WORKERS processes
+    """
+    context = multiprocessing.get_context('spawn')
+    context.set_executable(get_python())
+    return context.Pool(settings.DOWNSAMPLE_LOCAL_WORKERS, initializer=django.setup)
+
+
+class LocalDownsample(object):
+    """Downsample in this web server, with a pool of settings.DOWNSAMPLE_LOCAL_WORKERS processes
+
+    Only the anisotropic resolutions are computed, so channels that need isotropic copies are left to the Step
+    Function
+    """
+    supports_iso = False
+
+    @property
+    def max_running(self):
+        return settings.DOWNSAMPLE_LOCAL_MAX_RUNNING
+
+    def start(self, args, resource, dirty=None):
+        """Start a downsample in a background thread
+
+        Args:
+            args (dict): Downsample arguments built by the Downsample view
+            resource (BossResourceDjango): Channel to downsample
+            dirty (optional[dict]): Cuboids written since the last downsample, from DirtyCuboids.snapshot(), to only
+                                    recompute the cuboids above them
+
+        Returns:
+            (str): Handle of the downsample
+        """
+        handle = LOCAL_PREFIX + uuid.uuid4().hex
+        self.save_state(handle, 'RUNNING')
+
+        if dirty:
+            tasks = get_incremental_tasks(args, resource.to_dict(), dirty)
+        else:
+            tasks = get_tasks(args, resource.to_dict(), resource.get_experiment().num_time_samples)
+        thread = threading.Thread(target=self.run, args=(handle, args['channel_id'], tasks), daemon=True)
+        thread.start()
+        return handle
+
+    def status(self, handle):
+        """Get the status of a downsample
+
+        A downsample that hasn't reported progress for settings.DOWNSAMPLE_LOCAL_STALE_SECONDS is assumed to have
+        died with its web server process.
+
+        Args:
+            handle (str): Handle from start()
+
+        Returns:
+            (str): Step Function execution status
+        """
+        state = cache.get(LOCAL_STATE_KEY.format(handle))
+        if state is None:
+            return 'FAILED'
+        if state['status'] == 'RUNNING' and time.time() - state['updated'] > settings.DOWNSAMPLE_LOCAL_STALE_SECONDS:
+            return 'TIMED_OUT'
+        return state['status']
+
+    def cancel(self, handle):
+        """Ask a downsample to stop
+
+        Args:
+            handle (str): Handle from start()
+        """
+        cache.set(LOCAL_CANCEL_KEY.format(handle), True, settings.DOWNSAMPLE_LOCAL_STALE_SECONDS)
+
+    def save_state(self, handle, status):
+        """Save the status of a downsample
+
+        Args:
+            handle (str): Handle from start()
+            status (str): Step Function execution status
+        """
+        cache.set(LOCAL_STATE_KEY.format(handle), {'status': status, 'updated': time.time()}, None)
+
+    def run(self, handle, channel_id, levels):
+        """Compute each resolution in order, saving progress in the channel
+
+        Args:
+            handle (str): Handle from start()
+            channel_id (int): Id of the channel being downsampled
+            levels (list[list[tuple]]): Tasks from get_tasks()
+        """
+        total = sum(len(tasks) for tasks in levels)
+        done = 0
+        status = 'SUCCEEDED'
+
+        def save_progress():
+            self.save_state(handle, 'RUNNING')
+            # Update the row directly so progress doesn't invalidate the resource cache
+            Channel.objects.filter(pk=channel_id).update(downsample_progress=100 * done // max(total, 1))
+
+        try:
+            with get_pool() as pool:
+                for tasks in levels:
+                    # Each resolution is computed from the one before it, so levels can't overlap
+                    for _ in pool.imap_unordered(downsample_cuboid, tasks, chunksize=4):
+                        done += 1
+                        if done % 100 == 0:
+                            save_progress()
+                            if cache.get(LOCAL_CANCEL_KEY.format(handle)):
+                                status = 'ABORTED'
+                                pool.terminate()
+                                break
+                    if status != 'SUCCEEDED':
+                        break
+                    save_progress()
+        except Exception:
+            BossLogger().logger.exception("Problem downsampling channel {}".format(channel_id))
+            status = 'FAILED'
+
+        self.save_state(handle, status)
+
+
+# Downsample backends that can be selected with settings.DOWNSAMPLE_BACKEND
+BACKENDS = {
+    'step_function': StepFunctionDownsample,
+    'local': LocalDownsample,
+}
+
+
+def get_backend(handle=None):
+    """Get a downsample backend
+
+    Args:
+        handle (optional[str]): Handle of an existing downsample, which selects the backend that started it
+
+    Returns:
+        (StepFunctionDownsample|LocalDownsample): The backend for the handle, or settings.DOWNSAMPLE_BACKEND
+    """
+    if handle is not None:
+        return LocalDownsample() if handle.startswith(LOCAL_PREFIX) else StepFunctionDownsample()
+    return BACKENDS[settings.DOWNSAMPLE_BACKEND]()
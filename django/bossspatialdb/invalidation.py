@@ -0,0 +1,127 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Removal of a channel's cuboids from the SpatialDB cache
+
+After a downsample the cached cuboids of the channel are stale. SpatialDB
+names the cached cuboid key of every cuboid it reads through the cache
+before paging the missing ones in, including those paged in by lambdas, so
+the SpatialDB instances created with create_spatialdb() record each key
+they name in a Redis set per channel. Clearing a channel deletes the keys in
+its set, so the cost depends on how many of its cuboids have been read
+since the last clear, not on the size of its frame or of the cache.
+
+The removal runs in a background thread, so it doesn't delay the request
+that noticed the downsample finished.
+"""
+
+import threading
+import uuid
+
+from django.conf import settings
+
+import spdb
+from bossutils.logger import BossLogger
+from spdb.spatialdb.rediskvio import RedisKVIO
+
+# Redis set of the cached cuboid keys named for a channel, by lookup key
+CACHED_KEYS_KEY = 'CACHED-CUBOID-KEYS&{}'
+
+# Number of keys deleted with each DEL command
+BATCH_SIZE = 1000
+
+
+def track_cached_cuboids(kvio):
+    """Make an interface to the SpatialDB cache record the cached cuboid keys it names for each channel
+
+    Args:
+        kvio (RedisKVIO): Interface to the SpatialDB cache
+
+    Returns:
+        (RedisKVIO): kvio
+    """
+    generate_keys = kvio.generate_cached_cuboid_keys
+
+    def generate_tracked_keys(resource, resolution, time_sample_list, morton_idx_list, iso=False):
+        keys = generate_keys(resource, resolution, time_sample_list, morton_idx_list, iso=iso)
+        if keys:
+            kvio.cache_client.sadd(CACHED_KEYS_KEY.format(resource.get_lookup_key()), *keys)
+        return keys
+
+    kvio.generate_cached_cuboid_keys = generate_tracked_keys
+    return kvio
+
+
+def create_spatialdb():
+    """Create a SpatialDB instance whose cached cuboids can be found by clear_cached_cuboids()
+
+    Returns:
+        (SpatialDB)
+    """
+    spatialdb = spdb.spatialdb.SpatialDB(settings.KVIO_SETTINGS,
+                                         settings.STATEIO_CONFIG,
+                                         settings.OBJECTIO_CONFIG)
+    track_cached_cuboids(spatialdb.kvio)
+    return spatialdb
+
+
+def clear_cached_cuboids(resource, client=None):
+    """Delete all of a channel's cuboids from the SpatialDB cache
+
+    The channel's set of keys is moved aside first, so keys named while the cuboids are deleted are kept for the
+    next clear.
+
+    Args:
+        resource (BossResourceDjango): Channel to remove from the cache
+        client (optional[redis.StrictRedis]): Redis client, defaults to SpatialDB's cache client
+    """
+    log = BossLogger().logger
+    lookup_key = resource.get_lookup_key()
+
+    try:
+        if client is None:
+            client = RedisKVIO(settings.KVIO_SETTINGS).cache_client
+
+        keys_key = CACHED_KEYS_KEY.format(lookup_key)
+        if not client.exists(keys_key):
+            return
+        clearing_key = '{}&{}'.format(keys_key, uuid.uuid4().hex)
+        client.rename(keys_key, clearing_key)
+
+        log.debug("Clearing cache of {} cubes".format(lookup_key))
+        batch = []
+        for key in client.sscan_iter(clearing_key, count=BATCH_SIZE):
+            batch.append(key)
+            if len(batch) == BATCH_SIZE:
+                client.delete(*batch)
+                batch = []
+        if batch:
+            client.delete(*batch)
+        client.delete(clearing_key)
+    except Exception:
+        log.exception("Problem clearing cache after downsample finished")
+
+
+def start_clear_cached_cuboids(resource):
+    """Delete all of a channel's cuboids from the SpatialDB cache in a background thread
+
+    Args:
+        resource (BossResourceDjango): Channel to remove from the cache
+
+    Returns:
+        (threading.Thread)
+    """
+    thread = threading.Thread(target=clear_cached_cuboids, args=(resource,), daemon=True)
+    thread.start()
+    return thread
@@ -17,6 +17,7 @@ from django.conf import settings
 
 import blosc
 import numpy as np
+import struct
 import zlib
 import io
 
@@ -25,18 +26,86 @@ from bosscore.error import BossParserError, BossError, ErrorCodes
 
 import spdb
 
+from . import compressed_segmentation
 
-def is_too_large(request_obj, bit_depth):
+# Header that prefixes every blosc compressed buffer: version, versionlz, flags, typesize, nbytes, blocksize, cbytes
+BLOSC_HEADER = struct.Struct('<BBBBIII')
+
+# Most bytes blosc adds to the data it compresses, when the data is stored uncompressed
+BLOSC_MAX_OVERHEAD = 16
+
+# Number of bytes to pull off of the request stream per read
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def read_body(stream, content_length, max_length=None):
+    """Read a request body into a single preallocated buffer
+
+    The body is read in chunks directly into the buffer so that only one copy of the (compressed) body exists,
+    instead of the intermediate copies that stream.read() makes while building up a large bytes object.
+
+    Args:
+        stream (stream-like object): Request stream
+        content_length (int|None): Value of the Content-Length header
+        max_length (optional[int]): Largest body accepted, checked before the buffer is allocated
+
+    Returns:
+        (memoryview|bytes): The request body
+
+    Raises:
+        ValueError: If the Content-Length is larger than max_length
+    """
+    if max_length is not None and content_length is not None and content_length > max_length:
+        raise ValueError("Content-Length of {} is over the limit of {}".format(content_length, max_length))
+
+    if not content_length:
+        return stream.read()
+
+    buf = bytearray(content_length)
+    view = memoryview(buf)
+    pos = 0
+    while pos < content_length:
+        chunk = stream.read(min(READ_CHUNK_SIZE, content_length - pos))
+        if not chunk:
+            break
+        view[pos:pos + len(chunk)] = chunk
+        pos += len(chunk)
+
+    return view[:pos]
+
+
+def get_content_length(parser_context):
+    """Get the size of the request body from the Content-Length header
+
+    Args:
+        parser_context (dict): DRF parser context
+
+    Returns:
+        (int|None): Number of bytes in the body or None if the header is missing or invalid
+    """
+    try:
+        return int(parser_context['request'].META.get('CONTENT_LENGTH'))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_too_large(request_obj, bit_depth, encoded_bytes=None):
     """Method to check if a request is too large to handle
 
     Args:
         request_obj:
+        bit_depth (int): Bit depth of the channel
+        encoded_bytes (optional[int]): Size of the posted body, for formats whose size doesn't depend on a guessed
+                                       compression ratio. The body is limited to settings.CUTOUT_MAX_SIZE and the
+                                       decoded data to settings.CUTOUT_MAX_DECODED_SIZE.
 
     Returns:
         bool
     """
     t_span = request_obj.get_time().stop - request_obj.get_time().start
     total_bytes = request_obj.get_x_span() * request_obj.get_y_span() * request_obj.get_z_span() * t_span * bit_depth/8
+    if encoded_bytes is not None:
+        return encoded_bytes > settings.CUTOUT_MAX_SIZE or total_bytes > settings.CUTOUT_MAX_DECODED_SIZE
     if bit_depth == 64:
         # Allow larger annotation posts since things compress so well
         total_bytes /= 4
@@ -61,7 +130,9 @@ class ConsumeReqMixin:
             stream (stream-like object): The stream to consume.
         """
         try:
-            stream.read()
+            # Read in chunks so a large body isn't held in memory
+            while stream.read(READ_CHUNK_SIZE):
+                pass
         except:
             pass
 
@@ -115,18 +186,52 @@ class BloscParser(BaseParser, ConsumeReqMixin):
         try:
             bit_depth = resource.get_bit_depth()
         except ValueError:
+            self.consume_request(stream)
             return BossParserError("Unsupported data type provided to parser: {}".format(resource.get_data_type()),
                                    ErrorCodes.TYPE_ERROR)
 
         # Make sure cutout request is under 500MB UNCOMPRESSED
         if is_too_large(req, bit_depth):
+            self.consume_request(stream)
             return BossParserError("Cutout request is over 500MB when uncompressed. Reduce cutout dimensions.",
                                    ErrorCodes.REQUEST_TOO_LARGE)
 
+        # Shape of the matrix, as given by the URL
+        if req.time_request:
+            # Time series request (even if single time point) - Get 4D matrix
+            shape = (len(req.get_time()), req.get_z_span(), req.get_y_span(), req.get_x_span())
+        else:
+            # Not a time series request (time range [0,1] auto-populated) - Get 3D matrix
+            shape = (req.get_z_span(), req.get_y_span(), req.get_x_span())
+        dtype = np.dtype(resource.get_numpy_data_type())
+        expected_bytes = int(np.prod(shape)) * dtype.itemsize
+
+        # A blosc buffer is never larger than its data plus the blosc overhead
+        try:
+            body = read_body(stream, get_content_length(parser_context), expected_bytes + BLOSC_MAX_OVERHEAD)
+        except ValueError:
+            self.consume_request(stream)
+            return BossParserError("Posted data is larger than the cutout. Verify the datatype of your POSTed data "
+                                   "and xyz dimensions used in the POST URL.", ErrorCodes.REQUEST_TOO_LARGE)
+        except MemoryError:
+            return BossParserError("Ran out of memory reading data.", ErrorCodes.BOSS_SYSTEM_ERROR)
+
+        # Validate the sizes recorded in the blosc header before allocating the output matrix
+        if len(body) < BLOSC_HEADER.size:
+            return BossParserError("Failed to decompress data. Verify the datatype/bitdepth of your data "
+                                   "matches the channel.", ErrorCodes.DATATYPE_DOES_NOT_MATCH)
+        _, _, _, _, nbytes, _, cbytes = BLOSC_HEADER.unpack_from(body)
+        if cbytes != len(body):
+            return BossParserError("Failed to decompress data. Verify the datatype/bitdepth of your data "
+                                   "matches the channel.", ErrorCodes.DATATYPE_DOES_NOT_MATCH)
+        if nbytes != expected_bytes:
+            return BossParserError("Failed to unpack data. Verify the datatype of your POSTed data and "
+                                   "xyz dimensions used in the POST URL.", ErrorCodes.DATA_DIMENSION_MISMATCH)
+
         try:
-            # Decompress
-            raw_data = blosc.decompress(stream.read())
-            data_mat = np.fromstring(raw_data, dtype=resource.get_numpy_data_type())
+            # Decompress directly into the output matrix
+            parsed_data = np.empty(shape, dtype=dtype, order='C')
+            blosc.decompress_ptr(body, parsed_data.__array_interface__['data'][0])
         except MemoryError:
             return BossParserError("Ran out of memory decompressing data.",
                                     ErrorCodes.BOSS_SYSTEM_ERROR)
@@ -134,23 +239,6 @@ class BloscParser(BaseParser, ConsumeReqMixin):
             return BossParserError("Failed to decompress data. Verify the datatype/bitdepth of your data "
                                    "matches the channel.", ErrorCodes.DATATYPE_DOES_NOT_MATCH)
 
-        # Reshape and return
-        try:
-            if req.time_request:
-                # Time series request (even if single time point) - Get 4D matrix
-                parsed_data = np.reshape(data_mat,
-                                         (len(req.get_time()),
-                                          req.get_z_span(),
-                                          req.get_y_span(),
-                                          req.get_x_span()),
-                                         order='C')
-            else:
-                # Not a time series request (time range [0,1] auto-populated) - Get 3D matrix
-                parsed_data = np.reshape(data_mat, (req.get_z_span(), req.get_y_span(), req.get_x_span()), order='C')
-        except ValueError:
-            return BossParserError("Failed to unpack data. Verify the datatype of your POSTed data and "
-                                   "xyz dimensions used in the POST URL.", ErrorCodes.DATA_DIMENSION_MISMATCH)
-
         return req, resource, parsed_data
 
 
@@ -296,3 +384,92 @@ class NpygzParser(BaseParser, ConsumeReqMixin):
                                    "xyz dimensions used in the POST URL.", ErrorCodes.DATA_DIMENSION_MISMATCH)
 
         return req, resource, parsed_data
+
+
+class CompressedSegmentationParser(BaseParser, ConsumeReqMixin):
+    """
+    Parser that handles Neuroglancer compressed segmentation encoded annotation data
+    """
+    media_type = compressed_segmentation.MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        """Method to decode bytes from a POST that contains compressed segmentation encoded uint32 or uint64 data
+
+        Each time sample is encoded as a channel. The block size defaults to settings.CUTOUT_SEGMENTATION_BLOCK_SIZE
+        and can be set with the block_size parameter of the Content-Type (eg. block_size=8,8,8).
+
+        :param stream: Request stream
+        stream type: django.core.handlers.wsgi.WSGIRequest
+        :param media_type:
+        :param parser_context:
+        :return:
+        """
+        try:
+            request_args = {
+                "service": "cutout",
+                "collection_name": parser_context['kwargs']['collection'],
+                "experiment_name": parser_context['kwargs']['experiment'],
+                "channel_name": parser_context['kwargs']['channel'],
+                "resolution": parser_context['kwargs']['resolution'],
+                "x_args": parser_context['kwargs']['x_range'],
+                "y_args": parser_context['kwargs']['y_range'],
+                "z_args": parser_context['kwargs']['z_range'],
+            }
+            if 't_range' in parser_context['kwargs']:
+                request_args["time_args"] = parser_context['kwargs']['t_range']
+            else:
+                request_args["time_args"] = None
+
+            req = BossRequest(parser_context['request'], request_args)
+        except BossError as err:
+            self.consume_request(stream)
+            return BossParserError(err.message, err.error_code)
+        except Exception as err:
+            self.consume_request(stream)
+            return BossParserError(str(err), ErrorCodes.UNHANDLED_EXCEPTION)
+
+        # Convert to Resource
+        resource = spdb.project.BossResourceDjango(req)
+
+        # Only annotation datatypes can be encoded
+        if resource.get_numpy_data_type() not in compressed_segmentation.DATA_TYPES:
+            self.consume_request(stream)
+            return BossParserError("Compressed segmentation only supports uint32 and uint64 data.",
+                                   ErrorCodes.DATATYPE_NOT_SUPPORTED)
+
+        try:
+            block_size = compressed_segmentation.get_block_size(media_type, settings.CUTOUT_SEGMENTATION_BLOCK_SIZE)
+        except ValueError as err:
+            self.consume_request(stream)
+            return BossParserError(str(err), ErrorCodes.INVALID_ARGUMENT)
+
+        # Limit the request by its encoded size, which is known up front
+        content_length = get_content_length(parser_context)
+        if content_length is None:
+            self.consume_request(stream)
+            return BossParserError("Content-Length is required.", ErrorCodes.BAD_REQUEST)
+        if is_too_large(req, resource.get_bit_depth(), content_length):
+            self.consume_request(stream)
+            return BossParserError("Cutout request is too large. Reduce cutout dimensions.",
+                                   ErrorCodes.REQUEST_TOO_LARGE)
+
+        try:
+            body = read_body(stream, content_length)
+        except MemoryError:
+            return BossParserError("Ran out of memory reading data.", ErrorCodes.BOSS_SYSTEM_ERROR)
+
+        shape = (len(req.get_time()), req.get_z_span(), req.get_y_span(), req.get_x_span())
+        try:
+            parsed_data = compressed_segmentation.decode(body, shape, resource.get_numpy_data_type(), block_size)
+        except MemoryError:
+            return BossParserError("Ran out of memory decompressing data.",
+                                    ErrorCodes.BOSS_SYSTEM_ERROR)
+        except ValueError:
+            return BossParserError("Failed to decode data. Verify the block size and xyz dimensions used in the "
+                                   "POST URL.", ErrorCodes.DATA_DIMENSION_MISMATCH)
+
+        # Not a time series request (time range [0,1] auto-populated) - Get 3D matrix
+        if not req.time_request:
+            parsed_data = parsed_data[0]
+
+        return req, resource, parsed_data
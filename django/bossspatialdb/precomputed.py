@@ -0,0 +1,148 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helpers for serving a channel in Neuroglancer's precomputed format
+
+A precomputed volume is an 'info' JSON file describing each scale, plus one
+file per chunk named '<scale key>/<x_start>-<x_stop>_<y_start>-<y_stop>_<z_start>-<z_stop>'.
+Each resolution of the channel is a scale keyed by the resolution, with
+chunks the size of a cuboid laid out from the start of the coordinate frame.
+Each chunk is read from a single cuboid only if the frame starts on a cuboid
+boundary at that resolution. Otherwise a chunk spans up to 8 cuboids.
+Image chunks are raw little endian voxels in x, y, z order and annotation
+chunks are compressed segmentation encoded.
+
+See https://github.com/google/neuroglancer/tree/master/src/neuroglancer/datasource/precomputed
+"""
+
+import numpy as np
+
+from spdb.spatialdb.spatialdb import CUBOIDSIZE
+
+from . import blockreduce
+from . import compressed_segmentation
+
+# Number of nanometers in each voxel unit of a coordinate frame
+VOXEL_UNIT_NM = {
+    'nanometers': 1,
+    'micrometers': 1000,
+    'millimeters': 1000000,
+    'centimeters': 10000000,
+}
+
+
+def get_encoding(data_type, annotation):
+    """Get the precomputed encoding of a channel's chunks
+
+    Args:
+        data_type (str): Numpy datatype of the channel
+        annotation (bool): If the channel is an annotation channel
+
+    Returns:
+        (str): 'compressed_segmentation' or 'raw'
+    """
+    if annotation and data_type in compressed_segmentation.DATA_TYPES:
+        return 'compressed_segmentation'
+    return 'raw'
+
+
+def get_scale(frame_start, frame_stop, voxel_dims, voxel_unit, resolution, encoding, block_size):
+    """Describe a resolution of a channel as a precomputed scale
+
+    Args:
+        frame_start (tuple[int]): (x, y, z) start of the coordinate frame
+        frame_stop (tuple[int]): (x, y, z) stop of the coordinate frame
+        voxel_dims (list[list]): (x, y, z) voxel size at each resolution, from get_downsampled_voxel_dims()
+        voxel_unit (str): Voxel unit of the coordinate frame
+        resolution (int): Resolution of the scale
+        encoding (str): Encoding from get_encoding()
+        block_size (tuple[int]): (x, y, z) block size of compressed segmentation chunks
+
+    Returns:
+        (dict)
+    """
+    factors = blockreduce.get_factors(voxel_dims, resolution, 0)
+    start = [frame_start[i] // factors[i] for i in range(3)]
+    stop = [-(-frame_stop[i] // factors[i]) for i in range(3)]  # ceil div
+    scale = {
+        'key': str(resolution),
+        'size': [stop[i] - start[i] for i in range(3)],
+        'voxel_offset': start,
+        'resolution': [float(d) * VOXEL_UNIT_NM[voxel_unit] for d in voxel_dims[resolution]],
+        'chunk_sizes': [list(CUBOIDSIZE[resolution])],
+        'encoding': encoding,
+    }
+    if encoding == 'compressed_segmentation':
+        scale['compressed_segmentation_block_size'] = list(block_size)
+    return scale
+
+
+def get_info(data_type, annotation, scales):
+    """Build the info file of a channel
+
+    Args:
+        data_type (str): Numpy datatype of the channel
+        annotation (bool): If the channel is an annotation channel
+        scales (list[dict]): Scales from get_scale(), starting with the base resolution
+
+    Returns:
+        (dict)
+    """
+    return {
+        '@type': 'neuroglancer_multiscale_volume',
+        'type': 'segmentation' if annotation else 'image',
+        'data_type': data_type,
+        'num_channels': 1,
+        'scales': scales,
+    }
+
+
+def check_chunk(scale, start, stop):
+    """Check that a chunk is one of a scale's chunks
+
+    Args:
+        scale (dict): Scale from get_scale()
+        start (tuple[int]): (x, y, z) start of the chunk
+        stop (tuple[int]): (x, y, z) stop of the chunk
+
+    Returns:
+        (tuple[tuple[int], tuple[int]]): (x, y, z) corner and extent of the chunk
+
+    Raises:
+        ValueError: If the chunk isn't aligned to the scale's chunk grid or is outside of the scale
+    """
+    chunk_size = scale['chunk_sizes'][0]
+    for i in range(3):
+        offset = scale['voxel_offset'][i]
+        end = min(start[i] + chunk_size[i], offset + scale['size'][i])
+        if start[i] < offset or (start[i] - offset) % chunk_size[i] or stop[i] != end or stop[i] <= start[i]:
+            raise ValueError("Chunk {}-{}_{}-{}_{}-{} is not in scale {}".format(
+                start[0], stop[0], start[1], stop[1], start[2], stop[2], scale['key']))
+    return tuple(start), tuple(stop[i] - start[i] for i in range(3))
+
+
+def encode_chunk(data, encoding, block_size):
+    """Encode a chunk
+
+    Args:
+        data (np.ndarray): (z, y, x) array
+        encoding (str): Encoding from get_encoding()
+        block_size (tuple[int]): (x, y, z) block size of compressed segmentation chunks
+
+    Returns:
+        (bytes)
+    """
+    if encoding == 'compressed_segmentation':
+        return compressed_segmentation.encode(data[np.newaxis], block_size)
+    return np.ascontiguousarray(data, dtype=data.dtype.newbyteorder('<')).tobytes()
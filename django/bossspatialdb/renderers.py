@@ -14,6 +14,7 @@
 
 from rest_framework import renderers
 from rest_framework.renderers import JSONRenderer
+from django.conf import settings
 import blosc
 import numpy as np
 import zlib
@@ -21,6 +22,82 @@ import io
 from PIL import Image
 
 from bosscore.renderer_helper import check_for_403, check_for_429
+from bosscore.error import ErrorCodes
+from . import chunked
+from . import compressed_segmentation
+
+BLOSC_SHUFFLE = {
+    'none': blosc.NOSHUFFLE,
+    'byte': blosc.SHUFFLE,
+    'bit': blosc.BITSHUFFLE,
+}
+
+
+def get_blosc_args(data_type, media_type=None):
+    """Get the blosc compression arguments to use for a cutout
+
+    Defaults come from settings.CUTOUT_BLOSC_SETTINGS for the channel's datatype and can be overridden by the
+    codec, clevel, and shuffle parameters of the accepted media type (eg. application/blosc;codec=lz4;clevel=3).
+
+    Args:
+        data_type (str): Numpy datatype name of the cutout
+        media_type (str): Accepted media type, including any parameters
+
+    Returns:
+        (dict): Keyword arguments for blosc.compress() / blosc.pack_array() (cname, clevel, shuffle)
+
+    Raises:
+        ValueError: If a media type parameter is invalid
+    """
+    blosc_settings = settings.CUTOUT_BLOSC_SETTINGS
+    config = dict(blosc_settings.get(data_type, blosc_settings['default']))
+
+    if media_type:
+        for param in media_type.split(';')[1:]:
+            key, _, value = param.partition('=')
+            key = key.strip().lower()
+            if key in ('codec', 'clevel', 'shuffle'):
+                config[key] = value.strip().lower()
+
+    if config['codec'] not in blosc.compressor_list():
+        raise ValueError("Unsupported blosc codec '{}'. Supported codecs are {}"
+                         .format(config['codec'], ", ".join(blosc.compressor_list())))
+
+    try:
+        clevel = int(config['clevel'])
+    except ValueError:
+        clevel = -1
+    if not 0 <= clevel <= 9:
+        raise ValueError("Invalid blosc clevel '{}'. Must be between 0 and 9".format(config['clevel']))
+
+    if config['shuffle'] not in BLOSC_SHUFFLE:
+        raise ValueError("Invalid blosc shuffle '{}'. Must be one of {}"
+                         .format(config['shuffle'], ", ".join(sorted(BLOSC_SHUFFLE))))
+
+    return {'cname': config['codec'],
+            'clevel': clevel,
+            'shuffle': BLOSC_SHUFFLE[config['shuffle']]}
+
+
+def render_blosc_args_error(renderer, message, renderer_context):
+    """Convert a renderer's response into a 400 JSON error about invalid blosc media type parameters
+
+    Args:
+        renderer (BaseRenderer): The renderer that is rendering the response
+        message (str): Error message for the user
+        renderer_context (dict): DRF renderer context
+
+    Returns:
+        (bytes): The rendered JSON error
+    """
+    renderer_context["response"].status_code = 400
+    renderer_context['response']['Content-Type'] = 'application/json'
+    renderer_context["accepted_media_type"] = 'application/json'
+    renderer.media_type = 'application/json'
+    renderer.format = 'json'
+    err_msg = {"status": 400, "message": message, "code": ErrorCodes.INVALID_ARGUMENT}
+    jr = JSONRenderer()
+    return jr.render(err_msg, 'application/json', renderer_context)
 
 class BloscPythonRenderer(renderers.BaseRenderer):
     """ A DRF renderer for a blosc encoded cube of data using the numpy interface
@@ -36,14 +113,19 @@ class BloscPythonRenderer(renderers.BaseRenderer):
     @check_for_429
     def render(self, data, media_type=None, renderer_context=None):
 
+        try:
+            blosc_args = get_blosc_args(data["data"].data.dtype.name, media_type)
+        except ValueError as err:
+            return render_blosc_args_error(self, str(err), renderer_context)
+
         if not data["data"].data.flags['C_CONTIGUOUS']:
             data["data"].data = np.ascontiguousarray(data["data"].data, dtype=data["data"].data.dtype)
 
         # Return data, squeezing time dimension if only a single point
         if data["time_request"]:
-            return blosc.pack_array(data["data"].data)
+            return blosc.pack_array(data["data"].data, **blosc_args)
         else:
-            return blosc.pack_array(np.squeeze(data["data"].data, axis=(0,)))
+            return blosc.pack_array(np.squeeze(data["data"].data, axis=(0,)), **blosc_args)
 
 
 class BloscRenderer(renderers.BaseRenderer):
@@ -68,15 +150,43 @@ class BloscRenderer(renderers.BaseRenderer):
             jr = JSONRenderer()
             return jr.render(err_msg, 'application/json', renderer_context)
 
+        try:
+            blosc_args = get_blosc_args(data["data"].data.dtype.name, media_type)
+        except ValueError as err:
+            return render_blosc_args_error(self, str(err), renderer_context)
+
         if not data["data"].data.flags['C_CONTIGUOUS']:
             data["data"].data = np.ascontiguousarray(data["data"].data, dtype=data["data"].data.dtype)
 
         # Return data, squeezing time dimension if only a single point
+        typesize = data["data"].data.dtype.itemsize
         if data["time_request"]:
-            return blosc.compress(data["data"].data, typesize=renderer_context['view'].bit_depth)
+            return blosc.compress(data["data"].data, typesize=typesize, **blosc_args)
         else:
-            return blosc.compress(np.squeeze(data["data"].data, axis=(0,)),
-                                  typesize=renderer_context['view'].bit_depth)
+            return blosc.compress(np.squeeze(data["data"].data, axis=(0,)), typesize=typesize, **blosc_args)
+
+
+class BloscChunkedRenderer(renderers.BaseRenderer):
+    """ A DRF renderer for the chunked blosc format
+
+    The Cutout view streams the chunked format itself, so this renderer is only used during content negotiation and
+    to render error responses
+
+    """
+    media_type = chunked.MEDIA_TYPE
+    format = 'bin'
+    charset = None
+    render_style = 'binary'
+
+    @check_for_403
+    @check_for_429
+    def render(self, data, media_type=None, renderer_context=None):
+        renderer_context['response']['Content-Type'] = 'application/json'
+        renderer_context["accepted_media_type"] = 'application/json'
+        self.media_type = 'application/json'
+        self.format = 'json'
+        jr = JSONRenderer()
+        return jr.render(data, 'application/json', renderer_context)
 
 
 class NpygzRenderer(renderers.BaseRenderer):
@@ -113,6 +223,34 @@ class NpygzRenderer(renderers.BaseRenderer):
         return npy_gz_file.read()
 
 
+class CompressedSegmentationRenderer(renderers.BaseRenderer):
+    """ A DRF renderer for a Neuroglancer compressed segmentation encoded cube of uint32 or uint64 data, with each
+    time sample encoded as a channel
+
+    """
+    media_type = compressed_segmentation.MEDIA_TYPE
+    format = 'bin'
+    charset = None
+    render_style = 'binary'
+
+    @check_for_403
+    @check_for_429
+    def render(self, data, media_type=None, renderer_context=None):
+
+        try:
+            block_size = compressed_segmentation.get_block_size(media_type, settings.CUTOUT_SEGMENTATION_BLOCK_SIZE)
+            return compressed_segmentation.encode(data["data"].data, block_size)
+        except ValueError as err:
+            renderer_context["response"].status_code = 400
+            renderer_context['response']['Content-Type'] = 'application/json'
+            renderer_context["accepted_media_type"] = 'application/json'
+            self.media_type = 'application/json'
+            self.format = 'json'
+            err_msg = {"status": 400, "message": str(err), "code": ErrorCodes.DATATYPE_NOT_SUPPORTED}
+            jr = JSONRenderer()
+            return jr.render(err_msg, 'application/json', renderer_context)
+
+
 class JpegRenderer(renderers.BaseRenderer):
     """ A DRF renderer for a jpeg 'sprite sheet' encoded cube of data. Here, we concat z-slices
 
@@ -0,0 +1,212 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Parallel execution of large cutouts and writes
+
+A large cutout is split into sub-boxes aligned to cuboid boundaries.  The
+sub-boxes are read concurrently by a bounded pool of threads, each with its
+own SpatialDB instance, and copied into a single preallocated output array.
+The cache and object store reads release the GIL, so the round trips overlap.
+
+Large writes are split the same way. Because the sub-boxes are aligned, no
+two of them touch the same cuboid, so they can be written concurrently and
+only the sub-boxes at the edges of the region hold partial cuboids.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from spdb.spatialdb import Cube
+from spdb.spatialdb.spatialdb import CUBOIDSIZE
+
+from . import invalidation
+
+_executor = None
+_executor_lock = threading.Lock()
+_thread_data = threading.local()
+
+
+def get_executor():
+    """Get the process wide thread pool used to execute sharded operations
+
+    Returns:
+        (ThreadPoolExecutor)
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.CUTOUT_SHARD_WORKERS)
+        return _executor
+
+
+def get_spatialdb():
+    """Get the SpatialDB instance for the current thread
+
+    Returns:
+        (SpatialDB)
+    """
+    if getattr(_thread_data, 'spatialdb', None) is None:
+        _thread_data.spatialdb = invalidation.create_spatialdb()
+    return _thread_data.spatialdb
+
+
+def aligned_ranges(start, stop, step):
+    """Split a range into pieces aligned to multiples of step
+
+    The first and last pieces are trimmed to the given range.
+
+    Args:
+        start (int): Start of the range
+        stop (int): Stop (exclusive) of the range
+        step (int): Alignment of the piece boundaries
+
+    Returns:
+        (list[tuple[int]]): [start, stop) pairs covering the range
+    """
+    ranges = []
+    while start < stop:
+        end = min((start // step + 1) * step, stop)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def shard_boxes(corner, extent, shard_size):
+    """Split a region into sub-boxes aligned to multiples of the shard size
+
+    Args:
+        corner (tuple[int]): (x, y, z) corner of the region
+        extent (tuple[int]): (x, y, z) extent of the region
+        shard_size (tuple[int]): (x, y, z) size of a shard, normally a multiple of the cuboid size
+
+    Returns:
+        (list[tuple[tuple[int], tuple[int]]]): List of (corner, extent) sub-boxes
+    """
+    axes = [aligned_ranges(corner[i], corner[i] + extent[i], shard_size[i]) for i in range(3)]
+
+    boxes = []
+    for (x0, x1), (y0, y1), (z0, z1) in itertools.product(*axes):
+        boxes.append(((x0, y0, z0), (x1 - x0, y1 - y0, z1 - z0)))
+    return boxes
+
+
+def get_shard_size(resolution):
+    """Get the size of a shard at the given resolution
+
+    Args:
+        resolution (int): Resolution of the request
+
+    Returns:
+        (list[int]): (x, y, z) size of a shard in voxels
+    """
+    return [c * n for c, n in zip(CUBOIDSIZE[resolution], settings.CUTOUT_SHARD_CUBOIDS)]
+
+
+def use_sharded_cutout(corner, extent, num_time_samples, bit_depth, resolution):
+    """Determine if a cutout or write is large enough to be executed in parallel shards
+
+    Args:
+        corner (tuple[int]): (x, y, z) corner of the cutout
+        extent (tuple[int]): (x, y, z) extent of the cutout
+        num_time_samples (int): Number of time samples in the cutout
+        bit_depth (int): Bit depth of the channel
+        resolution (int): Resolution of the cutout
+
+    Returns:
+        (bool)
+    """
+    if settings.CUTOUT_SHARD_WORKERS < 2:
+        return False
+
+    total_bytes = extent[0] * extent[1] * extent[2] * num_time_samples * bit_depth / 8
+    if total_bytes < settings.CUTOUT_SHARD_MIN_SIZE:
+        return False
+
+    return len(shard_boxes(corner, extent, get_shard_size(resolution))) > 1
+
+
+def cutout(resource, corner, extent, resolution, time_range, filter_ids=None, iso=False, access_mode="cache"):
+    """Perform a cutout by reading cuboid aligned shards of the region in parallel
+
+    Takes the same arguments as SpatialDB.cutout()
+
+    Args:
+        resource (BossResource): Resource for the request
+        corner (tuple[int]): (x, y, z) corner of the cutout
+        extent (tuple[int]): (x, y, z) extent of the cutout
+        resolution (int): Resolution of the cutout
+        time_range (list[int]): [start, stop) time samples of the cutout
+        filter_ids (optional[list]): Annotation ids to filter the cutout on
+        iso (bool): If the isotropic copy of the data should be used
+        access_mode (str): Cache access mode
+
+    Returns:
+        (Cube): Cube containing the whole cutout
+    """
+    shape = (time_range[1] - time_range[0], extent[2], extent[1], extent[0])
+    output = np.empty(shape, dtype=resource.get_numpy_data_type())
+
+    def fetch(box):
+        box_corner, box_extent = box
+        cube = get_spatialdb().cutout(resource, box_corner, box_extent, resolution, time_range,
+                                      filter_ids=filter_ids, iso=iso, access_mode=access_mode)
+
+        x = box_corner[0] - corner[0]
+        y = box_corner[1] - corner[1]
+        z = box_corner[2] - corner[2]
+        output[:, z:z + box_extent[2], y:y + box_extent[1], x:x + box_extent[0]] = cube.data
+
+    boxes = shard_boxes(corner, extent, get_shard_size(resolution))
+    executor = get_executor()
+    for future in [executor.submit(fetch, box) for box in boxes]:
+        # Re-raises any exception from the worker thread
+        future.result()
+
+    cube = Cube.create_cube(resource, list(extent), time_range)
+    cube.data = output
+    return cube
+
+
+def write(resource, corner, resolution, data, time_sample, iso=False):
+    """Perform a write by writing cuboid aligned shards of the region in parallel
+
+    Takes the same arguments as SpatialDB.write_cuboid()
+
+    Args:
+        resource (BossResource): Resource for the request
+        corner (tuple[int]): (x, y, z) corner of the write
+        resolution (int): Resolution of the write
+        data (np.ndarray): (t, z, y, x) data to write
+        time_sample (int): First time sample of the data
+        iso (bool): If the isotropic copy of the data should be written
+    """
+    extent = (data.shape[3], data.shape[2], data.shape[1])
+
+    def store(box):
+        box_corner, box_extent = box
+        x = box_corner[0] - corner[0]
+        y = box_corner[1] - corner[1]
+        z = box_corner[2] - corner[2]
+        block = np.ascontiguousarray(data[:, z:z + box_extent[2], y:y + box_extent[1], x:x + box_extent[0]])
+        get_spatialdb().write_cuboid(resource, box_corner, resolution, block, time_sample, iso=iso)
+
+    boxes = shard_boxes(corner, extent, get_shard_size(resolution))
+    executor = get_executor()
+    for future in [executor.submit(store, box) for box in boxes]:
+        # Re-raises any exception from the worker thread
+        future.result()
@@ -0,0 +1,69 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+
+from bossspatialdb import blockreduce
+
+
+class TestBlockReduce(unittest.TestCase):
+
+    def test_get_factors(self):
+        anisotropic = [[4, 4, 35], [8, 8, 35], [16, 16, 35]]
+        self.assertEqual(blockreduce.get_factors(anisotropic, 2, 0), (4, 4, 1))
+        self.assertEqual(blockreduce.get_factors(anisotropic, 2, 1), (2, 2, 1))
+
+        isotropic = [[4, 4, 4], [8, 8, 8]]
+        self.assertEqual(blockreduce.get_factors(isotropic, 1, 0), (2, 2, 2))
+
+    def test_source_box(self):
+        self.assertEqual(blockreduce.source_box((10, 20, 3), (5, 6, 7), (2, 2, 1)),
+                         ((20, 40, 3), (10, 12, 7)))
+
+    def test_reduce_mean(self):
+        data = np.arange(2 * 4 * 4, dtype=np.uint8).reshape(1, 2, 4, 4)
+        reduced = blockreduce.block_reduce(data, (2, 2, 1))
+
+        self.assertEqual(reduced.shape, (1, 2, 2, 2))
+        self.assertEqual(reduced.dtype, np.uint8)
+        self.assertEqual(reduced[0, 0, 0, 0], np.rint(np.mean([0, 1, 4, 5])))
+        self.assertEqual(reduced[0, 1, 1, 1], np.rint(np.mean([26, 27, 30, 31])))
+
+    def test_reduce_mean_isotropic(self):
+        data = np.ones((2, 4, 4, 4), dtype=np.uint16) * 300
+        reduced = blockreduce.block_reduce(data, (2, 2, 2))
+        self.assertEqual(reduced.shape, (2, 2, 2, 2))
+        self.assertTrue((reduced == 300).all())
+
+    def test_reduce_mode(self):
+        data = np.zeros((1, 1, 2, 4), dtype=np.uint64)
+        # Most common value
+        data[0, 0, :, 0:2] = [[5, 7], [7, 7]]
+        # Non-zero values are preferred over a more common zero
+        data[0, 0, :, 2:4] = [[0, 0], [0, 9]]
+        reduced = blockreduce.block_reduce(data, (2, 2, 1), annotation=True)
+
+        self.assertEqual(reduced.dtype, np.uint64)
+        np.testing.assert_array_equal(reduced, [[[[7, 9]]]])
+
+    def test_reduce_mode_ties_and_zeros(self):
+        data = np.array([[[[3, 2], [2, 3]], [[0, 0], [0, 0]]]], dtype=np.uint32)
+        reduced = blockreduce.block_reduce(data, (2, 2, 1), annotation=True)
+        np.testing.assert_array_equal(reduced, [[[[2]], [[0]]]])
+
+    def test_no_reduction(self):
+        data = np.ones((1, 2, 2, 2), dtype=np.uint8)
+        self.assertIs(blockreduce.block_reduce(data, (1, 1, 1)), data)
@@ -0,0 +1,72 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from bossspatialdb import bulk
+
+CUBOID = (512, 512, 16)
+
+
+class TestBulk(unittest.TestCase):
+
+    def test_parse_boxes(self):
+        boxes = bulk.parse_boxes({'boxes': [[0, 10, 20, 40, 3, 4], ['5', '6', '7', '8', '9', '10']]}, 10)
+        self.assertEqual(boxes, [((0, 20, 3), (10, 20, 1)), ((5, 7, 9), (1, 1, 1))])
+
+    def test_parse_boxes_invalid(self):
+        with self.assertRaises(ValueError):
+            bulk.parse_boxes({}, 10)
+        with self.assertRaises(ValueError):
+            bulk.parse_boxes({'boxes': []}, 10)
+        with self.assertRaises(ValueError):
+            bulk.parse_boxes({'boxes': [[0, 10, 0, 10, 0]]}, 10)
+        with self.assertRaises(ValueError):
+            bulk.parse_boxes({'boxes': [[10, 0, 0, 10, 0, 1]]}, 10)
+        with self.assertRaises(ValueError):
+            bulk.parse_boxes({'boxes': [[0, 1, 0, 1, 0, 1]] * 11}, 10)
+
+    def test_parse_time_range(self):
+        self.assertIsNone(bulk.parse_time_range({}))
+        self.assertEqual(bulk.parse_time_range({'time_range': [2, 5]}), '2:5')
+        with self.assertRaises(ValueError):
+            bulk.parse_time_range({'time_range': [2]})
+
+    def test_cuboid_indices(self):
+        self.assertEqual(bulk.cuboid_indices((0, 0, 0), (512, 512, 16), CUBOID), [(0, 0, 0)])
+        self.assertEqual(bulk.cuboid_indices((500, 0, 15), (20, 10, 2), CUBOID),
+                         [(0, 0, 0), (0, 0, 1), (1, 0, 0), (1, 0, 1)])
+
+    def test_cluster_shared_cuboids(self):
+        boxes = [((0, 0, 0), (64, 64, 4)),
+                 ((2000, 2000, 0), (64, 64, 4)),
+                 ((100, 100, 8), (64, 64, 4))]
+        regions = bulk.cluster_boxes(boxes, CUBOID)
+
+        self.assertEqual(regions, [((0, 0, 0), (164, 164, 12), [0, 2]),
+                                   ((2000, 2000, 0), (64, 64, 4), [1])])
+
+    def test_cluster_chained(self):
+        # Boxes joined through a third box are read together
+        boxes = [((0, 0, 0), (10, 10, 1)),
+                 ((600, 0, 0), (10, 10, 1)),
+                 ((500, 0, 0), (20, 10, 1))]
+        regions = bulk.cluster_boxes(boxes, CUBOID)
+        self.assertEqual(regions, [((0, 0, 0), (610, 10, 1), [0, 1, 2])])
+
+    def test_cluster_wasteful(self):
+        # A diagonal chain's bounding box touches many cuboids none of the boxes need, so its boxes are read alone
+        boxes = [((i * 512 + 500, i * 512 + 500, 0), (20, 20, 1)) for i in range(8)]
+        regions = bulk.cluster_boxes(boxes, CUBOID)
+        self.assertEqual(regions, [(corner, extent, [i]) for i, (corner, extent) in enumerate(boxes)])
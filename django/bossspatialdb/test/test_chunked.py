@@ -0,0 +1,121 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import numpy as np
+
+from bossspatialdb import chunked
+
+
+class TestChunkedFormat(unittest.TestCase):
+
+    def test_z_slabs_aligned(self):
+        self.assertEqual(chunked.z_slabs(0, 32, 16), [(0, 16), (16, 32)])
+
+    def test_z_slabs_unaligned(self):
+        self.assertEqual(chunked.z_slabs(5, 40, 16), [(5, 16), (16, 32), (32, 40)])
+
+    def test_z_slabs_single(self):
+        self.assertEqual(chunked.z_slabs(3, 7, 16), [(3, 7)])
+
+    def test_stream_header_round_trip(self):
+        buf = chunked.encode_stream_header(np.uint16, [2, 5], 7, time_axis=True)
+        self.assertEqual(len(buf), chunked.STREAM_HEADER.size)
+
+        header = chunked.decode_stream_header(buf)
+        self.assertEqual(header['dtype'], np.dtype(np.uint16))
+        self.assertEqual(header['time_range'], [2, 5])
+        self.assertEqual(header['frame_count'], 7)
+        self.assertTrue(header['time_axis'])
+
+    def test_stream_header_bad_magic(self):
+        with self.assertRaises(ValueError):
+            chunked.decode_stream_header(b'\0' * chunked.STREAM_HEADER.size)
+
+    def test_frames_round_trip(self):
+        data = np.random.randint(1, 2**16, (20, 30, 40), dtype=np.uint16)
+
+        buf = chunked.encode_stream_header(data.dtype, [0, 1], 2)
+        buf += chunked.encode_frame(data[:11], (100, 200, 5))
+        buf += chunked.encode_frame(data[11:], (100, 200, 16))
+
+        frames = list(chunked.iter_frames(buf))
+        self.assertEqual(len(frames), 2)
+        self.assertEqual(frames[0][0], (100, 200, 5))
+        self.assertEqual(frames[1][0], (100, 200, 16))
+        np.testing.assert_array_equal(np.concatenate([f[1] for f in frames]), data)
+
+    def test_frames_round_trip_time_axis(self):
+        data = np.random.randint(1, 2**8, (3, 4, 30, 40), dtype=np.uint8)
+
+        buf = chunked.encode_stream_header(data.dtype, [0, 3], 1, time_axis=True)
+        buf += chunked.encode_frame(data, (0, 0, 0))
+
+        frames = list(chunked.iter_frames(buf))
+        np.testing.assert_array_equal(frames[0][1], data)
+
+    def test_version(self):
+        self.assertEqual(chunked.get_version(None), chunked.STREAM_VERSION)
+        self.assertEqual(chunked.get_version('application/blosc-chunked;codec=lz4'), chunked.STREAM_VERSION)
+        self.assertEqual(chunked.get_version('application/blosc-chunked; version=2'), chunked.INDEXED_VERSION)
+        with self.assertRaises(ValueError):
+            chunked.get_version('application/blosc-chunked;version=3')
+
+    def test_indexed_round_trip(self):
+        data = np.random.randint(1, 2**16, (20, 30, 40), dtype=np.uint16)
+        frames = [chunked.encode_frame(data[:11], (0, 0, 5)), chunked.encode_frame(data[11:], (0, 0, 16))]
+
+        buf = chunked.encode_stream_header(data.dtype, [0, 1], 2, version=chunked.INDEXED_VERSION)
+        buf += chunked.encode_index([len(f) for f in frames]) + b''.join(frames)
+
+        self.assertEqual(chunked.decode_stream_header(buf)['version'], chunked.INDEXED_VERSION)
+        index = chunked.decode_index(buf)
+        self.assertEqual(index[0], (chunked.STREAM_HEADER.size + 2 * chunked.INDEX_ENTRY.size, len(frames[0])))
+        for (offset, length), frame in zip(index, frames):
+            self.assertEqual(buf[offset:offset + length], frame)
+
+        decoded = np.concatenate([f[1] for f in chunked.iter_frames(buf)])
+        np.testing.assert_array_equal(decoded, data)
+
+    def test_parse_range(self):
+        self.assertEqual(chunked.parse_range('bytes=0-99', 1000), (0, 100))
+        self.assertEqual(chunked.parse_range('bytes=900-', 1000), (900, 1000))
+        self.assertEqual(chunked.parse_range('bytes=900-2000', 1000), (900, 1000))
+        self.assertEqual(chunked.parse_range('bytes=-100', 1000), (900, 1000))
+        self.assertEqual(chunked.parse_range('bytes=-2000', 1000), (0, 1000))
+
+    def test_parse_range_ignored(self):
+        for value in ('items=0-10', 'bytes=0-10,20-30', 'bytes=a-b', 'bytes=50-10'):
+            self.assertIsNone(chunked.parse_range(value, 1000))
+
+    def test_parse_range_unsatisfiable(self):
+        for value in ('bytes=1000-', 'bytes=-0'):
+            with self.assertRaises(ValueError):
+                chunked.parse_range(value, 1000)
+
+    def test_frames_in_range(self):
+        prefix = chunked.STREAM_HEADER.size + 3 * chunked.INDEX_ENTRY.size
+        lengths = [100, 200, 300]
+
+        # Resuming from the middle of the second frame
+        self.assertEqual(chunked.frames_in_range(lengths, prefix + 150, prefix + 600), (1, 3, prefix + 100))
+
+        # A range in the first frame
+        self.assertEqual(chunked.frames_in_range(lengths, prefix, prefix + 100), (0, 1, prefix))
+
+        # A range that starts in the stream header
+        self.assertEqual(chunked.frames_in_range(lengths, 0, prefix + 1), (0, 1, prefix))
+
+        # Only the stream header and index
+        self.assertEqual(chunked.frames_in_range(lengths, 0, prefix), (3, 3, prefix + 600))
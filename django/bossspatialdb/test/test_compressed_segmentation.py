@@ -0,0 +1,96 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+
+from bossspatialdb import compressed_segmentation
+
+
+class TestCompressedSegmentation(unittest.TestCase):
+
+    def test_single_id_block(self):
+        data = np.full((1, 8, 8, 8), 5, dtype=np.uint32)
+        words = np.frombuffer(compressed_segmentation.encode(data), dtype='<u4')
+
+        # Channel offset, table offset with 0 bits per index, index offset, table
+        np.testing.assert_array_equal(words, [1, 2, 3, 5])
+
+    def test_uint64_table(self):
+        data = np.zeros((1, 8, 8, 8), dtype=np.uint64)
+        data[0, 0, 0, 0] = 2 ** 40 + 3
+        words = np.frombuffer(compressed_segmentation.encode(data), dtype='<u4')
+
+        # 1 bit indices, after a table of two ids, low word first
+        self.assertEqual(words[1], 2 | (1 << 24))
+        self.assertEqual(words[2], 6)
+        np.testing.assert_array_equal(words[3:7], [0, 0, 3, 2 ** 8])
+        self.assertEqual(words[7], 1)
+        self.assertEqual(len(words), 1 + 6 + 512 // 32)
+
+    def test_round_trip(self):
+        rng = np.random.RandomState(0)
+        for dtype in ('uint32', 'uint64'):
+            for shape, block_size in [((1, 5, 9, 13), (8, 8, 8)),
+                                      ((2, 16, 64, 64), (8, 8, 8)),
+                                      ((1, 3, 4, 5), (2, 3, 1))]:
+                data = rng.randint(0, 3, size=shape).astype(dtype)
+                data[..., :2] = 2 ** 31 + 7
+                encoded = compressed_segmentation.encode(data, block_size)
+                decoded = compressed_segmentation.decode(encoded, shape, dtype, block_size)
+                np.testing.assert_array_equal(decoded, data)
+
+    def test_round_trip_many_ids(self):
+        data = np.arange(2 * 10 * 20 * 30, dtype=np.uint64).reshape(2, 10, 20, 30) * 2 ** 33
+        encoded = compressed_segmentation.encode(data)
+        np.testing.assert_array_equal(compressed_segmentation.decode(encoded, data.shape, 'uint64'), data)
+
+    def test_round_trip_each_index_width(self):
+        # Runs every gather, scatter, and packing path, including on the numpy pinned in requirements.txt
+        block_size = (64, 64, 32)
+        for bits in compressed_segmentation.INDEX_BITS:
+            data = (np.arange(32 * 64 * 64, dtype=np.uint64) % np.uint64(2 ** int(bits))).reshape(1, 32, 64, 64)
+            encoded = compressed_segmentation.encode(data, block_size)
+            self.assertEqual(np.frombuffer(encoded, dtype='<u4')[1] >> 24, bits)
+            decoded = compressed_segmentation.decode(encoded, data.shape, 'uint64', block_size)
+            np.testing.assert_array_equal(decoded, data)
+
+    def test_sparse_is_small(self):
+        data = np.zeros((1, 16, 256, 256), dtype=np.uint64)
+        data[0, :, 64:192, 64:192] = 12345
+        self.assertLess(len(compressed_segmentation.encode(data)), data.nbytes // 50)
+
+    def test_unsupported_dtype(self):
+        with self.assertRaises(ValueError):
+            compressed_segmentation.encode(np.zeros((1, 8, 8, 8), dtype=np.uint8))
+        with self.assertRaises(ValueError):
+            compressed_segmentation.decode(b'', (1, 8, 8, 8), 'uint16')
+
+    def test_truncated(self):
+        data = np.arange(512, dtype=np.uint32).reshape(1, 8, 8, 8)
+        encoded = compressed_segmentation.encode(data)
+        with self.assertRaises(ValueError):
+            compressed_segmentation.decode(encoded[:-4], data.shape, 'uint32')
+        with self.assertRaises(ValueError):
+            compressed_segmentation.decode(encoded[:-1], data.shape, 'uint32')
+
+    def test_block_size(self):
+        self.assertEqual(compressed_segmentation.get_block_size(None, (8, 8, 8)), (8, 8, 8))
+        self.assertEqual(compressed_segmentation.get_block_size(
+            'application/compressed-segmentation; block_size=16,16,4', (8, 8, 8)), (16, 16, 4))
+        for value in ('16,16', 'a,b,c', '8,0,8'):
+            with self.assertRaises(ValueError):
+                compressed_segmentation.get_block_size(
+                    'application/compressed-segmentation;block_size=' + value, (8, 8, 8))
@@ -0,0 +1,86 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from bossspatialdb import dirty
+
+CUBOID = (512, 512, 16)
+
+
+class TestDirtyCuboids(unittest.TestCase):
+
+    def test_morton(self):
+        self.assertEqual(dirty.morton_encode(0, 0, 0), 0)
+        self.assertEqual(dirty.morton_encode(1, 0, 0), 1)
+        self.assertEqual(dirty.morton_encode(0, 1, 0), 2)
+        self.assertEqual(dirty.morton_encode(0, 0, 1), 4)
+        self.assertEqual(dirty.morton_encode(2, 0, 0), 8)
+
+        for index in [(0, 0, 0), (5, 9, 3), (1023, 77, 4096)]:
+            self.assertEqual(dirty.morton_decode(dirty.morton_encode(*index)), index)
+
+    def test_members(self):
+        member = dirty.encode_member(3, (5, 9, 1))
+        self.assertEqual(dirty.decode_member(member), (3, (5, 9, 1)))
+        self.assertEqual(dirty.decode_member(member.encode('ascii')), (3, (5, 9, 1)))
+
+    def test_cuboid_indices(self):
+        self.assertEqual(dirty.cuboid_indices((0, 0, 0), (512, 512, 16), CUBOID), [(0, 0, 0)])
+        self.assertEqual(dirty.cuboid_indices((510, 0, 15), (4, 1, 2), CUBOID),
+                         [(0, 0, 0), (0, 0, 1), (1, 0, 0), (1, 0, 1)])
+
+    def test_parent_indices(self):
+        self.assertEqual(dirty.parent_indices((3, 2, 5), CUBOID, CUBOID, (2, 2, 1)), [(1, 1, 5)])
+        self.assertEqual(dirty.parent_indices((3, 2, 5), CUBOID, CUBOID, (2, 2, 2)), [(1, 1, 2)])
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis isn't installed")
+class TestDirtyCuboidsRedis(unittest.TestCase):
+
+    def setUp(self):
+        self.tracker = dirty.DirtyCuboids(fakeredis.FakeStrictRedis())
+
+    def test_mark_large_write(self):
+        # More members than Lua can unpack at once
+        self.tracker.mark('1&2&3', 0, (0, 0, 0), (512 * 100, 512 * 100, 16), [0, 2], CUBOID, start=True)
+        changed = self.tracker.snapshot('1&2&3', [0])
+        self.assertEqual(len(changed[0]), 100 * 100 * 2)
+
+    def test_mark_untracked(self):
+        self.tracker.mark('1&2&3', 0, (0, 0, 0), (512, 512, 16), [0, 1], CUBOID)
+        self.assertEqual(self.tracker.snapshot('1&2&3', [0]), {})
+
+    def test_full_downsample_fails(self):
+        self.tracker.mark('1&2&3', 0, (0, 0, 0), (512, 512, 16), [0, 1], CUBOID, start=True)
+        self.assertEqual(self.tracker.snapshot('1&2&3', [0, 1], read=False), {})
+
+        # Written while the downsample is in progress
+        self.tracker.mark('1&2&3', 0, (512, 0, 0), (512, 512, 16), [0, 1], CUBOID, start=True)
+
+        # Without finish() both writes are still downsampled by the next incremental downsample
+        self.assertEqual(self.tracker.snapshot('1&2&3', [0, 1]), {0: {(0, (0, 0, 0)), (0, (1, 0, 0))}})
+
+    def test_full_downsample_succeeds(self):
+        self.tracker.mark('1&2&3', 0, (0, 0, 0), (512, 512, 16), [0, 1], CUBOID, start=True)
+        self.tracker.snapshot('1&2&3', [0, 1], read=False)
+        self.tracker.mark('1&2&3', 0, (512, 0, 0), (512, 512, 16), [0, 1], CUBOID, start=True)
+        self.tracker.finish('1&2&3', [0, 1])
+
+        self.assertEqual(self.tracker.snapshot('1&2&3', [0, 1]), {0: {(0, (1, 0, 0))}})
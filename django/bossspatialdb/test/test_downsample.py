@@ -0,0 +1,221 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from bossspatialdb import downsample
+
+CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def get_args(hierarchy_method='anisotropic', resolution=0, resolution_max=3, iso_resolution=3):
+    return {
+        'x_start': 0, 'y_start': 0, 'z_start': 0,
+        'x_stop': 2048, 'y_stop': 1024, 'z_stop': 40,
+        'resolution': resolution,
+        'resolution_max': resolution_max,
+        'type': hierarchy_method,
+        'iso_resolution': iso_resolution,
+        'annotation_channel': False,
+    }
+
+
+def get_spatialdb(source, parent):
+    spatialdb = MagicMock()
+    spatialdb.cutout.side_effect = [MagicMock(data=source), MagicMock(data=parent)]
+    return spatialdb
+
+
+@override_settings(CACHES=CACHES, DOWNSAMPLE_BACKEND='local', DOWNSAMPLE_LOCAL_STALE_SECONDS=60)
+class TestDownsample(SimpleTestCase):
+
+    def test_frames_anisotropic(self):
+        frames = downsample.get_frames(get_args())
+        self.assertEqual(frames, [((0, 0, 0), (2048, 1024, 40)),
+                                  ((0, 0, 0), (1024, 512, 40)),
+                                  ((0, 0, 0), (512, 256, 40))])
+
+    def test_frames_isotropic(self):
+        args = get_args('isotropic')
+        args['x_start'] = 3
+        frames = downsample.get_frames(args)
+        self.assertEqual(frames[1], ((1, 0, 0), (1024, 512, 20)))
+        self.assertEqual(frames[2], ((0, 0, 0), (512, 256, 10)))
+
+    def test_tasks(self):
+        levels = downsample.get_tasks(get_args(), {}, 2)
+
+        # Resolutions 1 and 2 are computed
+        self.assertEqual(len(levels), 2)
+
+        # 2 x 1 x 3 cuboids at resolution 1 for each time sample
+        self.assertEqual(len(levels[0]), 2 * 1 * 3 * 2)
+        _, resolution, corner, extent, factors, time_sample, annotation = levels[0][0]
+        self.assertEqual((resolution, corner, extent, factors, time_sample, annotation),
+                         (0, (0, 0, 0), (512, 512, 16), (2, 2, 1), 0, False))
+
+        # The last z slab is trimmed to the frame
+        self.assertIn(({}, 0, (512, 0, 32), (512, 512, 8), (2, 2, 1), 1, False), levels[0])
+
+    def test_tasks_from_base_resolution(self):
+        levels = downsample.get_tasks(get_args(resolution=1), {}, 1)
+        self.assertEqual(len(levels), 1)
+        self.assertEqual(levels[0][0][1], 1)
+
+    def test_needs_iso(self):
+        self.assertFalse(downsample.needs_iso(get_args()))
+        self.assertFalse(downsample.needs_iso(get_args(iso_resolution=2)))
+        self.assertTrue(downsample.needs_iso(get_args(iso_resolution=1)))
+        self.assertFalse(downsample.needs_iso(get_args('isotropic', iso_resolution=0)))
+
+    def test_get_backend(self):
+        self.assertIsInstance(downsample.get_backend(), downsample.LocalDownsample)
+        self.assertIsInstance(downsample.get_backend('local:1234'), downsample.LocalDownsample)
+        self.assertIsInstance(downsample.get_backend('arn:aws:states:us-east-1:1234:execution:x'),
+                              downsample.StepFunctionDownsample)
+
+    def test_local_status(self):
+        backend = downsample.LocalDownsample()
+        self.assertEqual(backend.status('local:missing'), 'FAILED')
+
+        backend.save_state('local:1', 'RUNNING')
+        self.assertEqual(backend.status('local:1'), 'RUNNING')
+
+        downsample.cache.set(downsample.LOCAL_STATE_KEY.format('local:1'),
+                             {'status': 'RUNNING', 'updated': time.time() - 120}, None)
+        self.assertEqual(backend.status('local:1'), 'TIMED_OUT')
+
+    def test_incremental_tasks(self):
+        changed = {0: {(0, (3, 1, 2)), (0, (2, 0, 2))}}
+        levels = downsample.get_incremental_tasks(get_args(resolution_max=3), {}, changed)
+        self.assertEqual(len(levels), 2)
+
+        # Both cuboids are computed into the same cuboid at resolution 1, which is trimmed to the frame
+        self.assertEqual(levels[0], [({}, 0, (512, 0, 32), (512, 512, 8), (2, 2, 1), 0, False)])
+        self.assertEqual(levels[1], [({}, 1, (0, 0, 32), (512, 256, 8), (2, 2, 1), 0, False)])
+
+    def test_incremental_tasks_outside_frame(self):
+        levels = downsample.get_incremental_tasks(get_args(), {}, {0: {(0, (100, 0, 0))}})
+        self.assertEqual(levels, [[], []])
+
+    def test_incremental_frame(self):
+        frame = downsample.get_incremental_frame(get_args(), {0: {(0, (3, 1, 2))}})
+
+        # Aligned to a resolution 2 cuboid, 2048 x 2048 x 16 at resolution 0, and trimmed to the frame
+        self.assertEqual(frame, {'x_start': 0, 'x_stop': 2048,
+                                 'y_start': 0, 'y_stop': 1024,
+                                 'z_start': 32, 'z_stop': 40})
+
+    @patch('bossspatialdb.downsample.put_cuboid')
+    @patch('bossspatialdb.downsample.BossResourceBasic')
+    def test_downsample_cuboid(self, resource_class, put_cuboid):
+        # A region trimmed to the frame, inside resolution 1 cuboid (1, 0, 0)
+        task = ({}, 0, (514, 2, 0), (2, 2, 1), (2, 2, 1), 0, False)
+        zeros = np.zeros((1, 1, 4, 4), dtype=np.uint8)
+
+        def get_cuboid():
+            return np.ones((1, 16, 512, 512), dtype=np.uint8)
+
+        # Written over whatever is there, keeping the rest of the cuboid
+        with patch('bossspatialdb.downsample._spatialdb', get_spatialdb(zeros + 2, get_cuboid())) as spatialdb:
+            downsample.downsample_cuboid(task)
+            self.assertEqual(spatialdb.cutout.call_args[0][1:4], ([512, 0, 0], [512, 512, 16], 1))
+            _, resolution, index, cuboid, time_sample = put_cuboid.call_args[0]
+            self.assertEqual((resolution, index, time_sample), (1, (1, 0, 0), 0))
+            self.assertTrue((cuboid[0, 0, 2:4, 2:4] == 2).all())
+            self.assertEqual(cuboid.sum(), cuboid.size + 4)
+
+        # Zeroed data clears the region of an old non-empty cuboid
+        with patch('bossspatialdb.downsample._spatialdb', get_spatialdb(zeros, get_cuboid())):
+            downsample.downsample_cuboid(task)
+            cuboid = put_cuboid.call_args[0][3]
+            self.assertFalse(cuboid[0, 0, 2:4, 2:4].any())
+            self.assertEqual(cuboid.sum(), cuboid.size - 4)
+
+        # Not written if the region there is already empty or doesn't exist
+        put_cuboid.reset_mock()
+        with patch('bossspatialdb.downsample._spatialdb', get_spatialdb(zeros, get_cuboid() * 0)):
+            downsample.downsample_cuboid(task)
+            put_cuboid.assert_not_called()
+
+    @patch('bossspatialdb.downsample.put_cuboid')
+    @patch('bossspatialdb.downsample.BossResourceBasic')
+    def test_incremental_clears_zeroed_data(self, resource_class, put_cuboid):
+        # Cuboid (3, 1, 2) was zeroed since the last downsample
+        levels = downsample.get_incremental_tasks(get_args(), {}, {0: {(0, (3, 1, 2))}})
+        task = levels[0][0]
+        source = np.zeros((1, 8, 1024, 1024), dtype=np.uint8)
+        cuboid = np.ones((1, 16, 512, 512), dtype=np.uint8)
+
+        with patch('bossspatialdb.downsample._spatialdb', get_spatialdb(source, cuboid)):
+            downsample.downsample_cuboid(task)
+
+        # The region computed from it is cleared, the rest of the cuboid is kept
+        _, resolution, index, cuboid, _ = put_cuboid.call_args[0]
+        self.assertEqual((resolution, index), (1, (1, 0, 2)))
+        self.assertFalse(cuboid[0, :8].any())
+        self.assertTrue(cuboid[0, 8:].all())
+
+    @patch('bossspatialdb.downsample.Cube')
+    @patch('bossspatialdb.downsample.XYZMorton', return_value=5)
+    def test_put_cuboid(self, morton, cube_class):
+        cube = cube_class.create_cube.return_value
+        data = np.zeros((1, 16, 512, 512), dtype=np.uint8)
+
+        with patch('bossspatialdb.downsample._spatialdb') as spatialdb:
+            downsample.put_cuboid('resource', 1, (1, 0, 0), data, 3)
+
+            # Replaced in the object store, not merged through SpatialDB
+            objectio = spatialdb.objectio
+            objectio.generate_object_key.assert_called_once_with('resource', 1, 3, 5)
+            key = objectio.generate_object_key.return_value
+            objectio.put_objects.assert_called_once_with([key], [cube.to_blosc_by_time_index.return_value])
+            objectio.add_cuboid_to_index.assert_called_once_with(key)
+            spatialdb.write_cuboid.assert_not_called()
+            self.assertIs(cube.data, data)
+
+            # The stale copy is removed from the cache
+            spatialdb.kvio.generate_cached_cuboid_keys.assert_called_once_with('resource', 1, [3], [5])
+            self.assertTrue(spatialdb.kvio.cache_client.delete.called)
+
+    @patch('bossspatialdb.downsample.get_pool')
+    @patch('bossspatialdb.downsample.Channel')
+    def test_local_run(self, channel_class, get_pool):
+        pool = get_pool.return_value.__enter__.return_value
+        pool.imap_unordered.side_effect = lambda fn, tasks, chunksize: iter(tasks)
+
+        backend = downsample.LocalDownsample()
+        backend.run('local:2', 1, [[1, 2], [3]])
+
+        self.assertEqual(pool.imap_unordered.call_count, 2)
+        self.assertEqual(backend.status('local:2'), 'SUCCEEDED')
+
+    @override_settings(DOWNSAMPLE_LOCAL_PYTHON=None)
+    def test_python_under_uwsgi(self):
+        with patch('sys.executable', '/usr/bin/uwsgi'):
+            python = downsample.get_python()
+        self.assertNotEqual(python, '/usr/bin/uwsgi')
+        self.assertTrue(os.access(python, os.X_OK))
+
+    @override_settings(DOWNSAMPLE_LOCAL_PYTHON=None, DOWNSAMPLE_LOCAL_WORKERS=2)
+    def test_spawn_pool_under_uwsgi(self):
+        # The spawned processes must start even though the web server's executable isn't Python
+        with patch('sys.executable', '/usr/bin/uwsgi'):
+            with downsample.get_pool() as pool:
+                self.assertEqual(sorted(pool.map(abs, [-1, -2, -3])), [1, 2, 3])
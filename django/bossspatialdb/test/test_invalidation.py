@@ -0,0 +1,72 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from unittest.mock import MagicMock
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from bossspatialdb import invalidation
+
+
+class FakeKVIO(object):
+    def __init__(self, client):
+        self.cache_client = client
+
+    def generate_cached_cuboid_keys(self, resource, resolution, time_samples, mortons, iso=False):
+        prefix = "CACHED-CUBOID&ISO&" if iso else "CACHED-CUBOID&"
+        return ["{}{}&{}&{}&{}".format(prefix, resource.get_lookup_key(), resolution, t, m)
+                for t in time_samples for m in mortons]
+
+
+def get_resource(lookup_key):
+    resource = MagicMock()
+    resource.get_lookup_key.return_value = lookup_key
+    return resource
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis isn't installed")
+class TestInvalidation(unittest.TestCase):
+
+    def setUp(self):
+        self.client = fakeredis.FakeStrictRedis()
+        self.kvio = invalidation.track_cached_cuboids(FakeKVIO(self.client))
+
+    def cache(self, lookup_key, resolution, time_samples, mortons, iso=False):
+        for key in self.kvio.generate_cached_cuboid_keys(get_resource(lookup_key), resolution, time_samples, mortons,
+                                                         iso=iso):
+            self.client.set(key, b'cuboid')
+
+    def test_track(self):
+        keys = self.kvio.generate_cached_cuboid_keys(get_resource('1&2&3'), 0, [0, 1], [5, 6])
+        self.assertEqual(len(keys), 4)
+        self.assertEqual(self.client.smembers('CACHED-CUBOID-KEYS&1&2&3'), set(key.encode() for key in keys))
+
+    def test_clear(self):
+        self.cache('1&2&3', 0, [0], range(2500))
+        self.cache('1&2&3', 4, [0, 1], [7], iso=True)
+        self.cache('1&2&4', 0, [0], [1])
+
+        invalidation.clear_cached_cuboids(get_resource('1&2&3'), client=self.client)
+
+        # Only the other channel's cuboid and its set are left
+        self.assertEqual(set(self.client.keys()), {b'CACHED-CUBOID&1&2&4&0&0&1', b'CACHED-CUBOID-KEYS&1&2&4'})
+
+    def test_clear_untracked(self):
+        self.client.set('CACHED-CUBOID&1&2&3&0&0&1', b'cuboid')
+        invalidation.clear_cached_cuboids(get_resource('1&2&3'), client=self.client)
+        self.assertEqual(self.client.keys(), [b'CACHED-CUBOID&1&2&3&0&0&1'])
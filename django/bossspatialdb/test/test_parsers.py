@@ -0,0 +1,92 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import unittest
+from unittest.mock import MagicMock, patch
+
+import blosc
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from bossspatialdb import parsers
+
+
+class TestReadBody(unittest.TestCase):
+
+    def test_read_body(self):
+        data = bytes(range(256)) * 100
+        body = parsers.read_body(io.BytesIO(data), len(data))
+        self.assertEqual(bytes(body), data)
+
+    @patch('bossspatialdb.parsers.READ_CHUNK_SIZE', 7)
+    def test_read_body_multiple_chunks(self):
+        data = bytes(range(256)) * 3
+        body = parsers.read_body(io.BytesIO(data), len(data))
+        self.assertEqual(bytes(body), data)
+
+    def test_read_body_short_stream(self):
+        data = b'abc'
+        body = parsers.read_body(io.BytesIO(data), 10)
+        self.assertEqual(bytes(body), data)
+
+    def test_read_body_no_content_length(self):
+        data = b'abcdef'
+        self.assertEqual(parsers.read_body(io.BytesIO(data), None), data)
+
+    def test_read_body_over_limit(self):
+        stream = io.BytesIO(b'x' * 100)
+        with self.assertRaises(ValueError):
+            parsers.read_body(stream, 2 ** 40, 100)
+
+        # Nothing was read or allocated
+        self.assertEqual(stream.tell(), 0)
+
+    def test_read_body_at_limit(self):
+        data = b'x' * 100
+        self.assertEqual(bytes(parsers.read_body(io.BytesIO(data), len(data), 100)), data)
+
+    def test_blosc_overhead(self):
+        data = np.random.randint(0, 256, 4096).astype(np.uint8).tobytes()
+        self.assertLessEqual(len(blosc.compress(data, typesize=1)), len(data) + parsers.BLOSC_MAX_OVERHEAD)
+
+    def test_blosc_header(self):
+        data = np.arange(1000, dtype=np.uint16)
+        compressed = blosc.compress(data, typesize=2)
+        _, _, _, typesize, nbytes, _, cbytes = parsers.BLOSC_HEADER.unpack_from(compressed)
+        self.assertEqual(typesize, 2)
+        self.assertEqual(nbytes, data.nbytes)
+        self.assertEqual(cbytes, len(compressed))
+
+
+@override_settings(CUTOUT_MAX_SIZE=1000, CUTOUT_MAX_DECODED_SIZE=4000)
+class TestIsTooLarge(SimpleTestCase):
+
+    def get_request(self, x, y, z):
+        req = MagicMock()
+        req.get_time.return_value = range(0, 1)
+        req.get_x_span.return_value = x
+        req.get_y_span.return_value = y
+        req.get_z_span.return_value = z
+        return req
+
+    def test_annotation_allowance(self):
+        self.assertFalse(parsers.is_too_large(self.get_request(10, 10, 5), 64))
+        self.assertTrue(parsers.is_too_large(self.get_request(10, 10, 6), 64))
+
+    def test_encoded_size(self):
+        req = self.get_request(10, 10, 5)
+        self.assertFalse(parsers.is_too_large(req, 64, encoded_bytes=1000))
+        self.assertTrue(parsers.is_too_large(req, 64, encoded_bytes=1001))
+        self.assertTrue(parsers.is_too_large(self.get_request(10, 10, 6), 64, encoded_bytes=10))
@@ -0,0 +1,92 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+
+from bossspatialdb import compressed_segmentation
+from bossspatialdb import precomputed
+
+# (x, y, z) voxel size of each resolution of an anisotropic experiment
+VOXEL_DIMS = [[4, 4, 40], [8, 8, 40], [16, 16, 40]]
+
+
+def get_scale(resolution=0, encoding='raw'):
+    return precomputed.get_scale((0, 0, 0), (2000, 1000, 50), VOXEL_DIMS, 'nanometers', resolution, encoding,
+                                 (8, 8, 8))
+
+
+class TestPrecomputed(unittest.TestCase):
+
+    def test_encoding(self):
+        self.assertEqual(precomputed.get_encoding('uint8', False), 'raw')
+        self.assertEqual(precomputed.get_encoding('uint64', True), 'compressed_segmentation')
+        self.assertEqual(precomputed.get_encoding('uint32', True), 'compressed_segmentation')
+
+    def test_scale(self):
+        scale = get_scale(1)
+        self.assertEqual(scale['key'], '1')
+        self.assertEqual(scale['size'], [1000, 500, 50])
+        self.assertEqual(scale['voxel_offset'], [0, 0, 0])
+        self.assertEqual(scale['resolution'], [8.0, 8.0, 40.0])
+        self.assertEqual(scale['chunk_sizes'], [[512, 512, 16]])
+        self.assertNotIn('compressed_segmentation_block_size', scale)
+
+    def test_scale_units(self):
+        scale = precomputed.get_scale((3, 0, 0), (2001, 1000, 50), VOXEL_DIMS, 'micrometers', 2, 'raw', (8, 8, 8))
+        self.assertEqual(scale['resolution'], [16000.0, 16000.0, 40000.0])
+        self.assertEqual(scale['voxel_offset'], [0, 0, 0])
+        self.assertEqual(scale['size'], [501, 250, 50])
+
+    def test_segmentation_info(self):
+        scale = get_scale(encoding='compressed_segmentation')
+        self.assertEqual(scale['compressed_segmentation_block_size'], [8, 8, 8])
+        info = precomputed.get_info('uint64', True, [scale])
+        self.assertEqual(info['type'], 'segmentation')
+        self.assertEqual(info['data_type'], 'uint64')
+        self.assertEqual(info['num_channels'], 1)
+
+    def test_check_chunk(self):
+        scale = get_scale()
+        self.assertEqual(precomputed.check_chunk(scale, (512, 0, 16), (1024, 512, 32)),
+                         ((512, 0, 16), (512, 512, 16)))
+
+        # Chunks at the edge of the volume are clipped
+        self.assertEqual(precomputed.check_chunk(scale, (1536, 512, 48), (2000, 1000, 50)),
+                         ((1536, 512, 48), (464, 488, 2)))
+
+    def test_check_chunk_invalid(self):
+        scale = get_scale()
+        for start, stop in [((1, 0, 0), (513, 512, 16)),
+                            ((0, 0, 0), (256, 512, 16)),
+                            ((0, 0, 0), (1024, 512, 16)),
+                            ((1536, 0, 0), (2048, 512, 16)),
+                            ((2048, 0, 0), (2000, 512, 16))]:
+            with self.assertRaises(ValueError):
+                precomputed.check_chunk(scale, start, stop)
+
+    def test_encode_raw(self):
+        data = np.arange(2 * 3 * 4, dtype=np.uint16).reshape(2, 3, 4)
+        encoded = precomputed.encode_chunk(data, 'raw', (8, 8, 8))
+
+        # x varies fastest
+        self.assertEqual(np.frombuffer(encoded, dtype='<u2').tolist(), list(range(24)))
+
+    def test_encode_segmentation(self):
+        data = np.zeros((4, 8, 8), dtype=np.uint64)
+        data[1, 2, 3] = 7
+        encoded = precomputed.encode_chunk(data, 'compressed_segmentation', (8, 8, 8))
+        decoded = compressed_segmentation.decode(encoded, (1, 4, 8, 8), 'uint64', (8, 8, 8))
+        np.testing.assert_array_equal(decoded[0], data)
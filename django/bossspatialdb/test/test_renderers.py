@@ -0,0 +1,75 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest.mock import patch
+
+from django.apps import apps
+from django.test import SimpleTestCase, override_settings
+import blosc
+
+from bossspatialdb.renderers import get_blosc_args
+
+BLOSC_SETTINGS = {
+    'default': {'codec': 'blosclz', 'clevel': 9, 'shuffle': 'byte'},
+    'uint64': {'codec': 'lz4', 'clevel': 7, 'shuffle': 'bit'},
+}
+
+
+@override_settings(CUTOUT_BLOSC_SETTINGS=BLOSC_SETTINGS, CUTOUT_BLOSC_NTHREADS=1)
+class TestGetBloscArgs(SimpleTestCase):
+
+    def test_default(self):
+        args = get_blosc_args('uint8', 'application/blosc')
+        self.assertEqual(args, {'cname': 'blosclz', 'clevel': 9, 'shuffle': blosc.SHUFFLE})
+
+    def test_datatype(self):
+        args = get_blosc_args('uint64', 'application/blosc')
+        self.assertEqual(args, {'cname': 'lz4', 'clevel': 7, 'shuffle': blosc.BITSHUFFLE})
+
+    def test_media_type_params(self):
+        args = get_blosc_args('uint16', 'application/blosc; codec=LZ4;clevel=3; shuffle=none')
+        self.assertEqual(args, {'cname': 'lz4', 'clevel': 3, 'shuffle': blosc.NOSHUFFLE})
+
+    def test_unknown_params_ignored(self):
+        args = get_blosc_args('uint16', 'application/blosc;q=0.9')
+        self.assertEqual(args['cname'], 'blosclz')
+
+    def test_invalid_codec(self):
+        with self.assertRaises(ValueError):
+            get_blosc_args('uint8', 'application/blosc;codec=foo')
+
+    def test_invalid_clevel(self):
+        with self.assertRaises(ValueError):
+            get_blosc_args('uint8', 'application/blosc;clevel=10')
+        with self.assertRaises(ValueError):
+            get_blosc_args('uint8', 'application/blosc;clevel=high')
+
+    def test_invalid_shuffle(self):
+        with self.assertRaises(ValueError):
+            get_blosc_args('uint8', 'application/blosc;shuffle=word')
+
+
+class TestBloscThreads(SimpleTestCase):
+
+    @override_settings(CUTOUT_BLOSC_NTHREADS=3)
+    def test_set_at_startup(self):
+        with patch('bossspatialdb.apps.blosc.set_nthreads') as set_nthreads:
+            apps.get_app_config('bossspatialdb').ready()
+        set_nthreads.assert_called_once_with(3)
+
+    @override_settings(CUTOUT_BLOSC_SETTINGS=BLOSC_SETTINGS)
+    def test_not_set_per_request(self):
+        with patch('bossspatialdb.renderers.blosc.set_nthreads') as set_nthreads:
+            get_blosc_args('uint8', 'application/blosc')
+        set_nthreads.assert_not_called()
@@ -13,7 +13,7 @@
 # limitations under the License.
 
 from django.core.urlresolvers import resolve
-from ..views import Cutout
+from ..views import Cutout, BulkCutout, PrecomputedInfo, PrecomputedChunk
 
 from rest_framework.test import APITestCase
 
@@ -48,3 +48,34 @@ class CutoutInterfaceRoutingTests(APITestCase):
         view_based_cutout = resolve('/' + version + '/cutout/col1/exp1/ds1/2/0:5/0:6/0:2/5:57')
         self.assertEqual(view_based_cutout.func.__name__, Cutout.as_view().__name__)
 
+
+    def test_bulk_cutout_resolves_to_bulk_cutout(self):
+        """
+        Test to make sure the bulk cutout URL resolves
+        :return:
+        """
+        view_based_cutout = resolve('/' + version + '/cutout/col1/exp1/ds1/2/bulk/')
+        self.assertEqual(view_based_cutout.func.__name__, BulkCutout.as_view().__name__)
+
+    def test_precomputed_info_resolves_to_precomputed_info(self):
+        """
+        Test to make sure the precomputed info URL resolves, with and without a time sample
+        :return:
+        """
+        view_based_info = resolve('/' + version + '/precomputed/col1/exp1/ds1/info')
+        self.assertEqual(view_based_info.func.__name__, PrecomputedInfo.as_view().__name__)
+        self.assertIsNone(view_based_info.kwargs['time_sample'])
+
+        view_based_info = resolve('/' + version + '/precomputed/col1/exp1/ds1/t3/info')
+        self.assertEqual(view_based_info.kwargs['time_sample'], '3')
+
+    def test_precomputed_chunk_resolves_to_precomputed_chunk(self):
+        """
+        Test to make sure the precomputed chunk URL resolves
+        :return:
+        """
+        view_based_chunk = resolve('/' + version + '/precomputed/col1/exp1/ds1/t2/1/512-1024_0-512_16-32')
+        self.assertEqual(view_based_chunk.func.__name__, PrecomputedChunk.as_view().__name__)
+        self.assertEqual(view_based_chunk.kwargs['resolution'], '1')
+        self.assertEqual(view_based_chunk.kwargs['x_stop'], '1024')
+        self.assertEqual(view_based_chunk.kwargs['z_start'], '16')
@@ -0,0 +1,66 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from bossspatialdb import sharded
+from bossspatialdb.sharded import aligned_ranges, shard_boxes
+
+
+class TestShardBoxes(unittest.TestCase):
+
+    def test_aligned_ranges(self):
+        self.assertEqual(aligned_ranges(0, 1024, 512), [(0, 512), (512, 1024)])
+        self.assertEqual(aligned_ranges(100, 1100, 512), [(100, 512), (512, 1024), (1024, 1100)])
+        self.assertEqual(aligned_ranges(10, 20, 512), [(10, 20)])
+        self.assertEqual(aligned_ranges(10, 10, 512), [])
+
+    def test_shard_boxes_cover_region(self):
+        corner = (100, 50, 3)
+        extent = (1500, 600, 40)
+        boxes = shard_boxes(corner, extent, (1024, 1024, 32))
+
+        self.assertEqual(len(boxes), 2 * 1 * 2)
+        self.assertEqual(sum(e[0] * e[1] * e[2] for _, e in boxes), extent[0] * extent[1] * extent[2])
+        self.assertIn(((100, 50, 3), (924, 600, 29)), boxes)
+        self.assertIn(((1024, 50, 32), (576, 600, 11)), boxes)
+
+    def test_shard_boxes_single(self):
+        boxes = shard_boxes((0, 0, 0), (512, 512, 16), (1024, 1024, 32))
+        self.assertEqual(boxes, [((0, 0, 0), (512, 512, 16))])
+
+
+class TestShardedWrite(unittest.TestCase):
+
+    @patch('bossspatialdb.sharded.get_spatialdb')
+    def test_write_shards(self, get_spatialdb):
+        writes = []
+        get_spatialdb.return_value.write_cuboid.side_effect = \
+            lambda resource, corner, res, data, t, iso=False: writes.append((corner, data))
+
+        corner = (100, 0, 3)
+        data = np.random.randint(1, 255, (1, 40, 10, 1500), dtype=np.uint8)
+        sharded.write(None, corner, 0, data, 0)
+
+        # Every shard is aligned to the shard size and written once
+        self.assertEqual(sorted(c for c, _ in writes), [(100, 0, 3), (100, 0, 32), (1024, 0, 3), (1024, 0, 32)])
+        output = np.zeros(data.shape, dtype=data.dtype)
+        for (x, y, z), block in writes:
+            self.assertTrue(block.flags['C_CONTIGUOUS'])
+            x, y, z = x - corner[0], y - corner[1], z - corner[2]
+            output[:, z:z + block.shape[1], y:y + block.shape[2], x:x + block.shape[3]] = block
+        np.testing.assert_array_equal(output, data)
@@ -0,0 +1,170 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from bossspatialdb import writebehind
+
+CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def get_resource():
+    resource = MagicMock()
+    resource.to_dict.return_value = {'lookup_key': '1&2&3'}
+    resource.get_lookup_key.return_value = '1&2&3'
+    return resource
+
+
+@override_settings(CACHES=CACHES, CUTOUT_ASYNC_MIN_FREE_BYTES=0, CUTOUT_ASYNC_JOB_TTL=60)
+class TestWriteBehind(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        writebehind._pending.clear()
+        self.spool_dir = tempfile.mkdtemp()
+        self.settings = override_settings(CUTOUT_ASYNC_SPOOL_DIR=self.spool_dir)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.spool_dir)
+
+    @patch('bossspatialdb.writebehind.submit')
+    def test_spool(self, submit):
+        data = np.arange(2 * 4 * 8 * 16, dtype=np.uint8).reshape(2, 4, 8, 16)
+        job = writebehind.spool(get_resource(), (0, 8, 16), 0, data, 3, False, 'alice')
+
+        self.assertEqual(job['status'], writebehind.QUEUED)
+        self.assertEqual(writebehind.get_job(job['job_id'])['user'], 'alice')
+        submit.assert_called_once_with(job['job_id'])
+
+        data_path, args_path = writebehind.get_paths(job['job_id'])
+        np.testing.assert_array_equal(np.load(data_path), data)
+        self.assertTrue(os.path.exists(args_path))
+
+    @override_settings(CUTOUT_ASYNC_MIN_FREE_BYTES=2 ** 62)
+    @patch('bossspatialdb.writebehind.submit')
+    def test_spool_full(self, submit):
+        with self.assertRaises(OSError):
+            writebehind.spool(get_resource(), (0, 0, 0), 0, np.zeros((1, 1, 1, 1), np.uint8), 0, False, 'alice')
+        self.assertEqual(os.listdir(self.spool_dir), [])
+        submit.assert_not_called()
+
+    @patch('bossspatialdb.writebehind.Channel')
+    @patch('bossspatialdb.writebehind.record_write')
+    @patch('bossspatialdb.writebehind.write')
+    @patch('bossspatialdb.writebehind.BossResourceBasic')
+    @patch('bossspatialdb.writebehind.submit')
+    def test_run_job(self, submit, resource_class, write, record_write, channel_class):
+        data = np.ones((2, 4, 8, 16), dtype=np.uint16)
+        job = writebehind.spool(get_resource(), (0, 8, 16), 1, data, 3, True, 'alice')
+        writebehind.run_job(job['job_id'])
+
+        args = write.call_args[0]
+        self.assertEqual(args[1], (0, 8, 16))
+        self.assertEqual(args[2], 1)
+        np.testing.assert_array_equal(args[3], data)
+        self.assertEqual(args[4], 3)
+        self.assertTrue(write.call_args[1]['iso'])
+
+        # The downsample status is read when the job runs, not when it was queued
+        channel_class.objects.get.assert_called_once_with(pk=3)
+        record_write.assert_called_once_with(resource_class.return_value, (0, 8, 16), 1, (16, 8, 4), [3, 5],
+                                             channel=channel_class.objects.get.return_value)
+
+        self.assertEqual(writebehind.get_job(job['job_id'])['status'], writebehind.DONE)
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    @patch('bossspatialdb.writebehind.write', side_effect=Exception('boom'))
+    @patch('bossspatialdb.writebehind.BossResourceBasic')
+    @patch('bossspatialdb.writebehind.submit')
+    def test_run_job_failed(self, submit, resource_class, write):
+        job = writebehind.spool(get_resource(), (0, 0, 0), 0, np.ones((1, 1, 1, 1), np.uint8), 0, False, 'alice')
+        writebehind.run_job(job['job_id'])
+
+        state = writebehind.get_job(job['job_id'])
+        self.assertEqual(state['status'], writebehind.FAILED)
+        self.assertEqual(state['error'], 'boom')
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+        # A failed job still releases its channel
+        writebehind.check_channel('1&2&3')
+
+    @patch('bossspatialdb.writebehind.is_running', side_effect=lambda pid: pid == os.getpid())
+    @patch('bossspatialdb.writebehind.submit')
+    def test_recover(self, submit, is_running):
+        data = np.ones((1, 1, 1, 1), np.uint8)
+        live = writebehind.spool(get_resource(), (0, 0, 0), 0, data, 0, False, 'alice')
+        dead = writebehind.spool(get_resource(), (0, 0, 0), 0, data, 0, False, 'alice')
+        writebehind.save_job(dead['job_id'], writebehind.get_job(dead['job_id']), owner=-1)
+
+        self.assertEqual(writebehind.get_orphaned_jobs(), [dead['job_id']])
+        self.assertEqual(writebehind.recover(), [dead['job_id']])
+        self.assertEqual(writebehind.get_job(dead['job_id'])['owner'], os.getpid())
+        self.assertEqual(writebehind._pending['1&2&3'], 3)
+
+        # A job is only taken over once
+        self.assertEqual(writebehind.get_orphaned_jobs(), [])
+        self.assertEqual(writebehind._queue.get_nowait(), dead['job_id'])
+
+    @patch('bossspatialdb.writebehind.submit')
+    def test_recover_after_reboot(self, submit):
+        job = writebehind.spool(get_resource(), (0, 0, 0), 0, np.ones((1, 1, 1, 1), np.uint8), 0, False, 'alice')
+        self.assertEqual(writebehind.get_orphaned_jobs(), [])
+
+        # The process id may belong to another process after a reboot
+        writebehind.save_job(job['job_id'], writebehind.get_job(job['job_id']), boot_id='previous-boot')
+        self.assertEqual(writebehind.get_orphaned_jobs(), [job['job_id']])
+
+    @patch('bossspatialdb.writebehind.submit')
+    def test_channel_order(self, submit):
+        data = np.ones((1, 1, 1, 1), np.uint8)
+        writebehind.spool(get_resource(), (0, 0, 0), 0, data, 0, False, 'alice')
+        writebehind.spool(get_resource(), (0, 0, 0), 0, data, 0, False, 'alice')
+
+        # Synchronous posts can't land before the queued writes
+        with self.assertRaises(writebehind.WritesPendingError):
+            writebehind.check_channel('1&2&3')
+
+        # Nor can another process queue writes to the channel
+        with patch('bossspatialdb.writebehind.get_owner', return_value={'owner': -1, 'boot_id': ''}), \
+                patch.dict(writebehind._pending, clear=True):
+            with self.assertRaises(writebehind.WritesPendingError):
+                writebehind.spool(get_resource(), (0, 0, 0), 0, data, 0, False, 'bob')
+        self.assertEqual(len(os.listdir(self.spool_dir)), 4)
+
+        # The channel is released after the last queued write
+        writebehind.release_channel('1&2&3')
+        with self.assertRaises(writebehind.WritesPendingError):
+            writebehind.check_channel('1&2&3')
+        writebehind.release_channel('1&2&3')
+        writebehind.check_channel('1&2&3')
+
+    @patch('bossspatialdb.writebehind.submit')
+    def test_channel_expires(self, submit):
+        writebehind.spool(get_resource(), (0, 0, 0), 0, np.ones((1, 1, 1, 1), np.uint8), 0, False, 'alice')
+        cache.delete(writebehind.CHANNEL_KEY.format('1&2&3'))
+
+        # Another process took the channel after it expired, releasing it doesn't affect the new writer
+        other = {'owner': -1, 'boot_id': ''}
+        cache.set(writebehind.CHANNEL_KEY.format('1&2&3'), other)
+        writebehind.release_channel('1&2&3')
+        self.assertEqual(cache.get(writebehind.CHANNEL_KEY.format('1&2&3')), other)
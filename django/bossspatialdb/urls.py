@@ -17,7 +17,12 @@ from django.contrib.auth.decorators import login_required
 from . import views
 
 urlpatterns = [
+    # Url to provide the status of an asynchronous cutout write
+    url(r'^jobs/(?P<job_id>[0-9a-f]+)/?$', views.CutoutJob.as_view()),
 
+    # Url to handle reading many boxes of a channel in a single request
+    url(r'^(?P<collection>[\w_-]+)/(?P<experiment>[\w_-]+)/(?P<channel>[\w_-]+)/(?P<resolution>\d)/bulk/?$',
+        views.BulkCutout.as_view()),
 
     # Url to handle cutout with a collection, experiment, channel/annotation project and  range time
     url(r'^(?P<collection>[\w_-]+)/(?P<experiment>[\w_-]+)/(?P<channel>[\w_-]+)/(?P<resolution>\d)/(?P<x_range>\d+:\d+)/(?P<y_range>\d+:\d+)/(?P<z_range>\d+:\d+)/(?P<t_range>\d+:\d+?)/?$',
@@ -0,0 +1,28 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.conf.urls import url
+from . import views
+
+urlpatterns = [
+    # Url to describe a channel as a Neuroglancer precomputed volume, optionally of a single time sample (eg. t3/)
+    url(r'^(?P<collection>[\w_-]+)/(?P<experiment>[\w_-]+)/(?P<channel>[\w_-]+)/(?:t(?P<time_sample>\d+)/)?info/?$',
+        views.PrecomputedInfo.as_view()),
+
+    # Url to read a chunk of a channel's Neuroglancer precomputed volume
+    url(r'^(?P<collection>[\w_-]+)/(?P<experiment>[\w_-]+)/(?P<channel>[\w_-]+)/(?:t(?P<time_sample>\d+)/)?'
+        r'(?P<resolution>\d+)/(?P<x_start>\d+)-(?P<x_stop>\d+)_(?P<y_start>\d+)-(?P<y_stop>\d+)_'
+        r'(?P<z_start>\d+)-(?P<z_stop>\d+)/?$',
+        views.PrecomputedChunk.as_view()),
+]
@@ -19,27 +19,84 @@ from rest_framework import authentication, permissions
 from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
 from rest_framework.parsers import JSONParser
 
-from .parsers import BloscParser, BloscPythonParser, NpygzParser, is_too_large
-from .renderers import BloscRenderer, BloscPythonRenderer, NpygzRenderer, JpegRenderer
-
-from django.http import HttpResponse
+from .parsers import BloscParser, BloscPythonParser, NpygzParser, CompressedSegmentationParser, is_too_large
+from .renderers import BloscRenderer, BloscPythonRenderer, BloscChunkedRenderer, NpygzRenderer, JpegRenderer
+from .renderers import CompressedSegmentationRenderer
+from .renderers import get_blosc_args
+from . import blockreduce
+from . import bulk
+from . import chunked
+from . import dirty
+from . import downsample
+from . import invalidation
+from . import precomputed
+from . import sharded
+from . import writebehind
+
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
 from django.conf import settings
+from django.core.cache import cache as django_cache
 
 from bosscore.request import BossRequest
 from bosscore.error import BossError, BossHTTPError, BossParserError, ErrorCodes
 from bosscore.models import Channel
+from bosstiles import tile_cache
 
 from boss import utils
+from boss import metrics
 from boss.throttling import BossThrottle
 
-from spdb.spatialdb.spatialdb import SpatialDB, CUBOIDSIZE
-from spdb.spatialdb.rediskvio import RedisKVIO
+from spdb.spatialdb import Cube
+from spdb.spatialdb.spatialdb import CUBOIDSIZE
 from spdb import project
 import bossutils
 from bossutils.aws import get_region
 from bossutils.logger import BossLogger
 
 
+def meter_egress(request, collection, experiment, channel, cost):
+    """Throttle a read of a channel's data and add it to the cutout metrics in CloudWatch
+
+    Args:
+        request: DRF Request object
+        collection (str): Collection name
+        experiment (str): Experiment name
+        channel (str): Channel name
+        cost (float): Number of uncompressed bytes read
+
+    Raises:
+        Throttled: If the read is throttled
+    """
+    BossThrottle().check('cutout_egress',
+                         request.user,
+                         cost)
+
+    boss_config = bossutils.configuration.BossConfig()
+    dimensions = [
+        {'Name': 'User', 'Value': request.user.username},
+        {'Name': 'Resource', 'Value': '{}/{}/{}'.format(collection,
+                                                        experiment,
+                                                        channel)},
+        {'Name': 'Stack', 'Value': boss_config['system']['fqdn']},
+    ]
+
+    client = metrics.get_client()
+    client.put_metric_data(
+        Namespace = "BOSS/Cutout",
+        MetricData = [{
+            'MetricName': 'InvokeCount',
+            'Dimensions': dimensions,
+            'Value': 1.0,
+            'Unit': 'Count'
+        }, {
+            'MetricName': 'EgressCost',
+            'Dimensions': dimensions,
+            'Value': cost,
+            'Unit': 'Bytes'
+        }]
+    )
+
+
 class Cutout(APIView):
     """
     View to handle spatial cutouts by providing all datamodel fields
@@ -47,9 +104,9 @@ class Cutout(APIView):
     * Requires authentication.
     """
     # Set Parser and Renderer
-    parser_classes = (BloscParser, BloscPythonParser, NpygzParser, BrowsableAPIRenderer)
-    renderer_classes = (BloscRenderer, BloscPythonRenderer, NpygzRenderer, JpegRenderer,
-                        JSONRenderer, BrowsableAPIRenderer)
+    parser_classes = (BloscParser, BloscPythonParser, NpygzParser, CompressedSegmentationParser, BrowsableAPIRenderer)
+    renderer_classes = (BloscRenderer, BloscPythonRenderer, BloscChunkedRenderer, NpygzRenderer,
+                        CompressedSegmentationRenderer, JpegRenderer, JSONRenderer, BrowsableAPIRenderer)
 
     def __init__(self):
         super().__init__()
@@ -85,6 +142,9 @@ class Cutout(APIView):
         else:
             iso = False
 
+        # Compute resolutions that haven't been downsampled yet from the base resolution
+        on_the_fly = request.query_params.get("on-the-fly", "").lower() == "true"
+
         # Define access mode.
         access_mode = utils.get_access_mode(request)
 
@@ -132,60 +192,292 @@ class Cutout(APIView):
                / 8
                ) # Calculating the number of bytes
 
-        BossThrottle().check('cutout_egress',
-                             request.user,
-                             cost)
-
-        boss_config = bossutils.configuration.BossConfig()
-        dimensions = [
-            {'Name': 'User', 'Value': request.user.username},
-            {'Name': 'Resource', 'Value': '{}/{}/{}'.format(collection,
-                                                            experiment,
-                                                            channel)},
-            {'Name': 'Stack', 'Value': boss_config['system']['fqdn']},
-        ]
-
-        session = bossutils.aws.get_session()
-        client = session.client('cloudwatch')
-        client.put_metric_data(
-            Namespace = "BOSS/Cutout",
-            MetricData = [{
-                'MetricName': 'InvokeCount',
-                'Dimensions': dimensions,
-                'Value': 1.0,
-                'Unit': 'Count'
-            }, {
-                'MetricName': 'EgressCost',
-                'Dimensions': dimensions,
-                'Value': cost,
-                'Unit': 'Bytes'
-            }]
-        )
+        meter_egress(request, collection, experiment, channel, cost)
 
         # Get interface to SPDB cache
-        cache = SpatialDB(settings.KVIO_SETTINGS,
-                          settings.STATEIO_CONFIG,
-                          settings.OBJECTIO_CONFIG)
+        cache = invalidation.create_spatialdb()
+
+        # Compute the cutout from the base resolution if the channel's hierarchy isn't available yet
+        data = None
+        channel_obj = resource.get_channel()
+        if on_the_fly and req.get_resolution() > channel_obj.base_resolution \
+                and channel_obj.downsample_status.upper() != "DOWNSAMPLED":
+            try:
+                data = self.on_the_fly_cutout(resource, req, iso, access_mode)
+            except BossError as err:
+                return err.to_http()
+
+        # Stream the cutout one cuboid aligned z-slab at a time if the chunked format was requested
+        if request.accepted_renderer.media_type == chunked.MEDIA_TYPE:
+            try:
+                blosc_args = get_blosc_args(resource.get_data_type(), request.accepted_media_type)
+                version = chunked.get_version(request.accepted_media_type)
+            except ValueError as err:
+                return BossHTTPError(str(err), ErrorCodes.INVALID_ARGUMENT)
+
+            # The indexed format is built in memory so it can answer Range requests
+            if version == chunked.INDEXED_VERSION:
+                return self.indexed_cutout(request, cache, data, resource, req, iso, access_mode, blosc_args)
+
+            if data is not None:
+                return StreamingHttpResponse(self.stream_cube(data, req, blosc_args),
+                                             content_type=chunked.MEDIA_TYPE)
+
+            return StreamingHttpResponse(self.stream_cutout(cache, resource, req, iso, access_mode, blosc_args),
+                                         content_type=chunked.MEDIA_TYPE)
+
+        if data is not None:
+            return Response({"time_request": req.time_request,
+                             "data": data})
 
         # Get the params to pull data out of the cache
         corner = (req.get_x_start(), req.get_y_start(), req.get_z_start())
         extent = (req.get_x_span(), req.get_y_span(), req.get_z_span())
 
-        # Get a Cube instance with all time samples
-        data = cache.cutout(resource, corner, extent, req.get_resolution(), [req.get_time().start, req.get_time().stop],
-                            filter_ids=req.get_filter_ids(), iso=iso, access_mode=access_mode)
+        # Get a Cube instance with all time samples, reading large cutouts as parallel shards
+        time_range = [req.get_time().start, req.get_time().stop]
+        if sharded.use_sharded_cutout(corner, extent, len(req.get_time()), self.bit_depth, req.get_resolution()):
+            data = sharded.cutout(resource, corner, extent, req.get_resolution(), time_range,
+                                  filter_ids=req.get_filter_ids(), iso=iso, access_mode=access_mode)
+        else:
+            data = cache.cutout(resource, corner, extent, req.get_resolution(), time_range,
+                                filter_ids=req.get_filter_ids(), iso=iso, access_mode=access_mode)
         to_renderer = {"time_request": req.time_request,
                        "data": data}
 
         # Send data to renderer
         return Response(to_renderer)
 
+    def stream_cutout(self, cache, resource, req, iso, access_mode, blosc_args):
+        """Generator that produces a cutout in the chunked blosc format
+
+        The request region is read and compressed one cuboid aligned z-slab at a time so that only a single slab is
+        held in memory and the client starts receiving data as soon as the first slab is ready.
+
+        Args:
+            cache (SpatialDB): Interface to the SPDB cache
+            resource (BossResourceDjango): Resource for the request
+            req (BossRequest): Validated cutout request
+            iso (bool): If the isotropic copy of the data should be used
+            access_mode (str): Cache access mode for the cutout
+            blosc_args (dict): Compression arguments from get_blosc_args()
+
+        Yields:
+            (bytes): The stream header followed by one frame per z-slab
+        """
+        resolution = req.get_resolution()
+        time_range = [req.get_time().start, req.get_time().stop]
+        slabs = chunked.z_slabs(req.get_z_start(), req.get_z_stop(), CUBOIDSIZE[resolution][2])
+
+        yield chunked.encode_stream_header(resource.get_numpy_data_type(), time_range, len(slabs),
+                                           time_axis=req.time_request)
+
+        for z_start, z_stop in slabs:
+            try:
+                frame = self.encode_slab(cache, None, resource, req, iso, access_mode, blosc_args, z_start, z_stop)
+            except Exception:
+                # The status code has already been sent, so the client detects the truncated stream from the
+                # frame count in the stream header
+                BossLogger().logger.exception("Error streaming cutout slab {}:{}".format(z_start, z_stop))
+                return
+
+            yield frame
+
+    def stream_cube(self, cube, req, blosc_args):
+        """Generator that produces an in memory cutout in the chunked blosc format
+
+        Args:
+            cube (Cube): Cutout of the request's region
+            req (BossRequest): Validated cutout request
+            blosc_args (dict): Compression arguments from get_blosc_args()
+
+        Yields:
+            (bytes): The stream header followed by one frame per z-slab
+        """
+        time_range = [req.get_time().start, req.get_time().stop]
+        slabs = chunked.z_slabs(req.get_z_start(), req.get_z_stop(), CUBOIDSIZE[req.get_resolution()][2])
+
+        yield chunked.encode_stream_header(cube.data.dtype, time_range, len(slabs), time_axis=req.time_request)
+
+        for z_start, z_stop in slabs:
+            yield self.encode_slab(None, cube, None, req, None, None, blosc_args, z_start, z_stop)
+
+    def encode_slab(self, cache, cube, resource, req, iso, access_mode, blosc_args, z_start, z_stop):
+        """Encode a z-slab of a cutout as a chunked format frame
+
+        Args:
+            cache (SpatialDB|None): Interface to the SPDB cache, used if the cutout isn't already in memory
+            cube (Cube|None): Cutout of the request's region, if it is already in memory
+            resource (BossResourceDjango): Resource for the request
+            req (BossRequest): Validated cutout request
+            iso (bool): If the isotropic copy of the data should be used
+            access_mode (str): Cache access mode for the cutout
+            blosc_args (dict): Compression arguments from get_blosc_args()
+            z_start (int): First z index of the slab
+            z_stop (int): Last z index (exclusive) of the slab
+
+        Returns:
+            (bytes): The frame
+        """
+        corner = (req.get_x_start(), req.get_y_start(), z_start)
+        if cube is not None:
+            z = z_start - req.get_z_start()
+            data = cube.data[:, z:z + z_stop - z_start]
+        else:
+            extent = (req.get_x_span(), req.get_y_span(), z_stop - z_start)
+            data = cache.cutout(resource, corner, extent, req.get_resolution(),
+                                [req.get_time().start, req.get_time().stop],
+                                filter_ids=req.get_filter_ids(), iso=iso, access_mode=access_mode).data
+        if not req.time_request:
+            data = np.squeeze(data, axis=(0,))
+
+        return chunked.encode_frame(data, corner, **blosc_args)
+
+    def indexed_cutout(self, request, cache, cube, resource, req, iso, access_mode, blosc_args):
+        """Respond with a version 2 (indexed) chunked stream, honoring a Range request for a single range of bytes
+
+        The stream's frame lengths are cached under its ETag, which changes with the channel's data, so a resumed
+        download only encodes the frames that hold the requested bytes. The complete stream is sent if the frame
+        lengths aren't cached, the Range header asks for multiple ranges, or If-Range doesn't match the ETag.
+
+        Args:
+            request: DRF Request object
+            cache (SpatialDB|None): Interface to the SPDB cache, used if the cutout isn't already in memory
+            cube (Cube|None): Cutout of the request's region, if it is already in memory
+            resource (BossResourceDjango): Resource for the request
+            req (BossRequest): Validated cutout request
+            iso (bool): If the isotropic copy of the data should be used
+            access_mode (str): Cache access mode for the cutout
+            blosc_args (dict): Compression arguments from get_blosc_args()
+
+        Returns:
+            (HttpResponse)
+        """
+        time_range = [req.get_time().start, req.get_time().stop]
+        slabs = chunked.z_slabs(req.get_z_start(), req.get_z_stop(), CUBOIDSIZE[req.get_resolution()][2])
+        header = chunked.encode_stream_header(resource.get_numpy_data_type(), time_range, len(slabs),
+                                              time_axis=req.time_request, version=chunked.INDEXED_VERSION)
+
+        etag = tile_cache.make_etag(resource.get_lookup_key(), tile_cache.get_data_version(resource.get_lookup_key()),
+                                    req.get_resolution(), req.get_x_start(), req.get_x_stop(), req.get_y_start(),
+                                    req.get_y_stop(), req.get_z_start(), req.get_z_stop(), time_range, iso,
+                                    req.get_filter_ids(), cube is not None, sorted(blosc_args.items()))
+        index_key = chunked.INDEX_KEY.format(etag)
+
+        range_header = request.META.get('HTTP_RANGE')
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if if_range and if_range.strip() != etag:
+            range_header = None
+
+        def respond(body, total, byte_range, offset=0):
+            if byte_range is None:
+                response = HttpResponse(body, content_type=chunked.MEDIA_TYPE)
+            else:
+                start, stop = byte_range
+                response = HttpResponse(body[start - offset:stop - offset], status=206,
+                                        content_type=chunked.MEDIA_TYPE)
+                response['Content-Range'] = 'bytes {}-{}/{}'.format(start, stop - 1, total)
+            response['Accept-Ranges'] = 'bytes'
+            response['ETag'] = etag
+            return response
+
+        def unsatisfiable(total):
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(total)
+            return response
+
+        # Only encode the frames that hold the requested bytes if the frame lengths are known
+        frame_lengths = django_cache.get(index_key)
+        if range_header and frame_lengths is not None:
+            prefix = header + chunked.encode_index(frame_lengths)
+            total = len(prefix) + sum(frame_lengths)
+            try:
+                byte_range = chunked.parse_range(range_header, total)
+            except ValueError:
+                return unsatisfiable(total)
+
+            if byte_range is not None:
+                first, last, offset = chunked.frames_in_range(frame_lengths, *byte_range)
+                frames = [self.encode_slab(cache, cube, resource, req, iso, access_mode, blosc_args, *slabs[i])
+                          for i in range(first, last)]
+                if [len(f) for f in frames] == frame_lengths[first:last]:
+                    if byte_range[0] < len(prefix):
+                        return respond(prefix[:offset] + b''.join(frames), total, byte_range)
+                    return respond(b''.join(frames), total, byte_range, offset)
+
+                # The frames no longer match their cached lengths, so send the complete stream
+                BossLogger().logger.warning("Cached chunked cutout index doesn't match {}".format(etag))
+
+        frames = [self.encode_slab(cache, cube, resource, req, iso, access_mode, blosc_args, z_start, z_stop)
+                  for z_start, z_stop in slabs]
+        frame_lengths = [len(f) for f in frames]
+        django_cache.set(index_key, frame_lengths, settings.CUTOUT_CHUNKED_INDEX_TTL)
+
+        body = b''.join([header, chunked.encode_index(frame_lengths)] + frames)
+        byte_range = None
+        if range_header:
+            try:
+                byte_range = chunked.parse_range(range_header, len(body))
+            except ValueError:
+                return unsatisfiable(len(body))
+        return respond(body, len(body), byte_range)
+
+    def on_the_fly_cutout(self, resource, req, iso, access_mode):
+        """Compute a cutout from the channel's base resolution
+
+        The region at the base resolution is reduced with blockreduce.block_reduce(), which uses the ratio of the
+        voxel sizes of the resolutions, so the experiment's hierarchy method is respected.
+
+        Args:
+            resource (BossResourceDjango): Resource for the request
+            req (BossRequest): Validated cutout request
+            iso (bool): If the isotropic hierarchy should be computed
+            access_mode (str): Cache access mode for reading the base resolution
+
+        Returns:
+            (Cube): Cutout of the request's region at the request's resolution
+
+        Raises:
+            BossError: If the region to read at the base resolution is larger than settings.CUTOUT_ON_THE_FLY_MAX_SIZE
+        """
+        channel = resource.get_channel()
+        base_resolution = channel.base_resolution
+        factors = blockreduce.get_factors(resource.get_downsampled_voxel_dims(iso=iso), req.get_resolution(),
+                                          base_resolution)
+
+        corner = (req.get_x_start(), req.get_y_start(), req.get_z_start())
+        extent = (req.get_x_span(), req.get_y_span(), req.get_z_span())
+        time_range = [req.get_time().start, req.get_time().stop]
+        src_corner, src_extent = blockreduce.source_box(corner, extent, factors)
+
+        src_bytes = src_extent[0] * src_extent[1] * src_extent[2] * len(req.get_time()) * resource.get_bit_depth() / 8
+        if src_bytes > settings.CUTOUT_ON_THE_FLY_MAX_SIZE:
+            raise BossError("On the fly cutout reads over {}MB at the base resolution. Reduce cutout dimensions."
+                            .format(settings.CUTOUT_ON_THE_FLY_MAX_SIZE // 1048576), ErrorCodes.REQUEST_TOO_LARGE)
+
+        if sharded.use_sharded_cutout(src_corner, src_extent, len(req.get_time()), resource.get_bit_depth(),
+                                      base_resolution):
+            source = sharded.cutout(resource, src_corner, src_extent, base_resolution, time_range,
+                                    filter_ids=req.get_filter_ids(), access_mode=access_mode)
+        else:
+            source = sharded.get_spatialdb().cutout(resource, src_corner, src_extent, base_resolution, time_range,
+                                                    filter_ids=req.get_filter_ids(), access_mode=access_mode)
+
+        cube = Cube.create_cube(resource, list(extent), time_range)
+        cube.data = blockreduce.block_reduce(source.data, factors, annotation=not channel.is_image())
+        return cube
+
     def post(self, request, collection, experiment, channel, resolution, x_range, y_range, z_range, t_range=None):
         """
         View to handle POST requests for a cuboid of data while providing all datamodel params
 
         Due to parser implementation, request.data should be a numpy array already.
 
+        With ?async=true the data is queued and the response is 202 with a job id, whose status is at
+        v1/cutout/jobs/<job_id>/. While a channel has queued writes, synchronous posts to it and asynchronous posts
+        handled by other web server processes are rejected with a 409, so writes always land in the order they were
+        accepted.
+
         :param request: DRF Request object
         :type request: rest_framework.request.Request
         :param collection: Unique Collection identifier, indicating which collection you want to access
@@ -256,8 +548,7 @@ class Cutout(APIView):
             {'Name': 'Stack', 'Value': boss_config['system']['fqdn']},
         ]
 
-        session = bossutils.aws.get_session()
-        client = session.client('cloudwatch')
+        client = metrics.get_client()
         client.put_metric_data(
             Namespace = "BOSS/Cutout",
             MetricData = [{
@@ -273,39 +564,366 @@ class Cutout(APIView):
             }]
         )
 
-        # Get interface to SPDB cache
-        cache = SpatialDB(settings.KVIO_SETTINGS,
-                          settings.STATEIO_CONFIG,
-                          settings.OBJECTIO_CONFIG)
-
         # Write block to cache
         corner = (req.get_x_start(), req.get_y_start(), req.get_z_start())
+        if len(request.data[2].shape) == 4:
+            data = request.data[2]
+        else:
+            data = np.expand_dims(request.data[2], axis=0)
+
+        # Optionally queue the write and return before it finishes
+        if request.query_params.get('async', '').lower() == 'true':
+            try:
+                job = writebehind.spool(resource, corner, req.get_resolution(), data, req.get_time()[0], iso,
+                                        request.user.username)
+            except writebehind.WritesPendingError as e:
+                return BossHTTPError('{}. Retry once they are done.'.format(e), ErrorCodes.INVALID_STATE)
+            except OSError as e:
+                return BossHTTPError('Unable to queue write: {}'.format(e), ErrorCodes.BOSS_SYSTEM_ERROR)
+            return JsonResponse({'job_id': job['job_id'], 'status': job['status']}, status=202)
+
+        # Older queued writes would land over this one
+        try:
+            writebehind.check_channel(resource.get_lookup_key())
+        except writebehind.WritesPendingError as e:
+            return BossHTTPError('{}. Retry once they are done.'.format(e), ErrorCodes.INVALID_STATE)
 
         try:
-            if len(request.data[2].shape) == 4:
-                cache.write_cuboid(resource, corner, req.get_resolution(), request.data[2], req.get_time()[0], iso=iso)
-            else:
-                cache.write_cuboid(resource, corner, req.get_resolution(),
-                                   np.expand_dims(request.data[2], axis=0), req.get_time()[0], iso=iso)
+            # Large blocks are written as parallel, cuboid aligned shards
+            writebehind.write(resource, corner, req.get_resolution(), data, req.get_time()[0], iso=iso)
         except Exception as e:
             # TODO: Eventually remove as this level of detail should not be sent to the user
             return BossHTTPError('Error during write_cuboid: {}'.format(e), ErrorCodes.BOSS_SYSTEM_ERROR)
 
-        # If the channel status is DOWNSAMPLED change status to NOT_DOWNSAMPLED since you just wrote data
-        channel = resource.get_channel()
-        if channel.downsample_status.upper() == "DOWNSAMPLED":
-            # Get Channel object and update status
-            lookup_key = resource.get_lookup_key()
-            _, exp_id, _ = lookup_key.split("&")
-            channel_obj = Channel.objects.get(name=channel.name, experiment=int(exp_id))
-            channel_obj.downsample_status = "NOT_DOWNSAMPLED"
-            channel_obj.downsample_arn = ""
-            channel_obj.save()
+        writebehind.record_write(resource, corner, req.get_resolution(),
+                                 (req.get_x_span(), req.get_y_span(), req.get_z_span()),
+                                 [req.get_time().start, req.get_time().stop])
 
         # Send data to renderer
         return HttpResponse(status=201)
 
 
+class BulkCutout(APIView):
+    """
+    View to read many boxes of a channel at one resolution in a single request
+
+    * Requires authentication.
+    """
+    parser_classes = (JSONParser,)
+    renderer_classes = (BloscChunkedRenderer, JSONRenderer)
+
+    def post(self, request, collection, experiment, channel, resolution):
+        """
+        View to handle a bulk cutout request
+
+        The request body is a JSON object with 'boxes', a list of [x_start, x_stop, y_start, y_stop, z_start, z_stop],
+        and an optional 'time_range' of [start, stop). The boxes are validated, throttled, and metered as a single
+        request, and the response is a chunked blosc stream with one frame per box.
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param collection: Unique Collection identifier, indicating which collection you want to access
+        :param experiment: Experiment identifier, indicating which experiment you want to access
+        :param channel: Channel identifier, indicating which channel you want to access
+        :param resolution: Integer indicating the level in the resolution hierarchy (0 = native)
+        :return:
+        """
+        if "iso" in request.query_params:
+            if request.query_params["iso"].lower() == "true":
+                iso = True
+            else:
+                iso = False
+        else:
+            iso = False
+
+        # Define access mode.
+        access_mode = utils.get_access_mode(request)
+
+        try:
+            boxes = bulk.parse_boxes(request.data, settings.CUTOUT_BULK_MAX_BOXES)
+            t_range = bulk.parse_time_range(request.data)
+        except ValueError as err:
+            return BossHTTPError(str(err), ErrorCodes.INVALID_ARGUMENT)
+
+        # Validate the bounding box of the boxes, which is in the coordinate frame only if every box is
+        corner, extent = bulk.bounding_box(boxes)
+        try:
+            request_args = {
+                "service": "cutout",
+                "collection_name": collection,
+                "experiment_name": experiment,
+                "channel_name": channel,
+                "resolution": resolution,
+                "x_args": "{}:{}".format(corner[0], corner[0] + extent[0]),
+                "y_args": "{}:{}".format(corner[1], corner[1] + extent[1]),
+                "z_args": "{}:{}".format(corner[2], corner[2] + extent[2]),
+                "time_args": t_range,
+                # Bulk cutouts only read data
+                "method": "GET"
+            }
+            req = BossRequest(request, request_args)
+        except BossError as err:
+            return err.to_http()
+
+        # Convert to Resource
+        resource = project.BossResourceDjango(req)
+
+        # Get bit depth
+        try:
+            bit_depth = resource.get_bit_depth()
+        except ValueError:
+            return BossHTTPError("Unsupported data type: {}".format(resource.get_data_type()), ErrorCodes.TYPE_ERROR)
+
+        # Make sure the boxes are under the cutout size limit UNCOMPRESSED
+        cost = (sum(e[0] * e[1] * e[2] for _, e in boxes)
+                * (req.get_time().stop - req.get_time().start)
+                * bit_depth
+                / 8
+                ) # Calculating the number of bytes
+        if cost > settings.CUTOUT_MAX_SIZE:
+            return BossHTTPError("Bulk cutout request is over 500MB when uncompressed. Request fewer boxes.",
+                                 ErrorCodes.REQUEST_TOO_LARGE)
+
+        try:
+            blosc_args = get_blosc_args(resource.get_data_type(), request.accepted_media_type)
+        except ValueError as err:
+            return BossHTTPError(str(err), ErrorCodes.INVALID_ARGUMENT)
+
+        meter_egress(request, collection, experiment, channel, cost)
+
+        return StreamingHttpResponse(self.stream_boxes(resource, req, boxes, iso, access_mode, blosc_args),
+                                     content_type=chunked.MEDIA_TYPE)
+
+    def stream_boxes(self, resource, req, boxes, iso, access_mode, blosc_args):
+        """Generator that produces the boxes in the chunked blosc format
+
+        Each cluster of boxes from bulk.cluster_boxes() is read with a single cutout, so only one cluster is held in
+        memory at a time.
+
+        Args:
+            resource (BossResourceDjango): Resource for the request
+            req (BossRequest): Validated cutout request for the boxes' bounding box
+            boxes (list[tuple[tuple[int], tuple[int]]]): (corner, extent) of each box
+            iso (bool): If the isotropic copy of the data should be used
+            access_mode (str): Cache access mode for the cutouts
+            blosc_args (dict): Compression arguments from get_blosc_args()
+
+        Yields:
+            (bytes): The stream header followed by one frame per box
+        """
+        resolution = req.get_resolution()
+        time_range = [req.get_time().start, req.get_time().stop]
+
+        yield chunked.encode_stream_header(resource.get_numpy_data_type(), time_range, len(boxes),
+                                           time_axis=req.time_request)
+
+        for corner, extent, members in bulk.cluster_boxes(boxes, CUBOIDSIZE[resolution]):
+            try:
+                if sharded.use_sharded_cutout(corner, extent, len(req.get_time()), resource.get_bit_depth(),
+                                              resolution):
+                    cube = sharded.cutout(resource, corner, extent, resolution, time_range,
+                                          iso=iso, access_mode=access_mode)
+                else:
+                    cube = sharded.get_spatialdb().cutout(resource, corner, extent, resolution, time_range,
+                                                          iso=iso, access_mode=access_mode)
+            except Exception:
+                # The status code has already been sent, so the client detects the truncated stream from the
+                # frame count in the stream header
+                BossLogger().logger.exception("Error streaming bulk cutout region {} {}".format(corner, extent))
+                return
+
+            for i in members:
+                box_corner, box_extent = boxes[i]
+                x = box_corner[0] - corner[0]
+                y = box_corner[1] - corner[1]
+                z = box_corner[2] - corner[2]
+                data = cube.data[:, z:z + box_extent[2], y:y + box_extent[1], x:x + box_extent[0]]
+                if not req.time_request:
+                    data = np.squeeze(data, axis=(0,))
+
+                yield chunked.encode_frame(data, box_corner, **blosc_args)
+
+
+class CutoutJob(APIView):
+    """
+    View to provide the status of an asynchronous cutout write
+
+    * Requires authentication.
+    """
+    renderer_classes = (JSONRenderer, BrowsableAPIRenderer)
+
+    def get(self, request, job_id):
+        """View to provide the status of a write queued by a cutout post with ?async=true
+
+        Only the user that posted the data, or staff, can see a job.
+
+        Args:
+            request: DRF Request object
+            job_id (str): Id returned by the cutout post
+
+        Returns:
+            (Response): The job's status, which is QUEUED, RUNNING, DONE, or FAILED
+        """
+        job = writebehind.get_job(job_id)
+        if job is None or (job.get('user') != request.user.username and not request.user.is_staff):
+            return BossHTTPError("Write job {} not found".format(job_id), ErrorCodes.RESOURCE_NOT_FOUND)
+
+        data = {k: job[k] for k in ('job_id', 'status', 'channel', 'resolution', 'created', 'updated') if k in job}
+        if 'error' in job:
+            data['error'] = job['error']
+        return Response(data)
+
+
+class PrecomputedInfo(APIView):
+    """
+    View to describe a channel as a Neuroglancer precomputed volume
+
+    * Requires authentication.
+    """
+    renderer_classes = (JSONRenderer,)
+
+    def get(self, request, collection, experiment, channel, time_sample=None):
+        """View to provide a channel's precomputed info file
+
+        The scales are the channel's resolutions that have data: only the base resolution until the channel is
+        downsampled.
+
+        Args:
+            request: DRF Request object
+            collection (str): Unique Collection identifier, indicating which collection you want to access
+            experiment (str): Experiment identifier, indicating which experiment you want to access
+            channel (str): Channel identifier, indicating which channel you want to access
+            time_sample (optional[str]): Time sample of the volume, defaults to 0
+
+        Returns:
+            (Response)
+        """
+        try:
+            request_args = {
+                "service": "downsample",
+                "collection_name": collection,
+                "experiment_name": experiment,
+                "channel_name": channel,
+                "method": "GET"
+            }
+            req = BossRequest(request, request_args)
+        except BossError as err:
+            return err.to_http()
+
+        resource = project.BossResourceDjango(req)
+        channel_obj = resource.get_channel()
+        coord_frame = resource.get_coord_frame()
+        data_type = resource.get_numpy_data_type()
+        annotation = not channel_obj.is_image()
+
+        encoding = precomputed.get_encoding(data_type, annotation)
+        if channel_obj.downsample_status.upper() == "DOWNSAMPLED":
+            resolutions = range(channel_obj.base_resolution, resource.get_experiment().num_hierarchy_levels)
+        else:
+            resolutions = [channel_obj.base_resolution]
+        voxel_dims = resource.get_downsampled_voxel_dims(iso=False)
+        scales = [precomputed.get_scale((coord_frame.x_start, coord_frame.y_start, coord_frame.z_start),
+                                        (coord_frame.x_stop, coord_frame.y_stop, coord_frame.z_stop),
+                                        voxel_dims, coord_frame.voxel_unit, res, encoding,
+                                        settings.CUTOUT_SEGMENTATION_BLOCK_SIZE)
+                  for res in resolutions]
+
+        response = Response(precomputed.get_info(data_type, annotation, scales))
+        response['Cache-Control'] = settings.PRECOMPUTED_CACHE_CONTROL
+        return response
+
+
+class PrecomputedChunk(APIView):
+    """
+    View to read a chunk of a channel's Neuroglancer precomputed volume
+
+    * Requires authentication.
+    """
+    renderer_classes = (JSONRenderer,)
+
+    def get(self, request, collection, experiment, channel, resolution, x_start, x_stop, y_start, y_stop,
+            z_start, z_stop, time_sample=None):
+        """View to read a precomputed chunk, which is a cuboid aligned region of a single time sample
+
+        Chunks have an ETag derived from the channel's data version, so conditional requests for unchanged chunks
+        return 304 Not Modified without reading any data.
+
+        Args:
+            request: DRF Request object
+            collection (str): Unique Collection identifier, indicating which collection you want to access
+            experiment (str): Experiment identifier, indicating which experiment you want to access
+            channel (str): Channel identifier, indicating which channel you want to access
+            resolution (str): Scale key of the chunk, which is its resolution
+            x_start (str): X start of the chunk
+            x_stop (str): X stop of the chunk
+            y_start (str): Y start of the chunk
+            y_stop (str): Y stop of the chunk
+            z_start (str): Z start of the chunk
+            z_stop (str): Z stop of the chunk
+            time_sample (optional[str]): Time sample of the volume, defaults to 0
+
+        Returns:
+            (HttpResponse)
+        """
+        time_sample = int(time_sample or 0)
+        try:
+            request_args = {
+                "service": "cutout",
+                "collection_name": collection,
+                "experiment_name": experiment,
+                "channel_name": channel,
+                "resolution": resolution,
+                "x_args": "{}:{}".format(x_start, x_stop),
+                "y_args": "{}:{}".format(y_start, y_stop),
+                "z_args": "{}:{}".format(z_start, z_stop),
+                "time_args": "{}:{}".format(time_sample, time_sample + 1),
+            }
+            req = BossRequest(request, request_args)
+        except BossError as err:
+            return err.to_http()
+
+        resource = project.BossResourceDjango(req)
+        coord_frame = resource.get_coord_frame()
+        data_type = resource.get_numpy_data_type()
+        encoding = precomputed.get_encoding(data_type, not resource.get_channel().is_image())
+        block_size = settings.CUTOUT_SEGMENTATION_BLOCK_SIZE
+        resolution = req.get_resolution()
+
+        # Only serve the chunks listed by the info file, so responses can be cached by URL
+        scale = precomputed.get_scale((coord_frame.x_start, coord_frame.y_start, coord_frame.z_start),
+                                      (coord_frame.x_stop, coord_frame.y_stop, coord_frame.z_stop),
+                                      resource.get_downsampled_voxel_dims(iso=False), coord_frame.voxel_unit,
+                                      resolution, encoding, block_size)
+        try:
+            corner, extent = precomputed.check_chunk(scale,
+                                                     (int(x_start), int(y_start), int(z_start)),
+                                                     (int(x_stop), int(y_stop), int(z_stop)))
+        except ValueError as err:
+            return BossHTTPError(str(err), ErrorCodes.INVALID_CUTOUT_ARGS)
+
+        # The ETag is known before the chunk is read, so conditional requests for unchanged chunks don't read any data
+        etag = tile_cache.make_etag(tile_cache.get_data_version(resource.get_lookup_key()), resolution, corner,
+                                    time_sample, encoding, block_size)
+        if tile_cache.etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), etag):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            response['Cache-Control'] = settings.PRECOMPUTED_CACHE_CONTROL
+            return response
+
+        # Add metrics to CloudWatch
+        cost = extent[0] * extent[1] * extent[2] * resource.get_bit_depth() / 8
+        meter_egress(request, collection, experiment, channel, cost)
+
+        cube = sharded.get_spatialdb().cutout(resource, corner, extent, resolution, [time_sample, time_sample + 1],
+                                              access_mode=utils.get_access_mode(request))
+
+        response = HttpResponse(precomputed.encode_chunk(cube.data[0], encoding, block_size),
+                                content_type='application/octet-stream')
+        response['ETag'] = etag
+        response['Cache-Control'] = settings.PRECOMPUTED_CACHE_CONTROL
+        return response
+
+
 class Downsample(APIView):
     """
     View to handle downsample service requests
@@ -356,20 +974,31 @@ class Downsample(APIView):
         experiment = resource.get_experiment()
         to_renderer = {"status": channel.downsample_status}
 
-        # Check Step Function if status is in-progress and update
+        # Check the downsample backend if status is in-progress and update
         if channel.downsample_status == "IN_PROGRESS":
             lookup_key = resource.get_lookup_key()
             _, exp_id, _ = lookup_key.split("&")
             # Get channel object
             channel_obj = Channel.objects.get(name=channel.name, experiment=int(exp_id))
-            # Update the status from the step function
-            session = bossutils.aws.get_session()
-            status = bossutils.aws.sfn_status(session, channel_obj.downsample_arn)
+            to_renderer["progress"] = channel_obj.downsample_progress
+            # Update the status from the backend that started the downsample
+            status = downsample.get_backend(channel_obj.downsample_arn).status(channel_obj.downsample_arn)
             if status == "SUCCEEDED":
                 # Change to DOWNSAMPLED
                 channel_obj.downsample_status = "DOWNSAMPLED"
+                channel_obj.downsample_progress = 100
                 channel_obj.save()
                 to_renderer["status"] = "DOWNSAMPLED"
+                to_renderer["progress"] = 100
+
+                # Stop serving tiles rendered before the downsample
+                tile_cache.bump_data_version(lookup_key)
+
+                # The cuboids an incremental downsample was started for are now downsampled
+                try:
+                    dirty.DirtyCuboids().finish(lookup_key, range(experiment.num_hierarchy_levels))
+                except Exception:
+                    BossLogger().logger.exception("Problem clearing the downsampled cuboids of {}".format(lookup_key))
 
                 # DP NOTE: This code should be moved to spdb when change
                 #          tracking is added to automatically calculate
@@ -377,20 +1006,9 @@ class Downsample(APIView):
                 # DP NOTE: Clear the cache of any cubes for the channel
                 #          This is to prevent serving stale data after
                 #          (re)downsampling
-                log = BossLogger().logger
-                for pattern in ("CACHED-CUBOID&"+lookup_key+"&*",
-                                "CACHED-CUBOID&ISO&"+lookup_key+"&*"):
-                    log.debug("Clearing cache of {} cubes".format(pattern))
-                    try:
-                        cache = RedisKVIO(settings.KVIO_SETTINGS)
-                        pipe = cache.cache_client.pipeline()
-                        for key in cache.cache_client.scan_iter(match=pattern):
-                            pipe.delete(key)
-                        pipe.execute()
-                    except Exception as ex:
-                        log.exception("Problem clearing cache after downsample finished")
-
-            elif status == "FAILED" or status == "TIMED_OUT":
+                invalidation.start_clear_cached_cuboids(resource)
+
+            elif status == "FAILED" or status == "TIMED_OUT" or status == "ABORTED":
                 # Change status to FAILED
                 channel_obj = Channel.objects.get(name=channel.name, experiment=int(exp_id))
                 channel_obj.downsample_status = "FAILED"
@@ -451,22 +1069,30 @@ class Downsample(APIView):
         # Convert to Resource
         resource = project.BossResourceDjango(req)
 
+        # Only recompute the cuboids above the data written since the last downsample
+        incremental = request.query_params.get("incremental", "").lower() == "true"
+
         channel = resource.get_channel()
         if channel.downsample_status.upper() == "IN_PROGRESS":
             return BossHTTPError("Channel is currently being downsampled. Invalid Request.", ErrorCodes.INVALID_STATE)
         elif channel.downsample_status.upper() == "DOWNSAMPLED" and \
-             not request.user.is_staff:
+             not request.user.is_staff and not incremental:
             return BossHTTPError("Channel is already downsampled. Invalid Request.", ErrorCodes.INVALID_STATE)
 
-        session = bossutils.aws.get_session()
+        backend = downsample.get_backend()
 
-        # Make sure only one Channel is downsampled at a time
+        # Make sure the backend isn't already running as many downsamples as it can
+        running = 0
         channel_objs = Channel.objects.filter(downsample_status = 'IN_PROGRESS')
         for channel_obj in channel_objs:
-            # Verify that the channel is still being downsampled
-            status = bossutils.aws.sfn_status(session, channel_obj.downsample_arn)
+            # Verify that the channel is still being downsampled by the same kind of backend
+            if type(downsample.get_backend(channel_obj.downsample_arn)) is not type(backend):
+                continue
+            status = backend.status(channel_obj.downsample_arn)
             if status == 'RUNNING':
-                return BossHTTPError("Another Channel is currently being downsampled. Invalid Request.", ErrorCodes.INVALID_STATE)
+                running += 1
+        if running >= backend.max_running:
+            return BossHTTPError("Another Channel is currently being downsampled. Invalid Request.", ErrorCodes.INVALID_STATE)
 
         if request.user.is_staff:
             # DP HACK: allow admin users to override the coordinate frame
@@ -516,6 +1142,21 @@ class Downsample(APIView):
 
         }
 
+        if downsample.needs_iso(args) and not backend.supports_iso:
+            return BossHTTPError("The {} downsample backend can't build the isotropic resolutions of anisotropic "
+                                 "channels. Invalid Request.".format(settings.DOWNSAMPLE_BACKEND),
+                                 ErrorCodes.INVALID_REQUEST)
+
+        # Get the data written since the last downsample, which is kept for the next attempt if this one fails
+        tracker = dirty.DirtyCuboids()
+        changed = None
+        if incremental:
+            changed = tracker.snapshot(lookup_key, range(channel.base_resolution, experiment.num_hierarchy_levels))
+            if not changed:
+                return BossHTTPError("No data has been written since the channel was downsampled. Invalid Request.",
+                                     ErrorCodes.INVALID_STATE)
+            args.update(downsample.get_incremental_frame(args, changed))
+
         # Check that only administrators are triggering extra large downsamples
         if (not request.user.is_staff) and \
            ((args['x_stop'] - args['x_start']) * \
@@ -546,7 +1187,7 @@ class Downsample(APIView):
             {'Name': 'Stack', 'Value': boss_config['system']['fqdn']},
         ]
 
-        client = session.client('cloudwatch')
+        client = metrics.get_client()
         client.put_metric_data(
             Namespace = "BOSS/Downsample",
             MetricData = [{
@@ -562,14 +1203,21 @@ class Downsample(APIView):
             }]
         )
 
+        # A full downsample covers everything written before it starts, which is deleted once it succeeds
+        if not incremental:
+            try:
+                tracker.snapshot(lookup_key, range(experiment.num_hierarchy_levels), read=False)
+            except Exception:
+                BossLogger().logger.exception("Problem saving the written cuboids of {}".format(lookup_key))
+
         # Start downsample
-        downsample_sfn = boss_config['sfn']['downsample_sfn']
-        arn = bossutils.aws.sfn_execute(session, downsample_sfn, dict(args))
+        arn = backend.start(args, resource, dirty=changed)
 
         # Change Status and Save ARN
         channel_obj = Channel.objects.get(name=channel.name, experiment=int(exp_id))
         channel_obj.downsample_status = "IN_PROGRESS"
         channel_obj.downsample_arn = arn
+        channel_obj.downsample_progress = 0
         channel_obj.save()
 
         return HttpResponse(status=201)
@@ -610,10 +1258,8 @@ class Downsample(APIView):
         _, exp_id, _ = lookup_key.split("&")
         channel_obj = Channel.objects.get(name=channel.name, experiment=int(exp_id))
 
-        # Call cancel on the Step Function
-        session = bossutils.aws.get_session()
-        bossutils.aws.sfn_cancel(session, channel_obj.downsample_arn, error="User Cancel",
-                                 cause="User has requested the downsample operation to stop.")
+        # Call cancel on the backend that started the downsample
+        downsample.get_backend(channel_obj.downsample_arn).cancel(channel_obj.downsample_arn)
 
         # Clear ARN
         channel_obj.downsample_arn = ""
@@ -0,0 +1,547 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Write-behind of cutout posts
+
+A cutout post with ?async=true is validated like any other post, then the
+decoded array is spooled to settings.CUTOUT_ASYNC_SPOOL_DIR and the request
+returns a write job id. Each web server process has one worker thread that
+writes its spooled jobs in the order they were posted.
+
+Writes to a channel are kept in order across processes by giving one process
+at a time the channel's queued writes. The process that spools the first
+pending job of a channel records itself in the Django cache as the channel's
+writer until its last pending job of the channel finishes. Meanwhile other
+processes reject asynchronous posts to the channel, and every process
+rejects synchronous posts to it, so an older queued write never lands over a
+newer one. The writer refreshes its record as it makes progress. If it stops
+for settings.CUTOUT_ASYNC_CHANNEL_SECONDS, for instance because its host is
+down, the record expires and the channel is released.
+
+A job is two files, '<job id>.npy' with the (t, z, y, x) array and
+'<job id>.json' with the arguments of the write. Both are flushed to disk
+before the job is reported as queued, and are deleted once the job finishes.
+The status of each job is kept in the Django cache. Each worker takes over
+the spooled jobs of processes that are no longer running, including those
+from before the host rebooted. It does this when the web server process
+starts (see boss/wsgi.py) and every settings.CUTOUT_ASYNC_RECOVER_SECONDS
+after that. It also becomes the writer of those jobs' channels.
+"""
+
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+
+from bosscore.models import Channel
+from bosstiles import tile_cache
+from bossutils.logger import BossLogger
+from spdb.project import BossResourceBasic
+from spdb.spatialdb.spatialdb import CUBOIDSIZE
+
+from . import dirty
+from . import invalidation
+from . import sharded
+
+JOB_KEY = 'boss-write-job:{}'
+CLAIM_KEY = 'boss-write-job:{}:claim'
+
+# Django cache key of the process that has a channel's queued writes, by lookup key
+CHANNEL_KEY = 'boss-write-channel:{}'
+
+# Number of seconds other processes are kept from taking over a job that a process has claimed
+CLAIM_SECONDS = 60
+
+QUEUED = 'QUEUED'
+RUNNING = 'RUNNING'
+DONE = 'DONE'
+FAILED = 'FAILED'
+
+# File with an id that changes each time Linux boots
+BOOT_ID_PATH = '/proc/sys/kernel/random/boot_id'
+
+_queue = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+# Number of this process's unfinished jobs for each channel it is the writer of, by lookup key
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+class WritesPendingError(Exception):
+    """A channel has queued writes that a post could be reordered with"""
+    pass
+
+
+def check_channel(lookup_key):
+    """Make sure a synchronous write to a channel can't be overwritten by older queued writes
+
+    Args:
+        lookup_key (str): Lookup key of the channel
+
+    Raises:
+        WritesPendingError: If the channel has queued writes
+    """
+    if cache.get(CHANNEL_KEY.format(lookup_key)) is not None:
+        raise WritesPendingError("Queued writes to the channel haven't finished")
+
+
+def acquire_channel(lookup_key):
+    """Become the writer of a channel's queued writes, for one more job
+
+    Args:
+        lookup_key (str): Lookup key of the channel
+
+    Raises:
+        WritesPendingError: If another process has queued writes to the channel
+    """
+    owner = get_owner()
+    key = CHANNEL_KEY.format(lookup_key)
+    with _pending_lock:
+        if not _pending.get(lookup_key):
+            if not cache.add(key, owner, settings.CUTOUT_ASYNC_CHANNEL_SECONDS) and cache.get(key) != owner:
+                raise WritesPendingError("Another web server process has queued writes to the channel")
+        _pending[lookup_key] = _pending.get(lookup_key, 0) + 1
+        cache.set(key, owner, settings.CUTOUT_ASYNC_CHANNEL_SECONDS)
+
+
+def take_channel(lookup_key):
+    """Become the writer of a channel for a job taken over from a process that is no longer running
+
+    Args:
+        lookup_key (str): Lookup key of the channel
+    """
+    with _pending_lock:
+        _pending[lookup_key] = _pending.get(lookup_key, 0) + 1
+        cache.set(CHANNEL_KEY.format(lookup_key), get_owner(), settings.CUTOUT_ASYNC_CHANNEL_SECONDS)
+
+
+def release_channel(lookup_key):
+    """Finish one of the jobs of a channel, releasing the channel after the last one
+
+    Args:
+        lookup_key (str): Lookup key of the channel
+    """
+    owner = get_owner()
+    key = CHANNEL_KEY.format(lookup_key)
+    with _pending_lock:
+        count = _pending.pop(lookup_key, 0) - 1
+        if count > 0:
+            _pending[lookup_key] = count
+            cache.set(key, owner, settings.CUTOUT_ASYNC_CHANNEL_SECONDS)
+        elif cache.get(key) == owner:
+            cache.delete(key)
+
+
+def refresh_channels():
+    """Keep the channels this process is the writer of from expiring"""
+    owner = get_owner()
+    with _pending_lock:
+        for lookup_key in _pending:
+            key = CHANNEL_KEY.format(lookup_key)
+            if cache.get(key) in (None, owner):
+                cache.set(key, owner, settings.CUTOUT_ASYNC_CHANNEL_SECONDS)
+
+
+def write(resource, corner, resolution, data, time_sample, iso=False):
+    """Write a block of data to SpatialDB, as parallel shards if it is large
+
+    Args:
+        resource (BossResource): Channel to write to
+        corner (tuple[int]): (x, y, z) corner of the block
+        resolution (int): Resolution of the block
+        data (np.ndarray): (t, z, y, x) array to write
+        time_sample (int): First time sample of the block
+        iso (bool): If the block is written to the isotropic copy of the resolution
+    """
+    extent = (data.shape[3], data.shape[2], data.shape[1])
+    if sharded.use_sharded_cutout(corner, extent, data.shape[0], resource.get_bit_depth(), resolution):
+        sharded.write(resource, corner, resolution, data, time_sample, iso=iso)
+    else:
+        cache = invalidation.create_spatialdb()
+        cache.write_cuboid(resource, corner, resolution, data, time_sample, iso=iso)
+
+
+def record_write(resource, corner, resolution, extent, time_range, channel=None):
+    """Update the state that depends on a channel's data after a write
+
+    Bumps the channel's tile version, tracks the written cuboids for incremental downsamples, and marks a
+    downsampled channel as NOT_DOWNSAMPLED.
+
+    Args:
+        resource (BossResource): Channel that was written to
+        corner (tuple[int]): (x, y, z) corner of the write
+        resolution (int): Resolution of the write
+        extent (tuple[int]): (x, y, z) extent of the write
+        time_range (list[int]): [start, stop) time samples of the write
+        channel (optional[Channel]): Current channel, if the resource's copy may be out of date
+    """
+    lookup_key = resource.get_lookup_key()
+    if channel is None:
+        channel = resource.get_channel()
+
+    # Stop serving tiles rendered from the old data
+    tile_cache.bump_data_version(lookup_key)
+
+    # Track the written cuboids once the channel has a hierarchy, so it can be incrementally downsampled
+    try:
+        status = channel.downsample_status.upper()
+        dirty.DirtyCuboids().mark(lookup_key, resolution, corner, extent, time_range, CUBOIDSIZE[resolution],
+                                  start=status in ("DOWNSAMPLED", "IN_PROGRESS"))
+    except Exception:
+        BossLogger().logger.exception("Problem tracking the cuboids written to {}".format(lookup_key))
+
+    # If the channel status is DOWNSAMPLED change status to NOT_DOWNSAMPLED since you just wrote data
+    if channel.downsample_status.upper() == "DOWNSAMPLED":
+        _, exp_id, _ = lookup_key.split("&")
+        channel_obj = Channel.objects.get(name=channel.name, experiment=int(exp_id))
+        channel_obj.downsample_status = "NOT_DOWNSAMPLED"
+        channel_obj.downsample_arn = ""
+        channel_obj.save()
+
+
+def get_paths(job_id):
+    """Get the spool files of a job
+
+    Args:
+        job_id (str): Id of the job
+
+    Returns:
+        (tuple[str]): Paths of the array and the arguments
+    """
+    base = os.path.join(settings.CUTOUT_ASYNC_SPOOL_DIR, job_id)
+    return base + '.npy', base + '.json'
+
+
+def _write_file(path, write_fn):
+    """Write a file so that it is either complete on disk or not there at all
+
+    Args:
+        path (str): Path of the file
+        write_fn (callable): Function given the open file object to write the contents
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as fh:
+        write_fn(fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.rename(tmp, path)
+
+
+def get_job(job_id):
+    """Get the state of a write job
+
+    Args:
+        job_id (str): Id of the job
+
+    Returns:
+        (dict|None): State of the job, or None if the job doesn't exist or has expired
+    """
+    return cache.get(JOB_KEY.format(job_id))
+
+
+def save_job(job_id, state, **kwargs):
+    """Update the state of a write job
+
+    Args:
+        job_id (str): Id of the job
+        state (dict): Current state of the job, which is updated in place
+        **kwargs: Fields to change
+
+    Returns:
+        (dict): The updated state
+    """
+    state.update(kwargs)
+    state['updated'] = time.time()
+    cache.set(JOB_KEY.format(job_id), state, settings.CUTOUT_ASYNC_JOB_TTL)
+    return state
+
+
+def spool(resource, corner, resolution, data, time_sample, iso, user):
+    """Save a validated cutout post to disk and queue it to be written
+
+    Args:
+        resource (BossResource): Channel to write to
+        corner (tuple[int]): (x, y, z) corner of the block
+        resolution (int): Resolution of the block
+        data (np.ndarray): (t, z, y, x) array to write
+        time_sample (int): First time sample of the block
+        iso (bool): If the block is written to the isotropic copy of the resolution
+        user (str): Name of the user that posted the data, who can see the job's status
+
+    Returns:
+        (dict): State of the queued job
+
+    Raises:
+        OSError: If the spool directory doesn't have room for the data or can't be written
+        WritesPendingError: If another process has queued writes to the channel
+    """
+    os.makedirs(settings.CUTOUT_ASYNC_SPOOL_DIR, exist_ok=True)
+    free = shutil.disk_usage(settings.CUTOUT_ASYNC_SPOOL_DIR).free
+    if free - data.nbytes < settings.CUTOUT_ASYNC_MIN_FREE_BYTES:
+        raise OSError("Not enough space to queue the write")
+
+    lookup_key = resource.get_lookup_key()
+    acquire_channel(lookup_key)
+
+    job_id = uuid.uuid4().hex
+    data_path, args_path = get_paths(job_id)
+    args = {
+        'channel': lookup_key,
+        'resource': resource.to_dict(),
+        'corner': list(corner),
+        'resolution': resolution,
+        'time_sample': time_sample,
+        'iso': iso,
+    }
+
+    # The job is saved before its files, so other processes never mistake it for an orphan
+    state = {
+        'job_id': job_id,
+        'status': QUEUED,
+        'user': user,
+        'channel': lookup_key,
+        'resolution': resolution,
+        'created': time.time(),
+    }
+    save_job(job_id, state, **get_owner())
+
+    try:
+        _write_file(data_path, lambda fh: np.save(fh, data))
+        _write_file(args_path, lambda fh: fh.write(json.dumps(args).encode()))
+    except Exception:
+        remove(job_id)
+        cache.delete(JOB_KEY.format(job_id))
+        release_channel(lookup_key)
+        raise
+
+    submit(job_id)
+    return state
+
+
+def remove(job_id):
+    """Delete the spool files of a job
+
+    Args:
+        job_id (str): Id of the job
+    """
+    for path in get_paths(job_id):
+        for p in (path, path + '.tmp'):
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+
+def run_job(job_id):
+    """Write a spooled job to SpatialDB and delete its spool files
+
+    Args:
+        job_id (str): Id of the job
+    """
+    log = BossLogger().logger
+    state = get_job(job_id) or {'job_id': job_id}
+    save_job(job_id, state, status=RUNNING, **get_owner())
+    lookup_key = state.get('channel')
+
+    try:
+        data_path, args_path = get_paths(job_id)
+        with open(args_path) as fh:
+            args = json.load(fh)
+        data = np.load(data_path)
+
+        lookup_key = args['channel']
+        resource = BossResourceBasic(args['resource'])
+        corner = tuple(args['corner'])
+        time_sample = args['time_sample']
+        write(resource, corner, args['resolution'], data, time_sample, iso=args['iso'])
+
+        # The channel's downsample status may have changed since the job was queued
+        channel = Channel.objects.get(pk=int(lookup_key.split('&')[2]))
+        record_write(resource, corner, args['resolution'], (data.shape[3], data.shape[2], data.shape[1]),
+                     [time_sample, time_sample + data.shape[0]], channel=channel)
+        save_job(job_id, state, status=DONE)
+    except Exception as e:
+        log.exception("Problem writing spooled cutout {}".format(job_id))
+        save_job(job_id, state, status=FAILED, error=str(e))
+    finally:
+        remove(job_id)
+        if lookup_key is not None:
+            release_channel(lookup_key)
+        close_old_connections()
+
+
+def is_running(pid):
+    """Check if a process on this host is running
+
+    Args:
+        pid (int): Process id
+
+    Returns:
+        (bool)
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def get_boot_id():
+    """Get the id of the current boot of this host
+
+    Returns:
+        (str): The boot id, or '' if the platform doesn't have one
+    """
+    try:
+        with open(BOOT_ID_PATH) as fh:
+            return fh.read().strip()
+    except OSError:
+        return ''
+
+
+def get_owner():
+    """Get the fields of a job's state that identify this process as its owner
+
+    Process ids are reused after a reboot, so the boot is recorded with the process id
+
+    Returns:
+        (dict)
+    """
+    return {'owner': os.getpid(), 'boot_id': get_boot_id()}
+
+
+def is_owner_running(state):
+    """Check if the process that owns a job is still running
+
+    Args:
+        state (dict): State of the job
+
+    Returns:
+        (bool)
+    """
+    return state.get('boot_id', '') == get_boot_id() and is_running(state['owner'])
+
+
+def get_orphaned_jobs():
+    """Find the spooled jobs whose process is no longer running
+
+    Returns:
+        (list[str]): Ids of the jobs, oldest first
+    """
+    try:
+        names = os.listdir(settings.CUTOUT_ASYNC_SPOOL_DIR)
+    except FileNotFoundError:
+        return []
+
+    jobs = []
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        job_id = name[:-len('.json')]
+        state = get_job(job_id)
+        if state is not None and (state['status'] in (DONE, FAILED) or is_owner_running(state)):
+            continue
+        path = os.path.join(settings.CUTOUT_ASYNC_SPOOL_DIR, name)
+        jobs.append((os.path.getmtime(path), job_id))
+    return [job_id for _, job_id in sorted(jobs)]
+
+
+def get_job_channel(job_id):
+    """Get the channel of a spooled job from its arguments
+
+    Args:
+        job_id (str): Id of the job
+
+    Returns:
+        (str|None): Lookup key of the channel, or None if the arguments can't be read
+    """
+    try:
+        with open(get_paths(job_id)[1]) as fh:
+            return json.load(fh)['channel']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def recover():
+    """Queue the spooled jobs of processes that are no longer running
+
+    Returns:
+        (list[str]): Ids of the jobs taken over by this process
+    """
+    recovered = []
+    for job_id in get_orphaned_jobs():
+        # Only one process takes over each job
+        if cache.add(CLAIM_KEY.format(job_id), os.getpid(), CLAIM_SECONDS):
+            state = get_job(job_id) or {'job_id': job_id, 'created': time.time()}
+            if 'channel' not in state:
+                state['channel'] = get_job_channel(job_id)
+            save_job(job_id, state, status=QUEUED, **get_owner())
+            if state['channel'] is not None:
+                take_channel(state['channel'])
+            _queue.put(job_id)
+            recovered.append(job_id)
+    if recovered:
+        BossLogger().logger.info("Recovered {} spooled cutout writes".format(len(recovered)))
+    return recovered
+
+
+def work():
+    """Write queued jobs one at a time, forever, taking over orphaned jobs whenever the queue is idle"""
+    while True:
+        try:
+            recover()
+            refresh_channels()
+        except Exception:
+            BossLogger().logger.exception("Problem recovering spooled cutout writes")
+
+        try:
+            while True:
+                job_id = _queue.get(timeout=settings.CUTOUT_ASYNC_RECOVER_SECONDS)
+                try:
+                    run_job(job_id)
+                finally:
+                    _queue.task_done()
+        except queue.Empty:
+            pass
+
+
+def start():
+    """Start this process's worker thread if it isn't running"""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=work, daemon=True)
+            _worker.start()
+
+
+def submit(job_id):
+    """Queue a spooled job, starting this process's worker thread if needed
+
+    Args:
+        job_id (str): Id of the job
+    """
+    start()
+    _queue.put(job_id)
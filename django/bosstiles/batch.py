@@ -0,0 +1,175 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helpers for serving many tiles in a single request
+
+A batch request lists tiles as [orientation, resolution, x_idx, y_idx, z_idx]
+and/or a range of tiles. Tiles that fall in the same cuboid aligned block are
+grouped so a single cutout of the group's bounding box serves all of them.
+
+The response is a bundle of the encoded tiles, in the order requested, each
+prefixed with its length in bytes as a little endian uint32.
+"""
+
+from collections import OrderedDict
+import itertools
+import struct
+
+MEDIA_TYPE = 'application/x-boss-tile-bundle'
+
+ORIENTATIONS = ('xy', 'xz', 'yz')
+
+TILE_LENGTH = struct.Struct('<I')
+
+
+def tile_box(orientation, tile_size, x_idx, y_idx, z_idx):
+    """Get the region covered by a tile
+
+    Uses the same indexing as the tile service
+
+    Args:
+        orientation (str): Image plane of the tile (xy, xz, or yz)
+        tile_size (int): Width and height of the tile in pixels
+        x_idx (int): X index of the tile
+        y_idx (int): Y index of the tile
+        z_idx (int): Z index of the tile
+
+    Returns:
+        (tuple[tuple[int], tuple[int]]): (x, y, z) corner and extent of the tile
+    """
+    if orientation == 'xy':
+        return (tile_size * x_idx, tile_size * y_idx, z_idx), (tile_size, tile_size, 1)
+    elif orientation == 'yz':
+        return (x_idx, tile_size * y_idx, tile_size * z_idx), (1, tile_size, tile_size)
+    elif orientation == 'xz':
+        return (tile_size * x_idx, y_idx, tile_size * z_idx), (tile_size, 1, tile_size)
+    else:
+        raise ValueError("Invalid orientation: {}".format(orientation))
+
+
+def parse_tiles(data, max_tiles):
+    """Parse the tiles listed in a batch request
+
+    Args:
+        data (dict): Request body with 'tiles', a list of [orientation, resolution, x_idx, y_idx, z_idx], and/or
+                     'range', a dict with 'orientation', 'resolution', and [start, stop) 'x', 'y', and 'z' indices
+        max_tiles (int): Maximum number of tiles allowed in a request
+
+    Returns:
+        (list[tuple]): (orientation, resolution, x_idx, y_idx, z_idx) for each tile
+
+    Raises:
+        ValueError: If the tiles are invalid
+    """
+    tiles = []
+    try:
+        for tile in data.get('tiles', []):
+            orientation, resolution, x_idx, y_idx, z_idx = tile
+            tiles.append((orientation, int(resolution), int(x_idx), int(y_idx), int(z_idx)))
+
+        if 'range' in data:
+            rng = data['range']
+            axes = [range(int(rng[axis][0]), int(rng[axis][1])) for axis in ('x', 'y', 'z')]
+            count = len(axes[0]) * len(axes[1]) * len(axes[2])
+            if len(tiles) + count > max_tiles:
+                raise ValueError("Request is limited to {} tiles".format(max_tiles))
+            for x_idx, y_idx, z_idx in itertools.product(*axes):
+                tiles.append((rng['orientation'], int(rng['resolution']), x_idx, y_idx, z_idx))
+    except (TypeError, KeyError, IndexError, AttributeError):
+        raise ValueError("Invalid tile list")
+
+    if len(tiles) == 0:
+        raise ValueError("No tiles requested")
+    if len(tiles) > max_tiles:
+        raise ValueError("Request is limited to {} tiles".format(max_tiles))
+    for tile in tiles:
+        if tile[0] not in ORIENTATIONS:
+            raise ValueError("Invalid orientation: {}".format(tile[0]))
+        if min(tile[1:]) < 0:
+            raise ValueError("Invalid tile: {}".format(list(tile)))
+
+    return tiles
+
+
+def bounding_box(boxes):
+    """Get the bounding box of a list of regions
+
+    Args:
+        boxes (list[tuple[tuple[int], tuple[int]]]): (corner, extent) of each region
+
+    Returns:
+        (tuple[tuple[int], tuple[int]]): (corner, extent) of the bounding box
+    """
+    start = [min(corner[i] for corner, _ in boxes) for i in range(3)]
+    stop = [max(corner[i] + extent[i] for corner, extent in boxes) for i in range(3)]
+    return tuple(start), tuple(stop[i] - start[i] for i in range(3))
+
+
+def group_tiles(tiles, tile_size, get_cuboid_size):
+    """Group tiles that fall in the same cuboid aligned block
+
+    Each block is the tile's extent rounded up to a multiple of the cuboid size, so a group's bounding box is never
+    much larger than the data that has to be read for its tiles anyway.
+
+    Args:
+        tiles (list[tuple]): (orientation, resolution, x_idx, y_idx, z_idx) for each tile
+        tile_size (int): Width and height of the tiles in pixels
+        get_cuboid_size (function): Called with a resolution, returns the (x, y, z) cuboid size
+
+    Returns:
+        (OrderedDict): Map of group key to a list of (tile index, corner, extent)
+    """
+    groups = OrderedDict()
+    for i, (orientation, resolution, x_idx, y_idx, z_idx) in enumerate(tiles):
+        corner, extent = tile_box(orientation, tile_size, x_idx, y_idx, z_idx)
+        cuboid = get_cuboid_size(resolution)
+        block = [-(-extent[a] // cuboid[a]) * cuboid[a] for a in range(3)]
+        key = (resolution, orientation) + tuple(corner[a] // block[a] for a in range(3))
+        groups.setdefault(key, []).append((i, corner, extent))
+    return groups
+
+
+def encode_bundle(images):
+    """Encode tiles as a length prefixed bundle
+
+    Args:
+        images (list[bytes]): Encoded tiles
+
+    Returns:
+        (bytes)
+    """
+    parts = []
+    for image in images:
+        parts.append(TILE_LENGTH.pack(len(image)))
+        parts.append(image)
+    return b''.join(parts)
+
+
+def decode_bundle(buf):
+    """Decode a length prefixed bundle of tiles
+
+    Args:
+        buf (bytes): Bundle from encode_bundle()
+
+    Returns:
+        (list[bytes]): Encoded tiles
+    """
+    images = []
+    offset = 0
+    while offset < len(buf):
+        length, = TILE_LENGTH.unpack_from(buf, offset)
+        offset += TILE_LENGTH.size
+        images.append(bytes(buf[offset:offset + length]))
+        offset += length
+    return images
@@ -0,0 +1,82 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+import spdb
+
+from bosscore.request import BossRequest
+from bosscore.error import BossError
+from bosstiles import prerender
+
+
+class Command(BaseCommand):
+    help = "Pre-render a downsampled channel's XY tiles into the rendered tile cache, resuming an unfinished job"
+
+    def add_arguments(self, parser):
+        parser.add_argument('collection')
+        parser.add_argument('experiment')
+        parser.add_argument('channel')
+        parser.add_argument('--tile-size', type=int, default=512,
+                            help="Width and height of the tiles in pixels")
+        parser.add_argument('--resolutions', type=int, nargs='+',
+                            help="Resolutions to pre-render (default all)")
+        parser.add_argument('--formats', nargs='+', default=['png'],
+                            help="Image formats to render each tile in")
+        parser.add_argument('--restart', action='store_true',
+                            help="Start an unfinished job over instead of resuming it")
+        parser.add_argument('--user', default='bossadmin',
+                            help="User whose permissions are used to read the channel")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError("User {} does not exist".format(options['user']))
+
+        request = SimpleNamespace(user=user, method='GET', version='v1')
+        request_args = {
+            "service": "downsample",
+            "collection_name": options['collection'],
+            "experiment_name": options['experiment'],
+            "channel_name": options['channel']
+        }
+        try:
+            resource = spdb.project.BossResourceDjango(BossRequest(request, request_args))
+        except BossError as err:
+            raise CommandError(err.message)
+
+        if resource.get_channel().downsample_status.upper() != "DOWNSAMPLED":
+            raise CommandError("Channel must be downsampled before tiles are pre-rendered")
+
+        resolutions = options['resolutions']
+        if resolutions is None:
+            resolutions = list(range(resource.get_experiment().num_hierarchy_levels))
+
+        try:
+            state = prerender.start(resource, options['tile_size'], resolutions, options['formats'],
+                                    restart=options['restart'])
+        except ValueError as err:
+            raise CommandError(str(err))
+
+        def progress(state):
+            self.stdout.write("{}/{} units rendered".format(state['done'], state['total']))
+
+        state = prerender.run(state['key'], progress)
+        if state['status'] == prerender.FAILED:
+            raise CommandError("Pre-rendering failed: {}".format(state['error']))
+        self.stdout.write("Pre-rendering {}".format(state['status'].lower()))
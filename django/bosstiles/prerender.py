@@ -0,0 +1,323 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pre-rendering of a channel's XY tile pyramid into the rendered tile cache
+
+A job walks the channel's extent at each requested resolution, one column of
+tiles through a cuboid aligned z slab at a time, so that each cutout serves
+up to a cuboid's depth of tiles. The job state, including a cursor to the
+next unit of work, is kept in the Django cache after every unit, which is
+used to report progress and to resume a job that failed, was cancelled, or
+whose process died.
+
+Jobs are started by the prerender_tiles management command or the
+v1/tile/<collection>/<experiment>/<channel>/prerender/ API.
+"""
+
+import itertools
+import math
+import time
+
+from django.conf import settings
+
+from spdb.project import BossResourceBasic
+from spdb.spatialdb import Cube
+from spdb.spatialdb.spatialdb import CUBOIDSIZE
+
+from bossspatialdb import invalidation
+from bossspatialdb.sharded import aligned_ranges
+from bossutils.logger import BossLogger
+
+from . import tile_cache
+from .renderers import TILE_ENCODERS
+
+STATE_KEY = 'boss-tile-prerender:{}:{}'
+CANCEL_KEY = '{}:cancel'
+START_KEY = '{}:start'
+
+# Job statuses
+RUNNING = 'RUNNING'
+CANCELLED = 'CANCELLED'
+FAILED = 'FAILED'
+DONE = 'DONE'
+
+
+def get_state_key(lookup_key, tile_size):
+    """Get the cache key of a job's state
+
+    Args:
+        lookup_key (str): Lookup key of the channel
+        tile_size (int): Width and height of the tiles in pixels
+
+    Returns:
+        (str)
+    """
+    return STATE_KEY.format(lookup_key, tile_size)
+
+
+def get_state(state_key):
+    """Get the state of a job
+
+    Args:
+        state_key (str): Key from get_state_key()
+
+    Returns:
+        (dict|None): None if there is no job
+    """
+    return tile_cache.get_cache().get(state_key)
+
+
+def save_state(state):
+    """Save the state of a job
+
+    Args:
+        state (dict): Job state
+    """
+    state['updated'] = time.time()
+    tile_cache.get_cache().set(state['key'], state, None)
+
+
+def is_active(state):
+    """Determine if a job is running in some process
+
+    A running job that hasn't saved its state for settings.TILE_PRERENDER_STALE_SECONDS is assumed to have died with
+    its process.
+
+    Args:
+        state (dict|None): Job state
+
+    Returns:
+        (bool)
+    """
+    if state is None or state['status'] != RUNNING:
+        return False
+    return time.time() - state['updated'] < settings.TILE_PRERENDER_STALE_SECONDS
+
+
+def tile_ranges(start, stop, tile_size):
+    """Get the range of tile indices that are completely inside the given range
+
+    Args:
+        start (int): Start of the range
+        stop (int): Stop (exclusive) of the range
+        tile_size (int): Width and height of the tiles in pixels
+
+    Returns:
+        (range)
+    """
+    return range(int(math.ceil(start / tile_size)), stop // tile_size)
+
+
+def get_work_units(state, resolution):
+    """Get the units of work at a resolution
+
+    Each unit is a column of tiles through a cuboid aligned z slab. Only tiles that are inside the coordinate frame,
+    and so can be requested from the tile service, and that start inside the downsampled extent are rendered.
+
+    Args:
+        state (dict): Job state
+        resolution (int): Resolution to get the work for
+
+    Returns:
+        (tuple): Number of units and an iterator of (x_idx, y_idx, z_start, z_stop) units
+    """
+    tile_size = state['tile_size']
+    frame_start = state['frame_start']
+    frame_stop = state['frame_stop']
+    extent = state['extents'][str(resolution)]
+
+    xs = tile_ranges(frame_start[0], min(frame_stop[0], extent[0] + tile_size - 1), tile_size)
+    ys = tile_ranges(frame_start[1], min(frame_stop[1], extent[1] + tile_size - 1), tile_size)
+    zs = aligned_ranges(frame_start[2], min(frame_stop[2], extent[2]), state['cuboid_z'][str(resolution)])
+
+    count = len(xs) * len(ys) * len(zs)
+    units = ((x, y, z0, z1) for (z0, z1), y, x in itertools.product(zs, ys, xs))
+    return count, units
+
+
+def create_state(resource, tile_size, resolutions, formats):
+    """Create the state of a new job
+
+    Args:
+        resource (BossResourceDjango): Channel to pre-render
+        tile_size (int): Width and height of the tiles in pixels
+        resolutions (list[int]): Resolutions to pre-render
+        formats (list[str]): Image formats to render each tile in
+
+    Returns:
+        (dict)
+
+    Raises:
+        ValueError: If the arguments are invalid
+    """
+    experiment = resource.get_experiment()
+    coord_frame = resource.get_coord_frame()
+    channel = resource.get_channel()
+
+    if tile_size <= 0:
+        raise ValueError("Invalid tile size {}".format(tile_size))
+    for fmt in formats:
+        if fmt not in TILE_ENCODERS:
+            raise ValueError("Unsupported tile format {}".format(fmt))
+
+    extents = resource.get_downsampled_extent_dims()
+    for resolution in resolutions:
+        if not 0 <= resolution < experiment.num_hierarchy_levels:
+            raise ValueError("Invalid resolution {}".format(resolution))
+
+    lookup_key = resource.get_lookup_key()
+    state = {
+        'key': get_state_key(lookup_key, tile_size),
+        'resource': resource.to_dict(),
+        'lookup_key': lookup_key,
+        'tile_size': tile_size,
+        'resolutions': resolutions,
+        'formats': formats,
+        'time_sample': channel.default_time_sample,
+        'frame_start': [coord_frame.x_start, coord_frame.y_start, coord_frame.z_start],
+        'frame_stop': [coord_frame.x_stop, coord_frame.y_stop, coord_frame.z_stop],
+        'extents': {str(res): list(extents[res]) for res in resolutions},
+        'cuboid_z': {str(res): CUBOIDSIZE[res][2] for res in resolutions},
+        'status': RUNNING,
+        'resolution_index': 0,
+        'cursor': 0,
+        'done': 0,
+        'error': None,
+        'started': time.time(),
+    }
+    state['total'] = sum(get_work_units(state, res)[0] for res in resolutions)
+    return state
+
+
+def start(resource, tile_size, resolutions, formats, restart=False):
+    """Create a job, or resume the channel's existing job for the tile size
+
+    Args:
+        resource (BossResourceDjango): Channel to pre-render
+        tile_size (int): Width and height of the tiles in pixels
+        resolutions (list[int]): Resolutions to pre-render
+        formats (list[str]): Image formats to render each tile in
+        restart (bool): If an unfinished job should be started over instead of resumed
+
+    Returns:
+        (dict): State of the job, which has been saved as RUNNING
+
+    Raises:
+        ValueError: If the arguments are invalid or the job is already running
+    """
+    state_key = get_state_key(resource.get_lookup_key(), tile_size)
+
+    # Only one request at a time can check the job and save it as RUNNING
+    cache = tile_cache.get_cache()
+    start_key = START_KEY.format(state_key)
+    if not cache.add(start_key, True, settings.TILE_PRERENDER_STALE_SECONDS):
+        raise ValueError("Tiles are already being pre-rendered for this channel and tile size")
+
+    try:
+        state = get_state(state_key)
+        if is_active(state):
+            raise ValueError("Tiles are already being pre-rendered for this channel and tile size")
+
+        if state is None or restart or state['status'] == DONE:
+            state = create_state(resource, tile_size, resolutions, formats)
+        else:
+            state['status'] = RUNNING
+            state['error'] = None
+
+        cache.delete(CANCEL_KEY.format(state['key']))
+        save_state(state)
+    finally:
+        cache.delete(start_key)
+    return state
+
+
+def cancel(state_key):
+    """Ask a running job to stop after its current unit of work
+
+    The request is kept separate from the job state, which the job overwrites after every unit of work
+
+    Args:
+        state_key (str): Key from get_state_key()
+
+    Returns:
+        (bool): If there was a running job to cancel
+    """
+    if not is_active(get_state(state_key)):
+        return False
+    tile_cache.get_cache().set(CANCEL_KEY.format(state_key), True, settings.TILE_PRERENDER_STALE_SECONDS)
+    return True
+
+
+def run(state_key, progress=None):
+    """Run a job until it finishes, fails, or is cancelled
+
+    Args:
+        state_key (str): Key from get_state_key() of a job saved by start()
+        progress (optional[function]): Called with the job state after each unit of work
+
+    Returns:
+        (dict): Final state of the job
+    """
+    state = get_state(state_key)
+    resource = BossResourceBasic(state['resource'])
+    cache = invalidation.create_spatialdb()
+
+    tile_size = state['tile_size']
+    time_range = [state['time_sample'], state['time_sample'] + 1]
+    encoders = [TILE_ENCODERS[fmt]() for fmt in state['formats']]
+
+    try:
+        while state['resolution_index'] < len(state['resolutions']):
+            resolution = state['resolutions'][state['resolution_index']]
+            _, units = get_work_units(state, resolution)
+
+            for x_idx, y_idx, z_start, z_stop in itertools.islice(units, state['cursor'], None):
+                if tile_cache.get_cache().get(CANCEL_KEY.format(state_key)):
+                    state['status'] = CANCELLED
+                    save_state(state)
+                    return state
+
+                corner = (x_idx * tile_size, y_idx * tile_size, z_start)
+                extent = (tile_size, tile_size, z_stop - z_start)
+                data = cache.cutout(resource, corner, extent, resolution, time_range).data
+
+                for z in range(z_start, z_stop):
+                    cube = Cube.create_cube(resource, [tile_size, tile_size, 1], time_range)
+                    cube.data = data[:, z - z_start:z - z_start + 1].copy()
+                    img = cube.xy_image()
+
+                    for encoder in encoders:
+                        key = tile_cache.get_tile_key(state['lookup_key'], resolution, 'xy',
+                                                      (corner[0], corner[1], z), (tile_size, tile_size, 1),
+                                                      time_range, encoder.format)
+                        tile_cache.set_tile(key, encoder.render(img), settings.TILE_PRERENDER_TTL)
+
+                state['cursor'] += 1
+                state['done'] += 1
+                save_state(state)
+                if progress:
+                    progress(state)
+
+            state['resolution_index'] += 1
+            state['cursor'] = 0
+            save_state(state)
+
+        state['status'] = DONE
+    except Exception as ex:
+        BossLogger().logger.exception("Problem pre-rendering tiles for {}".format(state_key))
+        state['status'] = FAILED
+        state['error'] = str(ex)
+
+    save_state(state)
+    return state
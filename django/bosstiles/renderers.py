@@ -12,9 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import io
+from django.conf import settings
+from PIL import Image
 from rest_framework import renderers
 from rest_framework.renderers import JSONRenderer
 from bosscore.renderer_helper import check_for_403, check_for_429
+from . import batch
 
 
 class PNGRenderer(renderers.BaseRenderer):
@@ -29,9 +32,8 @@ class PNGRenderer(renderers.BaseRenderer):
     @check_for_429
     def render(self, data, media_type=None, renderer_context=None):
         file_obj = io.BytesIO()
-        data.save(file_obj, "PNG")
-        file_obj.seek(0)
-        return file_obj.read()
+        data.save(file_obj, "PNG", **settings.TILE_PNG_SETTINGS)
+        return file_obj.getvalue()
 
 
 class JPEGRenderer(renderers.BaseRenderer):
@@ -46,7 +48,58 @@ class JPEGRenderer(renderers.BaseRenderer):
     @check_for_429
     def render(self, data, media_type=None, renderer_context=None):
         file_obj = io.BytesIO()
-        data.save(file_obj, "JPEG")
-        file_obj.seek(0)
-        return file_obj.read()
+        data.save(file_obj, "JPEG", **settings.TILE_JPEG_SETTINGS)
+        return file_obj.getvalue()
 
+
+class WebPRenderer(renderers.BaseRenderer):
+    """ A DRF renderer for rendering an XY image as a webp
+
+    Only available if Pillow was built with WebP support (see IMAGE_RENDERERS)
+    """
+    media_type = 'image/webp'
+    format = 'webp'
+    charset = None
+    render_style = 'binary'
+
+    @check_for_403
+    @check_for_429
+    def render(self, data, media_type=None, renderer_context=None):
+        file_obj = io.BytesIO()
+        data.save(file_obj, "WEBP", **settings.TILE_WEBP_SETTINGS)
+        return file_obj.getvalue()
+
+
+def webp_supported():
+    """Determine if Pillow can encode WebP images
+
+    Returns:
+        (bool)
+    """
+    Image.init()
+    return 'WEBP' in Image.SAVE
+
+
+# Renderers for the image and tile services. WebP is last so it is only used when the client explicitly accepts it
+IMAGE_RENDERERS = (PNGRenderer, JPEGRenderer)
+if settings.TILE_WEBP_ENABLED and webp_supported():
+    IMAGE_RENDERERS += (WebPRenderer,)
+
+# Renderers used to encode tiles outside of content negotiation, by format name
+TILE_ENCODERS = {renderer.format: renderer for renderer in IMAGE_RENDERERS}
+TILE_ENCODERS['jpeg'] = JPEGRenderer
+
+
+
+class TileBundleRenderer(renderers.BaseRenderer):
+    """ A DRF renderer for a length prefixed bundle of encoded tiles, built by bosstiles.batch.encode_bundle()
+    """
+    media_type = batch.MEDIA_TYPE
+    format = 'bin'
+    charset = None
+    render_style = 'binary'
+
+    @check_for_403
+    @check_for_429
+    def render(self, data, media_type=None, renderer_context=None):
+        return data
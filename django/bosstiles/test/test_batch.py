@@ -0,0 +1,66 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from bosstiles import batch
+
+CUBOID_SIZE = (512, 512, 16)
+
+
+class TestBatchTiles(unittest.TestCase):
+
+    def test_tile_box(self):
+        self.assertEqual(batch.tile_box('xy', 512, 1, 2, 3), ((512, 1024, 3), (512, 512, 1)))
+        self.assertEqual(batch.tile_box('xz', 512, 1, 2, 3), ((512, 2, 1536), (512, 1, 512)))
+        self.assertEqual(batch.tile_box('yz', 512, 1, 2, 3), ((1, 1024, 1536), (1, 512, 512)))
+        with self.assertRaises(ValueError):
+            batch.tile_box('zz', 512, 0, 0, 0)
+
+    def test_parse_tiles(self):
+        data = {'tiles': [['xy', 0, 1, 2, 3]],
+                'range': {'orientation': 'xy', 'resolution': 1, 'x': [0, 2], 'y': [0, 1], 'z': [4, 5]}}
+        tiles = batch.parse_tiles(data, 10)
+        self.assertEqual(tiles, [('xy', 0, 1, 2, 3), ('xy', 1, 0, 0, 4), ('xy', 1, 1, 0, 4)])
+
+    def test_parse_tiles_invalid(self):
+        with self.assertRaises(ValueError):
+            batch.parse_tiles({}, 10)
+        with self.assertRaises(ValueError):
+            batch.parse_tiles({'tiles': [['xy', 0, 1]]}, 10)
+        with self.assertRaises(ValueError):
+            batch.parse_tiles({'tiles': [['ab', 0, 1, 2, 3]]}, 10)
+        with self.assertRaises(ValueError):
+            batch.parse_tiles({'tiles': [['xy', 0, -1, 2, 3]]}, 10)
+
+    def test_parse_tiles_limit(self):
+        data = {'range': {'orientation': 'xy', 'resolution': 0, 'x': [0, 100], 'y': [0, 100], 'z': [0, 100]}}
+        with self.assertRaises(ValueError):
+            batch.parse_tiles(data, 256)
+
+    def test_group_tiles(self):
+        tiles = [('xy', 0, 0, 0, z) for z in range(20)] + [('xy', 0, 1, 0, 0), ('xy', 1, 0, 0, 0)]
+        groups = batch.group_tiles(tiles, 512, lambda res: CUBOID_SIZE)
+
+        self.assertEqual(len(groups), 4)
+        self.assertEqual([i for i, _, _ in groups[(0, 'xy', 0, 0, 0)]], list(range(16)))
+        self.assertEqual([i for i, _, _ in groups[(0, 'xy', 0, 0, 1)]], list(range(16, 20)))
+        self.assertEqual(batch.bounding_box([(c, e) for _, c, e in groups[(0, 'xy', 0, 0, 0)]]),
+                         ((0, 0, 0), (512, 512, 16)))
+
+    def test_bundle(self):
+        images = [b'abc', b'', b'defgh']
+        buf = batch.encode_bundle(images)
+        self.assertEqual(len(buf), 8 + 3 * batch.TILE_LENGTH.size)
+        self.assertEqual(batch.decode_bundle(buf), images)
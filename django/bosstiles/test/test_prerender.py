@@ -0,0 +1,118 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from unittest.mock import MagicMock
+
+from django.test import SimpleTestCase, override_settings
+
+from bosstiles import prerender
+
+CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=CACHES, TILE_CACHE='default', TILE_PRERENDER_STALE_SECONDS=60)
+class TestPrerender(SimpleTestCase):
+
+    def setUp(self):
+        prerender.tile_cache.get_cache().clear()
+
+    def get_state(self):
+        return {
+            'key': prerender.get_state_key('1&2&3', 512),
+            'tile_size': 512,
+            'resolutions': [0, 1],
+            'frame_start': [0, 0, 0],
+            'frame_stop': [2000, 1100, 40],
+            'extents': {'0': [2000, 1100, 40], '1': [1000, 550, 40]},
+            'cuboid_z': {'0': 16, '1': 16},
+            'status': prerender.RUNNING,
+            'cursor': 0,
+        }
+
+    def test_tile_ranges(self):
+        self.assertEqual(prerender.tile_ranges(0, 2048, 512), range(0, 4))
+        self.assertEqual(prerender.tile_ranges(0, 2047, 512), range(0, 3))
+        self.assertEqual(prerender.tile_ranges(100, 2048, 512), range(1, 4))
+
+    def test_work_units(self):
+        count, units = prerender.get_work_units(self.get_state(), 0)
+        units = list(units)
+
+        # 3 x 2 tile columns through 3 z slabs
+        self.assertEqual(count, 18)
+        self.assertEqual(len(units), count)
+        self.assertEqual(units[0], (0, 0, 0, 16))
+        self.assertEqual(units[1], (1, 0, 0, 16))
+        self.assertEqual(units[-1], (2, 1, 32, 40))
+
+    def test_work_units_downsampled(self):
+        # Tiles that start inside the downsampled extent are rendered
+        count, units = prerender.get_work_units(self.get_state(), 1)
+        self.assertEqual(count, 2 * 2 * 3)
+        self.assertEqual(sorted(set((x, y) for x, y, _, _ in units)), [(0, 0), (0, 1), (1, 0), (1, 1)])
+
+    def test_is_active(self):
+        state = self.get_state()
+        self.assertFalse(prerender.is_active(None))
+
+        prerender.save_state(state)
+        self.assertTrue(prerender.is_active(prerender.get_state(state['key'])))
+
+        state['updated'] = time.time() - 120
+        self.assertFalse(prerender.is_active(state))
+
+        state['status'] = prerender.DONE
+        state['updated'] = time.time()
+        self.assertFalse(prerender.is_active(state))
+
+    def test_cancel(self):
+        state = self.get_state()
+        self.assertFalse(prerender.cancel(state['key']))
+
+        prerender.save_state(state)
+        self.assertTrue(prerender.cancel(state['key']))
+        self.assertTrue(prerender.tile_cache.get_cache().get(prerender.CANCEL_KEY.format(state['key'])))
+
+    def test_start_resumes(self):
+        resource = MagicMock()
+        resource.get_lookup_key.return_value = '1&2&3'
+        state = self.get_state()
+        state['status'] = prerender.CANCELLED
+        prerender.save_state(state)
+
+        self.assertEqual(prerender.start(resource, 512, [0, 1], ['png'])['status'], prerender.RUNNING)
+
+        # The job is now running, so it can't be started again
+        with self.assertRaises(ValueError):
+            prerender.start(resource, 512, [0, 1], ['png'])
+
+    def test_start_claimed(self):
+        resource = MagicMock()
+        resource.get_lookup_key.return_value = '1&2&3'
+        state = self.get_state()
+        state['status'] = prerender.CANCELLED
+        prerender.save_state(state)
+
+        # Another request is starting the job
+        start_key = prerender.START_KEY.format(state['key'])
+        prerender.tile_cache.get_cache().add(start_key, True)
+        with self.assertRaises(ValueError):
+            prerender.start(resource, 512, [0, 1], ['png'])
+        self.assertEqual(prerender.get_state(state['key'])['status'], prerender.CANCELLED)
+
+        # The claim is released once that request has saved the job
+        prerender.tile_cache.get_cache().delete(start_key)
+        prerender.start(resource, 512, [0, 1], ['png'])
+        self.assertIsNone(prerender.tile_cache.get_cache().get(start_key))
@@ -0,0 +1,46 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import unittest
+
+from django.test import SimpleTestCase
+from PIL import Image
+
+from bosstiles.renderers import PNGRenderer, JPEGRenderer, WebPRenderer, webp_supported
+
+
+class TestImageRenderers(SimpleTestCase):
+
+    def setUp(self):
+        self.img = Image.frombytes('L', (64, 32), bytes(range(256)) * 8)
+
+    def test_png(self):
+        data = PNGRenderer().render(self.img)
+        decoded = Image.open(io.BytesIO(data))
+        self.assertEqual(decoded.format, 'PNG')
+        self.assertEqual(decoded.tobytes(), self.img.tobytes())
+
+    def test_jpeg(self):
+        data = JPEGRenderer().render(self.img)
+        decoded = Image.open(io.BytesIO(data))
+        self.assertEqual(decoded.format, 'JPEG')
+        self.assertEqual(decoded.size, (64, 32))
+
+    @unittest.skipUnless(webp_supported(), "Pillow was built without WebP support")
+    def test_webp_lossless(self):
+        data = WebPRenderer().render(self.img)
+        decoded = Image.open(io.BytesIO(data))
+        self.assertEqual(decoded.format, 'WEBP')
+        self.assertEqual(decoded.convert('L').tobytes(), self.img.tobytes())
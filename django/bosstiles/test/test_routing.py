@@ -13,7 +13,7 @@
 # limitations under the License.
 
 from django.core.urlresolvers import resolve
-from bosstiles.views import Tile, CutoutTile
+from bosstiles.views import Tile, CutoutTile, TileBatch
 
 from rest_framework.test import APITestCase
 
@@ -92,3 +92,14 @@ class TileInterfaceRoutingTests(APITestCase):
 
         view_tiles = resolve('/' + version + '/tile/col1/exp1/ds1/yz/512/2/0/1/1/3/')
         self.assertEqual(view_tiles.func.__name__, Tile.as_view().__name__)
+
+    def test_batch_tile_resolves(self):
+        """
+        Test to make sure the batch tile URL resolves
+        :return:
+        """
+        view_tiles = resolve('/' + version + '/tile/col1/exp1/ds1/batch/512')
+        self.assertEqual(view_tiles.func.__name__, TileBatch.as_view().__name__)
+
+        view_tiles = resolve('/' + version + '/tile/col1/exp1/ds1/batch/512/')
+        self.assertEqual(view_tiles.func.__name__, TileBatch.as_view().__name__)
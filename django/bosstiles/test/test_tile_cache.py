@@ -0,0 +1,77 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+
+from django.test import SimpleTestCase, override_settings
+
+from bosstiles import tile_cache
+
+CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=CACHES, TILE_CACHE='default', TILE_CACHE_TTL=60, TILE_CACHE_MAX_BYTES=10)
+class TestTileCache(SimpleTestCase):
+
+    def setUp(self):
+        tile_cache.get_cache().clear()
+
+    def get_key(self, lookup_key='1&2&3'):
+        return tile_cache.get_tile_key(lookup_key, 0, 'xy', (0, 0, 5), (512, 512, 1), [0, 1], 'png')
+
+    def test_set_get(self):
+        key = self.get_key()
+        self.assertIsNone(tile_cache.get_tile(key))
+
+        etag = tile_cache.set_tile(key, b'tile')
+        self.assertEqual(tile_cache.get_tile(key), (etag, b'tile'))
+
+    def test_max_bytes(self):
+        key = self.get_key()
+        etag = tile_cache.set_tile(key, b'a large tile')
+        self.assertEqual(etag, tile_cache.make_etag(b'a large tile'))
+        self.assertIsNone(tile_cache.get_tile(key))
+
+    def test_bump_data_version(self):
+        key = self.get_key()
+        tile_cache.set_tile(key, b'tile')
+
+        tile_cache.bump_data_version('1&2&3')
+        self.assertNotEqual(self.get_key(), key)
+        self.assertIsNone(tile_cache.get_tile(self.get_key()))
+
+        # Other channels are not affected
+        self.assertEqual(self.get_key('1&2&4'), self.get_key('1&2&4'))
+
+    def test_evicted_version(self):
+        key = self.get_key()
+        tile_cache.get_cache().delete(tile_cache.VERSION_KEY.format('1&2&3'))
+        self.assertNotEqual(self.get_key(), key)
+
+    def test_make_etag_from_parts(self):
+        etag = tile_cache.make_etag('1&2&3', 5, (0, 0, 0), 'raw')
+        self.assertEqual(etag, tile_cache.make_etag('1&2&3', 5, (0, 0, 0), 'raw'))
+        self.assertNotEqual(etag, tile_cache.make_etag('1&2&3', 6, (0, 0, 0), 'raw'))
+        self.assertNotEqual(etag, tile_cache.make_etag('1&2&3', 5, (512, 0, 0), 'raw'))
+
+        # Content is hashed as is
+        self.assertEqual(tile_cache.make_etag(b'tile'), '"{}"'.format(hashlib.md5(b'tile').hexdigest()))
+
+    def test_etag_matches(self):
+        etag = tile_cache.make_etag(b'tile')
+        self.assertTrue(tile_cache.etag_matches(etag, etag))
+        self.assertTrue(tile_cache.etag_matches('"other", W/' + etag, etag))
+        self.assertTrue(tile_cache.etag_matches('*', etag))
+        self.assertFalse(tile_cache.etag_matches('"other"', etag))
+        self.assertFalse(tile_cache.etag_matches(None, etag))
@@ -0,0 +1,172 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cache of rendered tiles
+
+Encoded tiles are kept in the Django cache named by settings.TILE_CACHE,
+keyed by the channel's lookup key, the channel's data version, and the
+region, time range, and format of the tile. Writing data to a channel or
+finishing a downsample bumps the channel's data version, so tiles rendered
+from the old data are never served again and age out of the cache.
+
+Each cached tile has a strong ETag computed from its content, which is used
+to answer conditional GETs with 304 Not Modified.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+VERSION_KEY = 'boss-tile-version:{}'
+TILE_KEY = 'boss-tile:{}:{}:{}'
+
+
+def get_cache():
+    """Get the Django cache used for rendered tiles
+
+    Returns:
+        (BaseCache)
+    """
+    return caches[settings.TILE_CACHE]
+
+
+def get_data_version(lookup_key):
+    """Get the data version of a channel
+
+    If the version was evicted or never set a new version based on the current time is created, so tiles cached
+    under an older version can't be served.
+
+    Args:
+        lookup_key (str): Lookup key of the channel
+
+    Returns:
+        (int)
+    """
+    cache = get_cache()
+    key = VERSION_KEY.format(lookup_key)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_data_version(lookup_key):
+    """Change the data version of a channel, invalidating all of its cached tiles
+
+    Args:
+        lookup_key (str): Lookup key of the channel
+    """
+    cache = get_cache()
+    key = VERSION_KEY.format(lookup_key)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # No current version
+        cache.set(key, int(time.time() * 1000), None)
+
+
+def get_tile_key(lookup_key, resolution, orientation, corner, extent, time_range, image_format):
+    """Get the cache key of a rendered tile
+
+    Args:
+        lookup_key (str): Lookup key of the channel
+        resolution (int): Resolution of the tile
+        orientation (str): Image plane of the tile (xy, xz, or yz)
+        corner (tuple[int]): (x, y, z) corner of the tile
+        extent (tuple[int]): (x, y, z) extent of the tile
+        time_range (list[int]): [start, stop) time samples of the tile
+        image_format (str): Format of the encoded tile
+
+    Returns:
+        (str)
+    """
+    region = '{}:{}:{}:{}:{}'.format(resolution, orientation, ','.join(str(c) for c in corner),
+                                     ','.join(str(e) for e in extent), ','.join(str(t) for t in time_range))
+    return TILE_KEY.format(lookup_key, get_data_version(lookup_key), region + ':' + image_format)
+
+
+def make_etag(*parts):
+    """Create a strong ETag from a response's content, or from the values that determine its bytes
+
+    Args:
+        *parts (bytes|object): Content, such as an encoded tile, or values that identify the data and its encoding,
+                               including the channel's data version. Values that aren't bytes are hashed as strings
+
+    Returns:
+        (str): Quoted ETag
+    """
+    digest = hashlib.md5()
+    for i, part in enumerate(parts):
+        if i:
+            digest.update(b':')
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+    return '"{}"'.format(digest.hexdigest())
+
+
+def get_tile(key):
+    """Get a rendered tile from the cache
+
+    Args:
+        key (str): Key from get_tile_key()
+
+    Returns:
+        (tuple|None): (etag, content) or None if the tile isn't cached
+    """
+    return get_cache().get(key)
+
+
+def set_tile(key, content, ttl=None):
+    """Add a rendered tile to the cache
+
+    Tiles larger than settings.TILE_CACHE_MAX_BYTES are not cached
+
+    Args:
+        key (str): Key from get_tile_key()
+        content (bytes): Encoded tile
+        ttl (optional[int]): Number of seconds to cache the tile, defaults to settings.TILE_CACHE_TTL
+
+    Returns:
+        (str): ETag of the tile
+    """
+    etag = make_etag(content)
+    if len(content) <= settings.TILE_CACHE_MAX_BYTES:
+        get_cache().set(key, (etag, content), ttl or settings.TILE_CACHE_TTL)
+    return etag
+
+
+def etag_matches(if_none_match, etag):
+    """Determine if an If-None-Match header matches an ETag
+
+    Uses the weak comparison required for If-None-Match
+
+    Args:
+        if_none_match (str|None): Value of the If-None-Match header
+        etag (str): Quoted ETag of the current representation
+
+    Returns:
+        (bool)
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+
+    def strip_weak(tag):
+        tag = tag.strip()
+        return tag[2:] if tag.startswith('W/') else tag
+
+    return strip_weak(etag) in [strip_weak(tag) for tag in if_none_match.split(',')]
@@ -16,6 +16,14 @@ from django.conf.urls import url
 from bosstiles import views
 
 urlpatterns = [
+    # Url to handle requests for a batch of tiles
+    url(r'^(?P<collection>[\w_-]+)/(?P<experiment>[\w_-]+)/(?P<channel>[\w_-]+)/batch/(?P<tile_size>\d+)/?$',
+        views.TileBatch.as_view()),
+
+    # Url to handle pre-rendering a channel's tiles
+    url(r'^(?P<collection>[\w_-]+)/(?P<experiment>[\w_-]+)/(?P<channel>[\w_-]+)/prerender/(?P<tile_size>\d+)/?$',
+        views.TilePrerender.as_view()),
+
     # Url to handle cutout with a collection, experiment, channel/annotation project
     url(r'^(?P<collection>[\w_-]+)/(?P<experiment>[\w_-]+)/(?P<channel>[\w_-]+)/(?P<orientation>(xy|xz|yz))/(?P<tile_size>\d+)/(?P<resolution>\d)/(?P<x_idx>\d+)/(?P<y_idx>\d+)/(?P<z_idx>\d+)/?(?P<t_idx>\d+)?/?.*$',
         views.Tile.as_view()),
@@ -14,18 +14,62 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
 
 from boss import utils
+from boss import metrics
 from boss.throttling import BossThrottle
 from bosscore.request import BossRequest
 from bosscore.error import BossError, BossHTTPError, ErrorCodes
 
+import numpy as np
+import threading
 import spdb
+from spdb.spatialdb import Cube
+from spdb.spatialdb.spatialdb import CUBOIDSIZE
 
 import bossutils
+from bossspatialdb import invalidation
+from bossspatialdb import sharded
 
-from .renderers import PNGRenderer, JPEGRenderer
+from . import batch
+from . import prerender
+from . import tile_cache
+from .renderers import TileBundleRenderer, IMAGE_RENDERERS, TILE_ENCODERS
+
+def tile_response(request, tile_key, render):
+    """Serve a tile from the rendered tile cache, rendering and caching it if needed
+
+    Sets a strong ETag on the response and returns 304 Not Modified if it matches the request's If-None-Match header
+
+    Args:
+        request (rest_framework.request.Request): DRF Request object
+        tile_key (str|None): Key of the tile in the rendered tile cache, or None to not use the cache
+        render (function): Called with no arguments to get the tile as an image
+
+    Returns:
+        (HttpResponse)
+    """
+    renderer = request.accepted_renderer
+
+    cached = tile_cache.get_tile(tile_key) if tile_key else None
+    if cached is None:
+        content = renderer.render(render())
+        if tile_key:
+            etag = tile_cache.set_tile(tile_key, content)
+        else:
+            etag = tile_cache.make_etag(content)
+    else:
+        etag, content = cached
+
+    if tile_cache.etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type=renderer.media_type)
+    response['ETag'] = etag
+    return response
 
 
 class CutoutTile(APIView):
@@ -34,7 +78,7 @@ class CutoutTile(APIView):
 
     * Requires authentication.
     """
-    renderer_classes = (PNGRenderer, JPEGRenderer)
+    renderer_classes = IMAGE_RENDERERS
 
     def __init__(self):
         super().__init__()
@@ -115,8 +159,7 @@ class CutoutTile(APIView):
             {'Name': 'Stack', 'Value': boss_config['system']['fqdn']},
         ]
 
-        session = bossutils.aws.get_session()
-        client = session.client('cloudwatch')
+        client = metrics.get_client()
         client.put_metric_data(
             Namespace = "BOSS/Image",
             MetricData = [{
@@ -132,31 +175,33 @@ class CutoutTile(APIView):
             }]
         )
 
-        # Get interface to SPDB cache
-        cache = spdb.spatialdb.SpatialDB(settings.KVIO_SETTINGS,
-                                         settings.STATEIO_CONFIG,
-                                         settings.OBJECTIO_CONFIG)
-
         # Get the params to pull data out of the cache
         corner = (req.get_x_start(), req.get_y_start(), req.get_z_start())
         extent = (req.get_x_span(), req.get_y_span(), req.get_z_span())
+        time_range = [req.get_time().start, req.get_time().stop]
 
-        # Do a cutout as specified
-        data = cache.cutout(resource, corner, extent, req.get_resolution(),
-                            [req.get_time().start, req.get_time().stop], access_mode=access_mode)
-
-        # Covert the cutout back to an image and return it
-        if orientation == 'xy':
-            img = data.xy_image()
-        elif orientation == 'yz':
-            img = data.yz_image()
-        elif orientation == 'xz':
-            img = data.xz_image()
-        else:
-            return BossHTTPError("Invalid orientation: {}".format(orientation),
-                                 ErrorCodes.INVALID_CUTOUT_ARGS)
+        # Only tiles read through the cache are kept in the rendered tile cache
+        tile_key = None
+        if access_mode == "cache":
+            tile_key = tile_cache.get_tile_key(resource.get_lookup_key(), req.get_resolution(), orientation,
+                                               corner, extent, time_range, request.accepted_renderer.format)
 
-        return Response(img)
+        def render():
+            # Get interface to SPDB cache
+            cache = invalidation.create_spatialdb()
+
+            # Do a cutout as specified
+            data = cache.cutout(resource, corner, extent, req.get_resolution(), time_range, access_mode=access_mode)
+
+            # Covert the cutout back to an image
+            if orientation == 'xy':
+                return data.xy_image()
+            elif orientation == 'yz':
+                return data.yz_image()
+            else:
+                return data.xz_image()
+
+        return tile_response(request, tile_key, render)
 
 
 class Tile(APIView):
@@ -165,7 +210,7 @@ class Tile(APIView):
 
     * Requires authentication.
     """
-    renderer_classes = (PNGRenderer, JPEGRenderer)
+    renderer_classes = IMAGE_RENDERERS
 
     def __init__(self):
         super().__init__()
@@ -248,8 +293,7 @@ class Tile(APIView):
             {'Name': 'Stack', 'Value': boss_config['system']['fqdn']},
         ]
 
-        session = bossutils.aws.get_session()
-        client = session.client('cloudwatch')
+        client = metrics.get_client()
         client.put_metric_data(
             Namespace = "BOSS/Tile",
             MetricData = [{
@@ -265,28 +309,314 @@ class Tile(APIView):
             }]
         )
 
-        # Get interface to SPDB cache
-        cache = spdb.spatialdb.SpatialDB(settings.KVIO_SETTINGS,
-                                         settings.STATEIO_CONFIG,
-                                         settings.OBJECTIO_CONFIG)
-
         # Get the params to pull data out of the cache
         corner = (req.get_x_start(), req.get_y_start(), req.get_z_start())
         extent = (req.get_x_span(), req.get_y_span(), req.get_z_span())
+        time_range = [req.get_time().start, req.get_time().stop]
 
-        # Do a cutout as specified
-        data = cache.cutout(resource, corner, extent, req.get_resolution(),
-                            [req.get_time().start, req.get_time().stop], access_mode=access_mode)
-
-        # Covert the cutout back to an image and return it
-        if orientation == 'xy':
-            img = data.xy_image()
-        elif orientation == 'yz':
-            img = data.yz_image()
-        elif orientation == 'xz':
-            img = data.xz_image()
-        else:
-            return BossHTTPError("Invalid orientation: {}".format(orientation),
-                                 ErrorCodes.INVALID_CUTOUT_ARGS)
+        # Only tiles read through the cache are kept in the rendered tile cache
+        tile_key = None
+        if access_mode == "cache":
+            tile_key = tile_cache.get_tile_key(resource.get_lookup_key(), req.get_resolution(), orientation,
+                                               corner, extent, time_range, request.accepted_renderer.format)
+
+        def render():
+            # Get interface to SPDB cache
+            cache = invalidation.create_spatialdb()
+
+            # Do a cutout as specified
+            data = cache.cutout(resource, corner, extent, req.get_resolution(), time_range, access_mode=access_mode)
+
+            # Covert the cutout back to an image
+            if orientation == 'xy':
+                return data.xy_image()
+            elif orientation == 'yz':
+                return data.yz_image()
+            else:
+                return data.xz_image()
+
+        return tile_response(request, tile_key, render)
+
+
+class TileBatch(APIView):
+    """
+    View to handle requests for many tiles at once
+
+    Tiles in the same cuboid aligned block are served by a single cutout and the encoded tiles are returned as a
+    length prefixed bundle (see bosstiles.batch)
+
+    * Requires authentication.
+    """
+    renderer_classes = (TileBundleRenderer,)
+
+    def post(self, request, collection, experiment, channel, tile_size):
+        """
+        View to handle POST requests for a batch of tiles
+
+        The request body is a JSON object with:
+            tiles: List of [orientation, resolution, x_idx, y_idx, z_idx]
+            range: Optional range of tiles {orientation, resolution, x: [start, stop], y: [...], z: [...]}
+            format: Optional image format of the tiles (png, jpeg, or webp if supported, default png)
+            time: Optional time sample of the tiles (default is the channel's default time sample)
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param collection: Unique Collection identifier, indicating which collection you want to access
+        :param experiment: Experiment identifier, indicating which experiment you want to access
+        :param channel: Channel identifier, indicating which channel you want to access
+        :param tile_size: Width and height of the tiles in pixels
+        :return:
+        """
+        try:
+            tiles = batch.parse_tiles(request.data, settings.TILE_BATCH_MAX_TILES)
+            tile_size = int(tile_size)
+            encoder = TILE_ENCODERS[request.data.get('format', 'png')]
+            time = request.data.get('time')
+            time_args = None if time is None else str(int(time))
+        except (ValueError, TypeError, KeyError, AttributeError) as err:
+            return BossHTTPError("Invalid batch tile request: {}".format(err), ErrorCodes.INVALID_ARGUMENT)
+
+        # Validate the bounding box of the tiles at each resolution, normally a single BossRequest
+        boxes = {}
+        for orientation, resolution, x_idx, y_idx, z_idx in tiles:
+            boxes.setdefault(resolution, []).append(batch.tile_box(orientation, tile_size, x_idx, y_idx, z_idx))
+
+        try:
+            for resolution, res_boxes in boxes.items():
+                corner, extent = batch.bounding_box(res_boxes)
+                request_args = {
+                    "service": "cutout",
+                    "method": "GET",
+                    "collection_name": collection,
+                    "experiment_name": experiment,
+                    "channel_name": channel,
+                    "resolution": resolution,
+                    "x_args": "{}:{}".format(corner[0], corner[0] + extent[0]),
+                    "y_args": "{}:{}".format(corner[1], corner[1] + extent[1]),
+                    "z_args": "{}:{}".format(corner[2], corner[2] + extent[2]),
+                    "time_args": time_args
+                }
+                req = BossRequest(request, request_args)
+        except BossError as err:
+            return err.to_http()
+
+        #Define access_mode
+        access_mode = utils.get_access_mode(request)
+
+        # Convert to Resource
+        resource = spdb.project.BossResourceDjango(req)
+
+        # Get bit depth
+        try:
+            self.bit_depth = resource.get_bit_depth()
+        except ValueError:
+            return BossHTTPError("Datatype does not match channel", ErrorCodes.DATATYPE_DOES_NOT_MATCH)
+
+        time_range = [req.get_time().start, req.get_time().stop]
+
+        # Calculating the number of bytes
+        cost = sum(e[0] * e[1] * e[2] for res_boxes in boxes.values() for _, e in res_boxes) \
+               * (time_range[1] - time_range[0]) * self.bit_depth / 8
+        if cost > settings.CUTOUT_MAX_SIZE:
+            return BossHTTPError("Batch tile request is over 1GB when uncompressed. Request fewer tiles.",
+                                 ErrorCodes.REQUEST_TOO_LARGE)
+
+        BossThrottle().check('tile_egress',
+                             request.user,
+                             cost)
+
+        boss_config = bossutils.configuration.BossConfig()
+        dimensions = [
+            {'Name': 'User', 'Value': request.user.username},
+            {'Name': 'Resource', 'Value': '{}/{}/{}'.format(collection,
+                                                            experiment,
+                                                            channel)},
+            {'Name': 'Stack', 'Value': boss_config['system']['fqdn']},
+        ]
+
+        client = metrics.get_client()
+        client.put_metric_data(
+            Namespace = "BOSS/Tile",
+            MetricData = [{
+                'MetricName': 'InvokeCount',
+                'Dimensions': dimensions,
+                'Value': 1.0,
+                'Unit': 'Count'
+            }, {
+                'MetricName': 'EgressCost',
+                'Dimensions': dimensions,
+                'Value': cost,
+                'Unit': 'Bytes'
+            }]
+        )
+
+        images = [None] * len(tiles)
+        groups = batch.group_tiles(tiles, tile_size, lambda res: CUBOIDSIZE[res])
+
+        def render_group(key, members):
+            resolution, orientation = key[:2]
+            corner, extent = batch.bounding_box([(c, e) for _, c, e in members])
+            data = sharded.get_spatialdb().cutout(resource, corner, extent, resolution, time_range,
+                                                  access_mode=access_mode).data
+
+            for i, tile_corner, tile_extent in members:
+                x = tile_corner[0] - corner[0]
+                y = tile_corner[1] - corner[1]
+                z = tile_corner[2] - corner[2]
+                cube = Cube.create_cube(resource, list(tile_extent), time_range)
+                cube.data = np.ascontiguousarray(data[:, z:z + tile_extent[2],
+                                                      y:y + tile_extent[1],
+                                                      x:x + tile_extent[0]])
+                img = getattr(cube, orientation + '_image')()
+                images[i] = encoder().render(img)
+
+        executor = sharded.get_executor()
+        for future in [executor.submit(render_group, key, members) for key, members in groups.items()]:
+            # Re-raises any exception from the worker thread
+            future.result()
+
+        return Response(batch.encode_bundle(images))
+
+
+class TilePrerender(APIView):
+    """
+    View to pre-render a channel's XY tile pyramid into the rendered tile cache
+
+    * Requires authentication. Starting and cancelling jobs requires admin permissions.
+    """
+    renderer_classes = (JSONRenderer,)
+
+    def get_resource(self, request, collection, experiment, channel):
+        """Validate the request and get the channel's resource
+
+        Returns:
+            (BossResourceDjango)
+
+        Raises:
+            BossError: If the request is invalid
+        """
+        request_args = {
+            "service": "downsample",
+            "collection_name": collection,
+            "experiment_name": experiment,
+            "channel_name": channel,
+            # Jobs only read the channel's data
+            "method": "GET"
+        }
+        req = BossRequest(request, request_args)
+        return spdb.project.BossResourceDjango(req)
+
+    def get(self, request, collection, experiment, channel, tile_size):
+        """
+        View to get the progress of the channel's pre-render job for the tile size
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param collection: Unique Collection identifier, indicating which collection you want to access
+        :param experiment: Experiment identifier, indicating which experiment you want to access
+        :param channel: Channel identifier, indicating which channel you want to access
+        :param tile_size: Width and height of the tiles in pixels
+        :return:
+        """
+        try:
+            resource = self.get_resource(request, collection, experiment, channel)
+        except BossError as err:
+            return err.to_http()
+
+        state = prerender.get_state(prerender.get_state_key(resource.get_lookup_key(), int(tile_size)))
+        if state is None:
+            return BossHTTPError("No tiles have been pre-rendered for this channel and tile size",
+                                 ErrorCodes.RESOURCE_NOT_FOUND)
+
+        return Response(self.to_renderer(state))
+
+    def post(self, request, collection, experiment, channel, tile_size):
+        """
+        View to start, or resume, pre-rendering the channel's tiles
+
+        The optional request body is a JSON object with:
+            resolutions: Resolutions to pre-render (default all)
+            formats: Image formats to render each tile in (default ["png"])
+            restart: If an unfinished job should be started over instead of resumed (default false)
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param collection: Unique Collection identifier, indicating which collection you want to access
+        :param experiment: Experiment identifier, indicating which experiment you want to access
+        :param channel: Channel identifier, indicating which channel you want to access
+        :param tile_size: Width and height of the tiles in pixels
+        :return:
+        """
+        if not request.user.is_staff:
+            return BossHTTPError("Pre-rendering tiles requires admin permissions", ErrorCodes.MISSING_PERMISSION)
+
+        try:
+            resource = self.get_resource(request, collection, experiment, channel)
+        except BossError as err:
+            return err.to_http()
+
+        if resource.get_channel().downsample_status.upper() != "DOWNSAMPLED":
+            return BossHTTPError("Channel must be downsampled before tiles are pre-rendered",
+                                 ErrorCodes.INVALID_STATE)
+
+        try:
+            resolutions = request.data.get('resolutions',
+                                           list(range(resource.get_experiment().num_hierarchy_levels)))
+            resolutions = [int(res) for res in resolutions]
+            formats = [str(fmt) for fmt in request.data.get('formats', ['png'])]
+            restart = bool(request.data.get('restart', False))
+        except (TypeError, ValueError, AttributeError):
+            return BossHTTPError("Invalid pre-render arguments", ErrorCodes.INVALID_ARGUMENT)
+
+        try:
+            state = prerender.start(resource, int(tile_size), resolutions, formats, restart=restart)
+        except ValueError as err:
+            return BossHTTPError(str(err), ErrorCodes.INVALID_STATE)
+
+        threading.Thread(target=prerender.run, args=(state['key'],), daemon=True).start()
+
+        return Response(self.to_renderer(state), status=202)
+
+    def delete(self, request, collection, experiment, channel, tile_size):
+        """
+        View to cancel the channel's running pre-render job for the tile size
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param collection: Unique Collection identifier, indicating which collection you want to access
+        :param experiment: Experiment identifier, indicating which experiment you want to access
+        :param channel: Channel identifier, indicating which channel you want to access
+        :param tile_size: Width and height of the tiles in pixels
+        :return:
+        """
+        if not request.user.is_staff:
+            return BossHTTPError("Cancelling pre-rendering requires admin permissions", ErrorCodes.MISSING_PERMISSION)
+
+        try:
+            resource = self.get_resource(request, collection, experiment, channel)
+        except BossError as err:
+            return err.to_http()
 
-        return Response(img)
+        if not prerender.cancel(prerender.get_state_key(resource.get_lookup_key(), int(tile_size))):
+            return BossHTTPError("Tiles are not being pre-rendered for this channel and tile size",
+                                 ErrorCodes.INVALID_STATE)
+
+        return HttpResponse(status=204)
+
+    @staticmethod
+    def to_renderer(state):
+        """Get the public fields of a job's state"""
+        return {
+            'status': state['status'] if state['status'] != prerender.RUNNING or prerender.is_active(state)
+                      else prerender.FAILED,
+            'tile_size': state['tile_size'],
+            'resolutions': state['resolutions'],
+            'formats': state['formats'],
+            'resolution': state['resolutions'][state['resolution_index']]
+                          if state['resolution_index'] < len(state['resolutions']) else None,
+            'done': state['done'],
+            'total': state['total'],
+            'error': state['error'],
+            'started': state['started'],
+            'updated': state['updated'],
+        }